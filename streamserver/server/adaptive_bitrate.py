@@ -0,0 +1,171 @@
+import os
+import time
+from collections import deque
+
+# Encoding ladder, best first. Heights are upper bounds, smaller sources aren't upscaled.
+LADDER = [
+    {"name": "1080p", "height": 1080, "video_bitrate": 6000},
+    {"name": "720p", "height": 720, "video_bitrate": 4500},
+    {"name": "720p-low", "height": 720, "video_bitrate": 3000},
+    {"name": "480p", "height": 480, "video_bitrate": 1500},
+    {"name": "360p", "height": 360, "video_bitrate": 800},
+]
+
+# Channel config keys (all optional) and the attribute each one sets
+CONFIG_KEYS = {
+    "adaptive_min_speed": "min_speed",
+    "adaptive_max_queue": "max_queue",
+    "adaptive_down_seconds": "down_seconds",
+    "adaptive_up_seconds": "up_seconds",
+    "adaptive_up_seconds_max": "up_seconds_max",
+}
+
+def send_queue_bytes(pid):
+    """ Bytes sitting unsent in the kernel send queues of `pid`'s TCP sockets, None if it can't be read. """
+    inodes = set()
+    try:
+        for fd in os.listdir(f"/proc/{pid}/fd"):
+            try:
+                target = os.readlink(f"/proc/{pid}/fd/{fd}")
+            except OSError:
+                continue
+            if target.startswith("socket:["):
+                inodes.add(target[8:-1])
+    except OSError:
+        return None
+
+    queued = 0
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table, 'r') as file:
+                next(file)
+                for line in file:
+                    fields = line.split()
+                    if len(fields) > 9 and fields[9] in inodes:
+                        queued += int(fields[4].split(":")[0], 16)
+        except (OSError, StopIteration):
+            continue
+    return queued
+
+class BitrateController:
+    """
+    Steps a channel's encode down the ladder while its outputs are
+    congested and back up once the uplink has room again.
+
+    An output is congested when it can't keep real time, its socket send
+    queue keeps growing past `max_queue`, or it drops frames. Congestion has
+    to last `down_seconds` before stepping down; stepping up needs
+    `up_seconds` without any. A step up that runs straight back into
+    congestion doubles `up_seconds` (up to `up_seconds_max`), so a link that
+    can't hold the higher rung isn't retried every minute.
+    """
+
+    def __init__(self, ladder=LADDER):
+        self.ladder = ladder
+        self.min_speed = 0.97
+        self.max_queue = 256 * 1024
+        self.down_seconds = 10
+        self.up_seconds = 60
+        self.up_seconds_max = 600
+        self.settle_seconds = 15  # A restarted encoder needs a moment before it's judged
+
+        self.step = 0
+        self.up_wait = self.up_seconds
+        self.congested_since = None
+        self.clear_since = None
+        self.last_change = None
+        self.last_change_was_up = False
+        self.queues = {}
+        self.history = deque(maxlen=20)
+
+    def configure(self, config):
+        for key, attribute in CONFIG_KEYS.items():
+            if config.get(key) in (None, ""):
+                continue
+            try:
+                setattr(self, attribute, float(config[key]))
+            except (TypeError, ValueError):
+                print(f"Ignoring invalid {key}: {config[key]}")
+        self.up_wait = max(self.up_wait, self.up_seconds)
+
+    @property
+    def rung(self):
+        return self.ladder[self.step]
+
+    def restore(self, rung):
+        """ Carry on at `rung` (the one a pipeline kept across a node restart runs at) instead of the top. """
+        for step, candidate in enumerate(self.ladder):
+            if candidate["name"] == (rung or {}).get("name"):
+                self.step = step
+                self.last_change = time.monotonic()
+
+    def congestion(self, name, summary, queue):
+        """ Reasons output `name` looks congested, from its progress summary and send queue. """
+        reasons = []
+        if summary:
+            if summary["min_speed"] is not None and summary["min_speed"] < self.min_speed:
+                reasons.append(f"speed {summary['min_speed']}")
+            if summary["new_drop_frames"]:
+                reasons.append(f"{summary['new_drop_frames']} dropped frames")
+
+        previous = self.queues.get(name)
+        self.queues[name] = queue
+        if queue is not None and queue > self.max_queue and previous is not None and queue >= previous:
+            reasons.append(f"send queue {queue // 1024} KiB and growing")
+
+        return reasons
+
+    def observe(self, reasons, now=None):
+        """ Feed one tick of congestion reasons, returns the new step when it changes. """
+        now = now or time.monotonic()
+
+        if self.last_change is not None and now - self.last_change < self.settle_seconds:
+            return None
+
+        if reasons:
+            self.clear_since = None
+            self.congested_since = self.congested_since or now
+
+            if self.last_change_was_up and now - self.last_change < self.up_wait:
+                # The last step up didn't hold, be slower to try again
+                self.up_wait = min(self.up_seconds_max, self.up_wait * 2)
+                self.last_change_was_up = False
+
+            if now - self.congested_since >= self.down_seconds and self.step < len(self.ladder) - 1:
+                return self.change(self.step + 1, now, reasons)
+        else:
+            self.congested_since = None
+            self.clear_since = self.clear_since or now
+
+            if now - self.clear_since >= self.up_wait and self.step > 0:
+                return self.change(self.step - 1, now, [f"no congestion for {int(now - self.clear_since)}s"])
+
+            if self.last_change is not None and now - self.last_change >= self.up_seconds_max:
+                # Long stretch without trouble, forget earlier failed step ups
+                self.up_wait = self.up_seconds
+
+        return None
+
+    def change(self, step, now, reasons):
+        up = step < self.step
+        self.history.append({
+            "time": time.time(),
+            "from": self.rung["name"],
+            "to": self.ladder[step]["name"],
+            "reasons": reasons,
+        })
+        self.step = step
+        self.last_change = now
+        self.last_change_was_up = up
+        self.congested_since = None
+        self.clear_since = None
+        return step
+
+    def status(self):
+        return {
+            "rung": self.rung,
+            "step": self.step,
+            "up_wait": self.up_wait,
+            "congested_for": round(time.monotonic() - self.congested_since, 1) if self.congested_since else 0,
+            "history": list(self.history),
+        }
@@ -1,21 +1,38 @@
 from fastapi import FastAPI, HTTPException, Request, status, Form
 from pydantic import BaseModel
-from subprocess import Popen, PIPE
 import os
 from dotenv import load_dotenv
 import asyncio
 import signal
 import httpx  # to send async HTTP requests
 import os.path
-import psutil
 from datetime import datetime
-import subprocess
 import json
-import yt_dlp  # This is the module for downloading videos
 import aiohttp
 from datetime import datetime, timedelta
 import logging
-from typing import List, Dict
+import time
+import re
+import hashlib
+from typing import List, Dict, Optional
+from hls_monitor import HLSMonitor
+from supervisor import ProcessSupervisor
+from telemetry import FFMPEG, ProgressTracker, RateLimitedLog
+from restart_policy import INPUT_STALE, BAD_CONTENT
+from metrics import MetricsSampler
+from control_channel import ControlChannel
+from status_reporter import StatusReporter
+from downloads import DownloadManager
+from backup_ingest import BackupIngest
+from planner import StreamPlanner, Plan
+from content_health import ContentAnalyzer
+from delay_buffer import DelayBuffer
+from adaptive_bitrate import send_queue_bytes
+from config_changes import LIVE, RESTART, classify, live_commands, retune_plan
+from config_changes import noise_reduction, loudness_target, pipeline_settings
+from lifecycle import START, STOP, RETUNE, SYNC, RECONNECT, PARTIAL, STOPPED, STREAMING, SKIPPED
+from channels import Channel, DEFAULT_CHANNEL, NODE_KEYS, FEEDER_PIPELINE, RESERVED_DESTINATIONS, SOURCES
+from channels import channel_defaults, migrate_config, new_channel_config
 
 # Initialize logging
 logging.basicConfig(level=logging.INFO)
@@ -32,6 +49,9 @@ class StreamData(BaseModel):
     identifier: str  # stream1, stream2, or mp4
     url: str
 
+class VideoSelectRequest(BaseModel):
+    video_id: str
+
 class ConfigPair(BaseModel):
     configKey: str
     configValue: str
@@ -39,6 +59,16 @@ class ConfigPair(BaseModel):
 class ConfigRequest(BaseModel):
     config: List[ConfigPair]
 
+class DestinationRequest(BaseModel):
+    name: str
+    url: str  # rtmp:// or rtmps://
+    enabled: bool = True
+
+class ChannelRequest(BaseModel):
+    name: str
+    stream_key: Optional[str] = None
+    youtube_key: str = ""
+
 # Application version
 __version__ = "1.0.0"
 
@@ -96,23 +126,20 @@ def load_config():
             if not "server_host" in j:
                 j["server_host"] = server_host
 
-            if not "youtube_key" in j:
-                j["youtube_key"] = youtube_key
+            # Single-stream config from before channels, migrated below
+            if not "channels" in j:
+                if not "youtube_key" in j:
+                    j["youtube_key"] = youtube_key
 
-            if not "stream_key" in j:
-                j["stream_key"] = stream_key
+                if not "stream_key" in j:
+                    j["stream_key"] = stream_key
 
             return j
     except:
         return {
-            "stream1_url": f"rtmp://localhost:8453/live/{stream_key}",
-            "stream2_url": os.getenv("STREAM2_URL"),
-            "mp4_url": os.getenv("MP4_URL", "/backup.mp4"),
-            "active_source": "stream1",
             "server_uuid": server_uuid,
             "server_host": server_host,
-            "stream_key": stream_key,
-            "youtube_key": youtube_key
+            "channels": {DEFAULT_CHANNEL: channel_defaults(stream_key, youtube_key)}
         }
 
 def save_config(config):
@@ -120,30 +147,146 @@ def save_config(config):
         json.dump(config, file)
 
 config = load_config()
+if migrate_config(config):
+    save_config(config)
 
 print("Config", config)
 
-# Global variables to manage the stream
-ffmpeg_process = None
-failure_count = 0
+# Global variables to manage the streams
+supervisor = ProcessSupervisor(state_file=os.getenv("PIPELINE_STATE_FILE", "pipeline_state.json"))
+progress_trackers: Dict[str, ProgressTracker] = {}
 FAILURE_THRESHOLD = 3  # Number of allowed consecutive failures
 
+# Every restream channel hosted on this node, by name
+channels: Dict[str, Channel] = {name: Channel(name, channel_config) for name, channel_config in config["channels"].items()}
+CHANNEL_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Local ingest liveness, read straight from nginx's hls_path
+hls_monitor = HLSMonitor()
+
+# Black, frozen and silent ingest detection, one segment at a time
+content_analyzer = ContentAnalyzer(hls_monitor)
+content_analyzer.configure(config)
+
+# Host and per-pipeline resource usage, sampled once a second off the event loop
+metrics_sampler = MetricsSampler(supervisor.pids)
+
+# Full snapshot then deltas, more often while streaming or failing over
+status_reporter = StatusReporter()
+status_wakeup = asyncio.Event()
+
+# Backup video downloads, run off the event loop and cached by video ID
+download_manager = DownloadManager()
+
+# Stream-ready (copy-only) versions of the backup videos
+backup_ingest = BackupIngest()
+
+# Probes inputs (cached) and picks copy, audio-only transcode or a full re-encode
+stream_planner = StreamPlanner()
+pipeline_plans: Dict[str, Plan] = {}
+
+def load_node_secret():
+    """ Provisioned at deploy, authenticates the control channel. """
+    if os.path.isfile("/flowrecaster_node_secret.txt"):
+        with open("/flowrecaster_node_secret.txt", 'r') as file:
+            return file.read().strip()
+    return os.getenv("NODE_SECRET", "")
+
+def control_channel_url():
+    host = config["server_host"]
+    if host.startswith("https://"):
+        host = "wss://" + host[len("https://"):]
+    elif host.startswith("http://"):
+        host = "ws://" + host[len("http://"):]
+    return f'{host}/api/v1/ws/node/{config["server_uuid"]}'
+
+# One persistent connection to the webserver for status, events and commands.
+# The HTTP client is only the fallback for when the channel is down.
+control_channel = ControlChannel(control_channel_url(), headers={"Authorization": f"Bearer {load_node_secret()}"})
+http_client = httpx.AsyncClient(timeout=10)
+
+def get_channel(name):
+    channel = channels.get(name)
+    if not channel:
+        raise HTTPException(status_code=404, detail=f"Unknown channel {name}")
+    return channel
+
+def watch_channel_sources(channel):
+    for source in ["stream1", "stream2"]:
+        stream_key = hls_monitor.stream_key_for_url(channel.source_url(source))
+        if stream_key:
+            hls_monitor.watch(stream_key)
+
+async def start_channel(channel):
+    """ Bring a channel up: watch its ingest, resume its stream and start its health loop. """
+    watch_channel_sources(channel)
+
+    if channel.config.get("mp4_url") and os.path.isfile(channel.config["mp4_url"]):
+        backup_ingest.ensure(channel.config["mp4_url"])
+
+    if not channel.should_be_streaming:
+        # Left running by the last run of the node, but nobody wants it any more
+        await stop_channel_pipelines(channel)
+
+    # Feeders started from now on have to continue the timeline the adopted outputs are on
+    clocks = [supervisor.get(name).meta.get("relay_clock") for name in channel.pipelines() if supervisor.get(name)]
+    channel.relay_clock = next((clock for clock in clocks if clock), channel.relay_clock)
+
+    channel.lifecycle.start(lambda command: run_command(channel, command), streaming=channel_started(channel))
+    if channel.should_be_streaming:
+        # Keeps the pipelines adopted from the last run when they still run what we would start now
+        channel.lifecycle.submit(START, "resume")
+
+    channel.task = asyncio.create_task(check_stream(channel))
+
+def channel_started(channel):
+    return any(supervisor.get(name) for name in channel.pipelines())
+
+async def stop_channel_pipelines(channel, keep=()):
+    """ Stop every pipeline of `channel`, including outputs of destinations that were removed, except `keep`. """
+    for name in [name for name in supervisor.pipelines if name.startswith(channel.name + ":")]:
+        if name not in keep:
+            await supervisor.stop(name)
+            pipeline_plans.pop(name, None)
+
+    if not keep:
+        # Nothing reads the relay any more, the next outputs start a new timeline
+        channel.relay_clock = None
+
 @app.on_event("startup")
 async def startup_event():
-    global config
-    if "should_be_streaming" in config and config["should_be_streaming"]:
-        source_url = config[config["active_source"] + "_url"]
-        await start_youtube_stream_directly(source_url)
+    metrics_sampler.start()
 
-    asyncio.create_task(check_stream())
+    for name in supervisor.recover():
+        if name.split(":")[0] not in channels:
+            await supervisor.stop(name)
+
+    for channel in channels.values():
+        asyncio.create_task(start_channel(channel))
+
+    asyncio.create_task(hls_monitor.run())
+    asyncio.create_task(content_analyzer.run())
     asyncio.create_task(report_system_status())
-    asyncio.create_task(restart_stream_every_30_minutes())
-    await notify_server_online()
+    control_channel.on_connect(notify_server_online)
+    control_channel.on_connect(resync_status)
+    asyncio.create_task(control_channel.run())
+    asyncio.create_task(announce_online())
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    if ffmpeg_process:
-        ffmpeg_process.terminate()
+    metrics_sampler.stop()
+    # Pipelines outlive the node (KillMode=process), the next run adopts them
+    supervisor.detach_all()
+    await http_client.aclose()
+
+async def resync_status():
+    status_reporter.reset()
+    request_status_report()
+
+async def announce_online():
+    """ The control channel announces us when it connects, fall back to HTTP if it doesn't. """
+    if not await control_channel.wait_connected(5):
+        await notify_server_online()
 
 async def notify_server_online():
     """ Notify the central server that this node is online. """
@@ -151,107 +294,220 @@ async def notify_server_online():
         "server_uuid": config["server_uuid"]
     }
 
-    async with httpx.AsyncClient() as client:
+    if control_channel.is_connected():
         try:
-            response = await client.post(f'{config["server_host"]}/api/v1/streamservers/server_online', json=payload)
-            response.raise_for_status()  # Will raise an exception for 4XX/5XX responses
-        except httpx.HTTPError as e:
-            print(f"Failed to notify server: {e}")
+            await control_channel.request("server_online", payload)
+            return
+        except Exception as e:
+            print(f"Failed to notify server over the control channel: {e}")
 
-async def restart_stream_every_30_minutes():
-    global ffmpeg_process, config
-    last_known_source = config['active_source']  # Track the last known active source
+    try:
+        response = await http_client.post(f'{config["server_host"]}/api/v1/streamservers/server_online', json=payload)
+        response.raise_for_status()  # Will raise an exception for 4XX/5XX responses
+    except httpx.HTTPError as e:
+        print(f"Failed to notify server: {e}")
+
+def pipeline_health_cause(channel):
+    """ Why the channel's source pipeline needs a restart, or None if it is healthy. """
+    name = channel.source_pipeline()
+    return channel.restart_policy.check(supervisor.get(name), progress_trackers.get(name))
+
+def check_destinations(channel):
+    """ Reconnect failed relay outputs, without touching the feeder or the other destinations. """
+    failed = []
+    for destination in channel.destinations():
+        name = channel.pipeline(destination["name"])
+        policy = channel.destination_policy(destination["name"])
+        cause = policy.check(supervisor.get(name), progress_trackers.get(name))
+
+        if not cause:
+            policy.healthy(supervisor.get(name).uptime)
+        elif policy.allow_restart():
+            print(f"Reconnecting {name}, output is {cause}")
+            policy.record_restart(cause)
+            failed.append(destination["name"])
+
+    if failed:
+        # Through the lifecycle like every other change, so it can't race a start or sync
+        channel.lifecycle.submit(RECONNECT, "outputs failed", automatic=True, keys=failed)
+
+async def source_live(channel, source):
+    url = channel.source_url(source)
+    if not url:
+        return False
+    if source == "mp4":
+        return os.path.isfile(url)
 
-    while True:
-        await asyncio.sleep(60*30)  # Non-blocking wait
+    try:
+        live = await is_source_live(url)
+    except Exception as e:
+        print(f"failed to see if {url} was live", e)
+        return False
 
-        if ffmpeg_process:
-            current_source = config['active_source']
-            current_url = config[f'{current_source}_url']
-            await start_youtube_stream_directly(current_url)
+    # Segments arriving isn't enough, there has to be something in them
+    problems = content_problems(url)
+    if live and problems:
+        print(f"{channel.name} {source} is live but {', '.join(problems)}")
+        return False
+    return live
+
+def content_problems(url):
+    stream_key = hls_monitor.stream_key_for_url(url)
+    return content_analyzer.problems(stream_key) if stream_key else []
+
+async def probe_sources(channel):
+    """ Probe every source in the channel's failover chain at once. """
+    sources = list(channel.failover.order)
+    results = await asyncio.gather(*(source_live(channel, source) for source in sources))
+    channel.failover.update(dict(zip(sources, results)))
+    channel.failure_count = channel.failover.failures(channel.config["active_source"])
+
+    # Keep the plan probe of every live input fresh, so switching to one never waits for it
+    for source, live in zip(sources, results):
+        if live and source != "mp4":
+            stream_planner.refresh(channel.source_url(source))
+
+def check_plan(channel):
+    """ A source that started before its probe was in runs on the safe plan, restart it if the probe says that isn't enough. """
+    name = channel.source_pipeline()
+    plan = pipeline_plans.get(name)
+    if not plan or plan.video != "copy" or plan.reasons != ["input not probed"]:
+        return
+
+    probe = stream_planner.cached(channel.source_url())
+    if probe is None:
+        return
+
+    probed = stream_planner.plan(probe, noise_reduction_amount(channel, channel.source_url()),
+                                 loudness_target(channel.config.get("loudness_target")))
+    if probed.video == "encode":
+        channel.lifecycle.submit(START, "probe needs a video encode", automatic=True)
+    else:
+        # The copy was right, stop checking
+        plan.reasons = ["input probed after start"]
 
-async def check_stream():
-    global ffmpeg_process, config, failure_count
-    last_known_source = config['active_source']  # Track the last known active source
+async def follow_failover_chain(channel):
+    """ Move to the best healthy source: straight down when the active one fails, back up once a better one is stable. """
+    active = channel.config["active_source"]
+    target = channel.failover.decide(active)
+    if not target:
+        return
+
+    falling = not channel.failover.is_healthy(active)
+
+    if falling and channel.delay_buffer and not channel.delay_buffer.running_dry():
+        # The source may well be back before viewers notice anything
+        print(f"{channel.name} {active} is down, playing out the delay buffer ({channel.delay_buffer.fill:.0f}s left)")
+        return
+
+    print(f"{channel.name} switching from {active} to {target}", "(failover)" if falling else "(recovered)")
+
+    channel.config["active_source"] = target
+    save_config(config)
+    channel.failover.switched()
+
+    if falling:
+        channel.restart_policy.record_restart(BAD_CONTENT if content_problems(channel.source_url(active)) else INPUT_STALE)
+
+    channel.lifecycle.submit(START, f"failover to {target}" if falling else f"recovered to {target}", automatic=True)
+
+    if falling:
+        await report_failure(channel)
+
+async def check_bitrate(channel):
+    """ Move the channel's encode along the bitrate ladder when its outputs congest or recover. """
+    outputs = channel.output_pipelines() if channel.uses_relay() else channel.pipelines()
+    reasons = []
+
+    for name in outputs:
+        pipeline = supervisor.get(name)
+        if not pipeline or not pipeline.is_running():
+            continue
+        summary = progress_trackers[name].summary(10) if name in progress_trackers else None
+        reasons += [f"{name} {reason}" for reason in channel.bitrate.congestion(name, summary, send_queue_bytes(pipeline.pid))]
+
+    if channel.bitrate.observe(reasons) is None:
+        return
+
+    step = channel.bitrate.history[-1]
+    print(f"{channel.name} bitrate {step['from']} -> {step['to']}:", ", ".join(step["reasons"]))
+    await report_bitrate_step(channel, step)
+
+    # Only the encoder restarts, relay outputs stay connected
+    channel.lifecycle.submit(START, f"bitrate {step['to']}", automatic=True)
+
+async def report_bitrate_step(channel, step):
+    request_status_report()
+    await control_channel.event("bitrate_step", {"channel": channel.name, "rung": channel.bitrate.rung, **step})
+
+async def check_stream(channel):
+    start_attempts = 0
 
     while True:
         await asyncio.sleep(3)  # Non-blocking wait
 
-        current_source = config['active_source']
-        current_url = config[f'{current_source}_url']
-        
-        if ffmpeg_process:
-            if not await find_ffmpeg_processes():
-                failure_count += 1
+        await probe_sources(channel)
+        current_url = channel.source_url()
 
-                if failure_count >= FAILURE_THRESHOLD:
-                    await start_youtube_stream_directly(current_url)
-                    failure_count = 0
+        if channel.delay_buffer:
+            channel.delay_buffer.update()
+
+        if channel.lifecycle.busy:
+            # Pipelines are being changed, judge them once that's done
+            continue
+
+        if channel_started(channel):
+            start_attempts = 0
+            cause = pipeline_health_cause(channel)
+
+            if cause:
+                if channel.restart_policy.allow_restart():
+                    print(f"Restarting channel {channel.name}, pipeline is {cause}")
+                    channel.restart_policy.record_restart(cause)
+                    stream_planner.invalidate(current_url)  # The input may have changed under us
+                    channel.lifecycle.submit(START, f"pipeline {cause}", automatic=True)
 
                 continue
 
-            if current_source != 'mp4':
-                try:
-                    stream_live = await is_hls_stream_live(convert_url_rtmp_to_hls(current_url))
-                except Exception as e:
-                    print("failed to see if URL was live")
-                    stream_live = False
-
-                if not stream_live:
-                    print(f"{current_source} failure detected.")
-                    failure_count += 1
-                    if failure_count >= FAILURE_THRESHOLD:
-                        print(f"{current_source} failure detected for too long. Switching to MP4.")
-                        await switch_to_backup_stream()
-                        await report_failure()
-                        
-                        # Check if the stream comes back online
-                        while not await is_hls_stream_live(convert_url_rtmp_to_hls(current_url)):
-                            print ("Stream is still not live yet")
-                            await asyncio.sleep(5)
-                            # Check if the active source has been changed externally
-                            if config['active_source'] != last_known_source:
-                                print(f"Active source changed externally from {last_known_source} to {config['active_source']}")
-                                break  # Break the inner loop to continue with the main loop
-                                
-                        if config['active_source'] == last_known_source:
-                            # If the loop exits naturally, the original stream is back
-                            print(f"{current_source} is back online, switching back from backup mp4")
-                            await switch_to_original_stream(current_source)
-                            failure_count = 0  # Reset failure count after recovery
-
-                else:
-                    failure_count = 0  # Reset failure count if stream is active
-
-            # Update last known source for the next iteration
-            last_known_source = config['active_source']
-        elif "should_be_streaming" in config and config["should_be_streaming"]:
-            failure_count += 1
-            if failure_count >= FAILURE_THRESHOLD:
-                await start_youtube_stream_directly(current_url)
-                failure_count = 0
-
-async def switch_to_backup_stream():
-    await start_youtube_stream_directly(config['mp4_url'])
-
-async def switch_to_original_stream(original_stream):
-    global config
-    config['active_source'] = original_stream
-    save_config(config)
-    await start_youtube_stream_directly(config[f'{original_stream}_url'])
+            channel.restart_policy.healthy(supervisor.get(channel.source_pipeline()).uptime)
 
-async def report_failure():
-    print("Report Failure")
-    async with httpx.AsyncClient() as client:
-        await client.post(f'{config["server_host"]}/api/v1/report_failure', json={"stream_url": os.getenv("STREAM1_URL"), "failure_count": failure_count})
+            if channel.uses_relay():
+                check_destinations(channel)
 
-def is_file_recent(filepath, max_age_seconds):
-    """Check if the file was modified within the last `max_age_seconds` seconds."""
-    if not os.path.exists(filepath):
-        return False
-    file_mod_time = os.path.getmtime(filepath)
-    current_time = time.time()
-    return (current_time - file_mod_time) < max_age_seconds
+            if channel.adaptive_bitrate:
+                await check_bitrate(channel)
+
+            check_plan(channel)
+
+            await follow_failover_chain(channel)
+        elif channel.should_be_streaming:
+            start_attempts += 1
+            if start_attempts >= FAILURE_THRESHOLD:
+                channel.lifecycle.submit(START, "not running", automatic=True)
+                start_attempts = 0
+
+async def report_failure(channel):
+    print("Report Failure", channel.name)
+    payload = {"channel": channel.name, "stream_url": channel.source_url(), "failure_count": channel.failure_count}
+
+    request_status_report()
+
+    if not await control_channel.event("report_failure", payload):
+        try:
+            await http_client.post(f'{config["server_host"]}/api/v1/report_failure', json=payload)
+        except httpx.HTTPError as e:
+            print(f"Failed to report failure: {e}")
+
+async def is_source_live(url):
+    """
+    Check if a source is live. Streams ingested by this node are answered from
+    the cached playlist state, anything else falls back to asking over HTTP.
+    """
+    stream_key = hls_monitor.stream_key_for_url(url)
+    if stream_key:
+        return hls_monitor.is_live(stream_key)
+
+    return await is_hls_stream_live(convert_url_rtmp_to_hls(url))
 
 async def is_hls_stream_live(url, max_age_seconds=10):
     print("Checking URL:", url)
@@ -308,72 +564,103 @@ def convert_url_rtmp_to_hls(rtmp_url):
     hls_url = f"{protocol}{host}/streams/hls/{stream_id}.m3u8"
     return hls_url
 
-async def report_system_status():
-    global config
-    global ffmpeg_process
+def channel_failing(channel):
+    if channel.failure_count > 0 or channel.restart_policy.recently_restarted(60):
+        return True
+    return channel.should_be_streaming and not stream_pipelines_running(channel)
+
+def stream_failing():
+    """ True while any channel is failing over or recovering, so status goes out more often. """
+    return any(channel_failing(channel) for channel in channels.values())
+
+def request_status_report():
+    """ Wake the status reporter now instead of at the next interval. """
+    status_wakeup.set()
+
+async def channel_status(channel, pipeline_resources):
+    # Answered from the health loop's last probe of each source
+    stream1_live = channel.failover.is_live("stream1")
+    stream2_live = channel.failover.is_live("stream2")
+
+    return {
+        "selected_source": channel.config["active_source"],
+        "switch_mode": channel.config.get("switch_mode", "direct"),
+        "stream_key": channel.stream_key,
+        "youtube_key": channel.config.get("youtube_key", ""),
+        "ffmpeg_alive": stream_pipelines_running(channel) or False,
+        "stream1_live": stream1_live,
+        "stream2_live": stream2_live,
+        "stream1_url": channel.config.get('stream1_url') or "",
+        "stream2_url": channel.config.get('stream2_url') or "",
+        "noise_reduction": channel.config.get("noise_reduction", "0"),
+        "restart_policy": channel.restart_policy.status(),
+        "failover": channel.failover.status(),
+        "delay_buffer": channel.delay_buffer.as_dict() if channel.delay_buffer else None,
+        "bitrate": channel.bitrate.status() if channel.adaptive_bitrate else None,
+        "pipeline_plans": {name: pipeline_plans[name].path for name in channel.pipelines() if name in pipeline_plans},
+        "cpu_usage": sum((pipeline_resources.get(name) or {}).get("cpu") or 0 for name in channel.pipelines()),
+        "destinations": {destination["name"]: destination_status(channel, destination) for destination in channel.destinations()},
+        "lifecycle": channel.lifecycle.status(),
+    }
 
-    net_start = datetime.now()
-    net_io = psutil.net_io_counters()
-    init_bytes_sent = net_io.bytes_sent
-    init_bytes_recv = net_io.bytes_recv
+async def report_system_status():
+    interval = status_reporter.idle_interval
+    last_report = time.monotonic()
 
     while True:
-        await asyncio.sleep(30)  # Report every minute
+        # Sleep until the next report is due, or until something asks for one early
+        try:
+            await asyncio.wait_for(status_wakeup.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+        status_wakeup.clear()
         print("Reporting System Status")
         
         try:
-            # Collect system metrics
-            cpu_usage = psutil.cpu_percent(interval=1)
-            ram_usage = psutil.virtual_memory().percent
-            net_io = psutil.net_io_counters()
-
-            net_now = datetime.now()
-            duration_seconds = (net_now - net_start).total_seconds()
-
-            bytes_sent = (net_io.bytes_sent - init_bytes_sent) / duration_seconds
-            bytes_recv = (net_io.bytes_recv - init_bytes_recv) / duration_seconds
-
-            init_bytes_sent = bytes_sent
-            init_bytes_recv = bytes_recv
-            net_start = net_now
-            
-            # Check FFmpeg stream status
-            ffmpeg_alive = ffmpeg_process and ffmpeg_process.returncode is None
+            # Averages since the last report, from the background sampler
+            window = max(1, time.monotonic() - last_report)
+            last_report = time.monotonic()
 
-            print("ffmpeg?", ffmpeg_process)
-            
-            if ffmpeg_process:
-                print("Poll?", ffmpeg_process.returncode)
+            cpu_usage = metrics_sampler.host_average("cpu", window) or 0
+            ram_usage = metrics_sampler.host_average("ram", window) or 0
+            bytes_sent = metrics_sampler.host_average("net_sent", window) or 0
+            bytes_recv = metrics_sampler.host_average("net_recv", window) or 0
+            pipeline_resources = metrics_sampler.pipeline_averages(window)
 
-            print("Checking URLs")
-            stream1_live = await is_hls_stream_live(convert_url_rtmp_to_hls(config['stream1_url']))
-            stream2_live = await is_hls_stream_live(convert_url_rtmp_to_hls(config['stream2_url']))
+            channel_statuses = {name: await channel_status(channel, pipeline_resources) for name, channel in channels.items()}
             
             # Prepare the payload
             payload = {
                 "server_uuid": config["server_uuid"],
                 "cpu_usage": cpu_usage,
                 "ram_usage": ram_usage,
-                "bytes_sent": get_size(bytes_sent),
-                "bytes_recv": get_size(bytes_recv),
                 "bytes_sent_raw": bytes_sent,
                 "bytes_recv_raw": bytes_recv,
-                "selected_source": config["active_source"],
-                "youtube_key": config["youtube_key"],
-                "ffmpeg_alive": ffmpeg_alive or False,
-                "stream1_live": stream1_live,
-                "stream2_live": stream2_live,
-                "stream1_url": config['stream1_url'] or "",
-                "stream2_url": config['stream2_url'] or "",
-                "noise_reduction": config.get("noise_reduction", "0")
+                "cpu_budget": cpu_budget(),
+                "pipelines": supervisor.status(),
+                "ffmpeg_progress": ffmpeg_progress(),
+                "pipeline_resources": pipeline_resources,
+                "content_health": content_analyzer.status(),
+                "channels": channel_statuses
             }
 
-            print("Sending payload", payload)
-            
-            # Send the status to the central server
-            async with httpx.AsyncClient() as client:
+            # The top level fields describe the default channel, which is all older dashboards know about
+            if DEFAULT_CHANNEL in channel_statuses:
+                payload.update({key: value for key, value in channel_statuses[DEFAULT_CHANNEL].items() if key not in payload})
+
+            streaming = any(channel_started(channel) for channel in channels.values())
+            interval = status_reporter.interval(streaming, stream_failing())
+
+            # Send the status to the central server, as a delta over the control channel when we can
+            if await control_channel.event("status_report", status_reporter.build(payload)):
+                print(f"Status pushed at {datetime.now()}, next in {interval}s")
+            else:
+                status_reporter.reset()
+                payload["bytes_sent"] = get_size(bytes_sent)
+                payload["bytes_recv"] = get_size(bytes_recv)
+
                 try:
-                    response = await client.post(f'{config["server_host"]}/api/v1/streamservers/report_status', json=payload)
+                    response = await http_client.post(f'{config["server_host"]}/api/v1/streamservers/report_status', json=payload)
                     response.raise_for_status()  # Will raise an exception for 4XX/5XX responses
                     print(f"Status reported successfully at {datetime.now()}")
                 except httpx.HTTPError as e:
@@ -381,236 +668,613 @@ async def report_system_status():
         except Exception as e:
             print("Main status look had failure", e)
 
-async def is_stream_live(stream_url):
-    if not stream_url:
-        return False
-
-    """ Check if the given stream URL is live using ffprobe. """
+def cpu_budget():
+    """ Host CPU percentage this node may be loaded to before it refuses new channels. """
     try:
-        # Run ffprobe to check the stream status
-        # ffprobe -v error -show_entries format=duration -of default=noprint_wrappers=1:nokey=1
-        result = subprocess.run(
-            ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", 
-             "default=noprint_wrappers=1:nokey=1", stream_url],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            timeout=10  # Set a timeout to avoid hanging
+        return float(config.get("cpu_budget", 80))
+    except (TypeError, ValueError):
+        return 80.0
+
+def noise_reduction_amount(channel, stream_url):
+    """ afftdn strength for `stream_url`, 0 for backup videos or when it's turned off. """
+    if stream_url.endswith(".mp4"):
+        return 0
+    return noise_reduction(channel.config.get("noise_reduction"))
+
+async def plan_source(channel, stream_url):
+    """ The input to read for `stream_url` and the cheapest plan that streams it correctly. """
+    prepared = backup_ingest.prepared_for(stream_url) if stream_url.endswith(".mp4") else None
+    if prepared:
+        # Already loudness-normalised mono AAC with a 2 s GOP, nothing left to encode
+        input_url, plan = prepared, Plan("copy", "copy", [], ["prepared backup asset"])
+    else:
+        if os.path.isfile(stream_url):
+            # A local file probes in well under a second
+            probe = await stream_planner.probe(stream_url)
+        else:
+            # Never wait seconds for a live input on a switch, the health loop keeps its probe warm.
+            # Without one the safe plan streams now and check_plan restarts it if that isn't enough.
+            probe = stream_planner.cached(stream_url)
+            if probe is None:
+                stream_planner.refresh(stream_url)
+        input_url, plan = stream_url, stream_planner.plan(
+            probe, noise_reduction_amount(channel, stream_url), loudness_target(channel.config.get("loudness_target"))
         )
 
-        # If ffprobe runs successfully, the stream is live
-        return result.returncode == 0
-    except subprocess.TimeoutExpired:
-        # If ffprobe times out, the stream is not live
-        return False
-    except:
-        return False
+    if channel.adaptive_bitrate:
+        plan.video = "encode"
+        plan.rung = channel.bitrate.rung
+        plan.reasons.append(f"adaptive bitrate at {plan.rung['name']}")
+
+    return input_url, plan
+
+def build_source_command(input_url, output_url, plan, input_args="", ts_offset=None):
+    """
+    Build the ffmpeg command that reads `input_url` and publishes it to `output_url` as `plan` says.
+    `ts_offset` shifts the output timestamps, feeders use it to continue the relay's timeline.
+    """
+    if input_url.endswith(".mp4"):
+        input_args = "-stream_loop -1"
+    input_args = f"{input_args} " if input_args else ""
+    output_args = f"-output_ts_offset {ts_offset} " if ts_offset is not None else ""
+    return f'{FFMPEG} -re {input_args}-i {input_url} {stream_planner.output_args(plan)} {output_args}-f flv {output_url}'
+
+def delay_buffer_for(channel, stream_url):
+    """ A delay buffer for `stream_url` if the channel has one configured and the source is ingested here. """
+    delay = channel.setting("delay_seconds", 0)
+    stream_key = hls_monitor.stream_key_for_url(stream_url)
+    if delay <= 0 or not stream_key:
+        return None
+
+    state = hls_monitor.watch(stream_key)
+    if not state.segments:
+        # Nothing on disk yet to play out, read it live
+        return None
+    return DelayBuffer(state, delay, channel.setting("delay_low_water", 4))
+
+def build_relay_output_command(channel, destination_url):
+    """
+    Build the long-lived ffmpeg that copies the channel's local relay stream to one destination.
 
-async def start_youtube_stream_directly(stream_url):
-    global ffmpeg_process, config
+    The packets keep the timestamps the feeder gave them, restamping here
+    would lose the B-frame order. Feeders continue the relay's timeline
+    instead (see Channel.relay_offset), so they stay monotonic across
+    switches.
+    """
+    return f'{FFMPEG} -f live_flv -i {channel.relay_url} -c copy -f flv {destination_url}'
 
-    print("Starting stream direct", stream_url)
+def stream_pipelines_running(channel):
+    return all(supervisor.is_running(name) for name in channel.pipelines())
 
-    config["should_be_streaming"] = True
-    save_config(config)
+def ffmpeg_progress():
+    """ Latest progress and 30 s summary for each running pipeline. """
+    return {name: progress_trackers[name].summary() for name in supervisor.pipelines if name in progress_trackers}
 
-    if ffmpeg_process:
-        try:
-            ffmpeg_process.kill()
-            await asyncio.sleep(1)
-            ffmpeg_process = None
-            await kill_ffmpeg_processes()
+async def start_pipeline(name, command, identity=None, meta=None):
+    print("Final Command", command)
 
-            await asyncio.sleep(2)
-        except Exception as e:
-            print("Failed to kill ffmpeg", e)
-        print("Should be dead")
+    try:
+        # Replaces (and waits out) the previous ffmpeg if one is running
+        pipeline = await supervisor.start(name, command, identity=identity, meta=meta)
+        if pipeline.adopted:
+            # Its stdout and stderr went with the last run of the node
+            progress_trackers.pop(name, None)
+            return pipeline
+
+        # Progress blocks arrive on stdout, warnings and errors on stderr
+        progress_trackers[name] = ProgressTracker()
+        asyncio.create_task(progress_trackers[name].read(pipeline.process.stdout))
+        asyncio.create_task(RateLimitedLog(f"FFMPEG {name}").read(pipeline.process.stderr))
+    except Exception as e:
+        logger.exception("Failed to start FFmpeg process.")
+        raise HTTPException(status_code=500, detail=str(e))
 
-    youtube_key = config["youtube_key"]
+    return pipeline
 
-    if not youtube_key:
-        return False
+async def start_output(channel, destination):
+    """ (Re)start the relay reader that copies the channel's stream to `destination`. """
+    name = channel.pipeline(destination["name"])
+    channel.start_relay_clock()
+    await start_pipeline(name, build_relay_output_command(channel, destination["url"]), meta={"relay_clock": channel.relay_clock})
+    pipeline_plans[name] = Plan("copy", "copy", [], ["relay output"])
 
-    cv = "copy"
-    ca = "aac"
+async def sync_outputs(channel):
+    """ Start relay outputs that are missing or point somewhere else, and stop the ones no longer wanted. """
+    for destination in channel.destinations():
+        output = supervisor.get(channel.pipeline(destination["name"]))
+        if not output or not output.is_running() or output.command != build_relay_output_command(channel, destination["url"]):
+            await start_output(channel, destination)
 
-    additional_commands = []
-    more_additional_commands = []
+    await stop_channel_pipelines(channel, keep=channel.pipelines())
 
-    additional_commands.append('-af "loudnorm=I=-16:TP=-1.5:LRA=11" -ac 1')
+async def start_youtube_stream_directly(channel, stream_url):
+    print(f"Starting channel {channel.name} direct", stream_url)
 
-    if not stream_url.endswith(".mp4"):
-        if "noise_reduction" in config and config["noise_reduction"]:
-            nr_amount = 12
+    channel.config["should_be_streaming"] = True
+    save_config(config)
+    request_status_report()
 
-            try:
-                nr_amount = int(config["noise_reduction"])
-                if nr_amount > 97:
-                    nr_amount = 97
-                elif nr_amount < 0:
-                    nr_amount = 0
-            except:
-                pass
+    destinations = channel.destinations()
+
+    if not destinations:
+        await stop_channel_pipelines(channel)
+        return False
 
-            if nr_amount > 0:
-                additional_commands.append(f'-af "afftdn=nr={nr_amount}"')
-                ca = "aac"
+    name = channel.source_pipeline()
+    if channel.uses_relay():
+        # Relay: the feeder reads and encodes once, the outputs stay connected and only the feeder is swapped
+        await sync_outputs(channel)
     else:
-        more_additional_commands.append("-stream_loop -1")
+        # One destination: read, encode and publish in a single ffmpeg
+        await stop_channel_pipelines(channel, keep=(name,))
 
-    command = f'/usr/bin/ffmpeg -re {" ".join(more_additional_commands)} -i {stream_url} {" ".join(additional_commands)} -c:v {cv} -c:a {ca} -g 60 -f flv -x264-params keyint=60:min-keyint=60:no-scenecut=1 -drop_pkts_on_overflow 1 -attempt_recovery 1 -recovery_wait_time 1 rtmp://a.rtmp.youtube.com/live2/{youtube_key}'
-    print("Final Command", command)
+    identity = source_identity(channel, stream_url)
+    if resume_source(channel, name, stream_url, identity):
+        return True
 
-    # ffmpeg_process = Popen(command, stdout=PIPE, stderr=PIPE, bufsize=1,
-    #     universal_newlines=True, shell=True)
+    input_url, plan = await plan_source(channel, stream_url)
+    print(f"Pipeline plan for {stream_url}: {plan.path}", ", ".join(plan.reasons))
 
-    try:
-        ffmpeg_process = await asyncio.create_subprocess_shell(
-            command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+    input_args = ""
+    channel.delay_buffer = delay_buffer_for(channel, stream_url)
+    if channel.delay_buffer:
+        input_args, input_url = channel.delay_buffer.input_args()
 
-        # Log the output from FFmpeg process
-        asyncio.create_task(log_ffmpeg_output(ffmpeg_process))
+    if channel.uses_relay():
+        command = build_source_command(input_url, channel.relay_url, plan, input_args, channel.relay_offset())
+    else:
+        command = build_source_command(input_url, destinations[0]["url"], plan, input_args)
 
-    except Exception as e:
-        logger.exception("Failed to start FFmpeg process.")
-        raise HTTPException(status_code=500, detail=str(e))
+    await start_pipeline(name, command, identity, {"plan": plan.as_dict(), "relay_clock": channel.relay_clock})
+    pipeline_plans[name] = plan
+    return True
+
+def source_identity(channel, stream_url):
+    """
+    What a channel's source pipeline is built from: the config keys that need
+    a restart and the input. Unlike the command, it doesn't depend on the
+    probe, the bitrate rung or the delay buffer, and live tweaks are kept in
+    the plan recorded with it instead.
+    """
+    settings = pipeline_settings(channel.config)
+    return hashlib.sha256(json.dumps([stream_url, settings], sort_keys=True, default=str).encode()).hexdigest()
 
-    # Kick off the log monitoring as a background task
-    # asyncio.create_task(log_ffmpeg_output(ffmpeg_process))
+def resume_source(channel, name, stream_url, identity):
+    """ Keep the source pipeline the last run of the node left running, as long as the channel config is the same. """
+    pipeline = supervisor.adopt(name, identity)
+    if not pipeline:
+        return False
 
-async def log_ffmpeg_output(process):
-    """ Log output from FFmpeg to check for any errors or important information. """
-    async for line in process.stderr:
-        if line:
-            logger.error(f"FFMPEG: {line.decode().strip()}")
-    await process.wait()
+    # Carry on with what it was started with, a new probe could come out different
+    plan = Plan.from_dict(pipeline.meta["plan"]) if pipeline.meta.get("plan") else Plan("copy", "copy", [], ["adopted"])
+    pipeline_plans[name] = plan
+    if channel.adaptive_bitrate and plan.rung:
+        channel.bitrate.restore(plan.rung)
+    channel.delay_buffer = delay_buffer_for(channel, stream_url)
+    progress_trackers.pop(name, None)  # Its stdout went with the last run of the node
+    return True
 
 @app.get("/start-youtube-stream/")
-async def start_youtube_stream():
-    global config
-
-    source_url = config[config["active_source"] + "_url"]
-    await start_youtube_stream_directly(source_url)
+@app.get("/channels/{channel_name}/start-youtube-stream/")
+async def start_youtube_stream(channel_name: str = DEFAULT_CHANNEL):
+    channel = get_channel(channel_name)
 
-    config["should_be_streaming"] = True
+    channel.config["should_be_streaming"] = True
     save_config(config)
 
-    return {"message": "YouTube stream started"}
+    command = channel.lifecycle.submit(START, "start requested")
+    return {"message": "YouTube stream starting", "channel": channel.name, "command_id": command.id}
 
 @app.get("/stop-youtube-stream/")
-async def stop_youtube_stream():
-    global ffmpeg_process
-    if ffmpeg_process:
-        print("Killing")
-        ffmpeg_process.kill()
-        ffmpeg_process = None
-        await kill_ffmpeg_processes()
-
-        config["should_be_streaming"] = False
-        save_config(config)
+@app.get("/channels/{channel_name}/stop-youtube-stream/")
+async def stop_youtube_stream(channel_name: str = DEFAULT_CHANNEL):
+    channel = get_channel(channel_name)
 
-        await asyncio.sleep(2)
-        print("Should be dead")
+    # Set right away so nothing the health loop queues in the meantime brings it back
+    channel.config["should_be_streaming"] = False
+    save_config(config)
 
-    return {"message": "YouTube stream stopped"}
+    command = channel.lifecycle.submit(STOP, "stop requested")
+    return {"message": "YouTube stream stopping", "channel": channel.name, "command_id": command.id}
 
 @app.post("/switch-stream/")
-async def switch_stream(stream_data: StreamData):
-    if stream_data.identifier in ["stream1", "stream2", "mp4"]:
-        config["active_source"] = stream_data.identifier
+@app.post("/channels/{channel_name}/switch-stream/")
+async def switch_stream(stream_data: StreamData, channel_name: str = DEFAULT_CHANNEL):
+    channel = get_channel(channel_name)
+
+    if stream_data.identifier in SOURCES:
+        # Picking a source by hand makes it the preferred one, the chain falls back from there
+        channel.config["active_source"] = stream_data.identifier
+        channel.failover.promote(stream_data.identifier)
+        channel.failover.switched()
+        channel.config["failover_chain"] = list(channel.failover.order)
         save_config(config)
-        await start_youtube_stream_directly(config[stream_data.identifier + "_url"])
-        return {"message": f"Switched to {stream_data.identifier}"}
+        command = channel.lifecycle.submit(START, f"switch to {stream_data.identifier}")
+        return {"message": f"Switching to {stream_data.identifier}", "channel": channel.name, "command_id": command.id}
     raise HTTPException(status_code=404, detail="Invalid stream identifier")
 
 @app.post("/set-stream-url/")
-async def set_stream_url(stream_data: StreamData):
-    global config
+@app.post("/channels/{channel_name}/set-stream-url/")
+async def set_stream_url(stream_data: StreamData, channel_name: str = DEFAULT_CHANNEL):
+    channel = get_channel(channel_name)
 
     if stream_data.identifier in ["stream1", "stream2"]:
-        config[stream_data.identifier + "_url"] = stream_data.url
+        channel.config[stream_data.identifier + "_url"] = stream_data.url
         save_config(config)
-        print("Config updated", config)
+        watch_channel_sources(channel)
+        print("Config updated", channel.name, channel.config)
         return {"message": f"{stream_data.identifier} URL updated"}
     raise HTTPException(status_code=404, detail="Invalid stream identifier")
 
 @app.post("/set-config/")
-async def set_stream_url(config_data: ConfigRequest):
-    global config, ffmpeg_process
+@app.post("/channels/{channel_name}/set-config/")
+async def set_config(config_data: ConfigRequest, channel_name: str = DEFAULT_CHANNEL):
+    channel = get_channel(channel_name)
+    channel_values = {}
 
     for pair in config_data.config:
-        config[pair.configKey] = pair.configValue
+        if pair.configKey == "channels":
+            continue
+        if pair.configKey in NODE_KEYS:
+            config[pair.configKey] = pair.configValue
+        else:
+            channel_values[pair.configKey] = pair.configValue
+
+    # Classify against the running pipeline before anything changes under it
+    source_pipeline = channel.source_pipeline()
+    plan = pipeline_plans.get(source_pipeline) if supervisor.is_running(source_pipeline) else None
+    changes = {key: classify(channel, key, value, plan) for key, value in channel_values.items()}
+
+    channel.configure(channel_values)
+    content_analyzer.configure(config)
+    save_config(config)
+
+    command = None
+    if channel_started(channel):
+        live = [key for key, change in changes.items() if change == LIVE]
+        if RESTART in changes.values():
+            command = channel.lifecycle.submit(START, "config change")
+        elif live:
+            command = channel.lifecycle.submit(RETUNE, "config change", keys=live)
+
+    print("Config changes", channel.name, changes)
+    return {
+        "message": "Configuration updated",
+        "channel": channel.name,
+        "changes": changes,
+        "command_id": command.id if command else None,
+    }
+
+async def retune_pipeline(channel, name, plan, keys):
+    """ Apply live tweakable config `keys` to running pipeline `name` through ffmpeg filter commands. """
+    commands = live_commands(channel, keys)
+    for instance, command, argument in commands:
+        # ffmpeg's interactive "c" command: target, time (-1 is now), command, argument
+        if not await supervisor.send_input(name, f"c{instance} -1 {command} {argument}\n".encode()):
+            print(f"Couldn't send {command} to {name}, restarting instead")
+            return False
 
+    if plan:
+        retune_plan(plan, commands)
+        supervisor.update_meta(name, plan=plan.as_dict())  # Adopted after a node restart with these values
+    return True
+
+async def use_backup_video(channel, path):
+    """ Make `path` the channel's backup video, and stream it if the channel is streaming. """
+    channel.config['mp4_url'] = path
     save_config(config)
+    download_manager.evict(keep=tuple(c.config.get('mp4_url') for c in channels.values()))
+    backup_ingest.ensure(path)
+
+    if channel_started(channel):
+        # Start streaming the newly downloaded video
+        channel.lifecycle.submit(START, "new backup video", url=path)
 
-    if ffmpeg_process:
-        await start_youtube_stream_directly(config[config["active_source"] + "_url"])
+async def backup_download_complete(job):
+    channel = channels.get(job.channel)
+    if channel:
+        await use_backup_video(channel, job.path)
 
-    return {"message": "Configuration updated"}
+download_manager.on_complete(backup_download_complete)
 
 @app.post("/download-youtube-video/")
-async def download_youtube_video(request: YouTubeDownloadRequest):
-    # Specify the output template and options for yt-dlp
-    ydl_opts = {
-        'format': 'best',
-        'outtmpl': '/yt_video.mp4',  # Set output file template
-        'merge_output_format': 'mp4',  # Ensure the output is MP4 if video and audio are separate
+@app.post("/channels/{channel_name}/download-youtube-video/")
+async def download_youtube_video(request: YouTubeDownloadRequest, channel_name: str = DEFAULT_CHANNEL):
+    channel = get_channel(channel_name)
+    job = download_manager.submit(request.youtube_url, channel=channel.name)
+    return {"message": "YouTube video download queued", **job.as_dict()}
+
+@app.get("/download-jobs/")
+async def list_download_jobs():
+    download_manager.prune()
+    return [job.as_dict() for job in download_manager.jobs.values()]
+
+@app.get("/download-jobs/{job_id}")
+async def get_download_job(job_id: str):
+    job = download_manager.jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Download job not found")
+    return job.as_dict()
+
+@app.delete("/download-jobs/{job_id}")
+async def cancel_download_job(job_id: str):
+    job = download_manager.cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Download job not found")
+    return job.as_dict()
+
+@app.get("/videos/")
+async def list_videos():
+    return download_manager.cached_videos()
+
+@app.post("/select-video/")
+@app.post("/channels/{channel_name}/select-video/")
+async def select_video(request: VideoSelectRequest, channel_name: str = DEFAULT_CHANNEL):
+    channel = get_channel(channel_name)
+    path = download_manager.lookup(request.video_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Video is not cached")
+
+    download_manager.touch(request.video_id)
+    await use_backup_video(channel, path)
+    return {"message": "Backup video selected", "mp4_url": path}
+
+@app.get("/backup-assets/")
+@app.get("/channels/{channel_name}/backup-assets/")
+async def list_backup_assets(channel_name: str = DEFAULT_CHANNEL):
+    channel = get_channel(channel_name)
+    mp4_url = channel.config.get("mp4_url")
+    return {
+        "assets": backup_ingest.records(),
+        "current": backup_ingest.record_for(mp4_url) if mp4_url else None,
+        "preparing": list(backup_ingest.running),
     }
 
-    try:
-        # Use yt-dlp to download the video
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([request.youtube_url])
+@app.post("/backup-assets/prepare/")
+@app.post("/channels/{channel_name}/backup-assets/prepare/")
+async def prepare_backup_asset(channel_name: str = DEFAULT_CHANNEL):
+    channel = get_channel(channel_name)
+    mp4_url = channel.config.get("mp4_url")
+    if not mp4_url or not os.path.isfile(mp4_url):
+        raise HTTPException(status_code=404, detail="Backup video not found")
+
+    backup_ingest.ensure(mp4_url)
+    return {"message": "Backup video is being prepared", "preparing": list(backup_ingest.running)}
+
+def destination_status(channel, destination):
+    name = channel.pipeline(destination["name"])
+    pipeline = supervisor.get(name)
+    summary = progress_trackers[name].summary() if pipeline and name in progress_trackers else None
+
+    return {
+        "state": pipeline.state if pipeline else "stopped",
+        "uptime": round(pipeline.uptime, 1) if pipeline and pipeline.is_running() else 0,
+        "bitrate": summary["avg_bitrate"] if summary else None,
+        "speed": summary["min_speed"] if summary else None,
+        "reconnects": channel.destination_policy(destination["name"]).status(),
+    }
 
-        # Update the configuration to use the new MP4 file
-        global config
-        config['mp4_url'] = '/yt_video.mp4'
-        save_config(config)
+@app.get("/channels/{channel_name}/destinations/")
+async def list_destinations(channel_name: str):
+    channel = get_channel(channel_name)
+    return {
+        "destinations": channel.config.get("destinations") or [],
+        "status": {destination["name"]: destination_status(channel, destination) for destination in channel.destinations()},
+    }
 
-        if ffmpeg_process:
-            # Start streaming the newly downloaded video
-            await start_youtube_stream_directly(config['mp4_url'])
+def apply_destinations(channel):
+    """ Pick up a changed destinations list, without restarting the feeder when the layout allows it. """
+    if channel_started(channel):
+        return channel.lifecycle.submit(SYNC, "destinations changed")
+    request_status_report()
+    return None
+
+async def run_command(channel, command):
+    """ Carry out one lifecycle command for `channel`, returns the channel's new state. """
+    if command.kind == STOP:
+        print("Killing", channel.name)
+        await stop_channel_pipelines(channel)
+        request_status_report()
+        return STOPPED
+
+    if command.automatic and not channel.should_be_streaming:
+        # Stopped while this was queued
+        command.state = SKIPPED
+        return None
+
+    if command.kind in PARTIAL and not channel_started(channel):
+        command.state = SKIPPED
+        return None
+
+    if command.kind == SYNC:
+        feeder = supervisor.get(channel.pipeline(FEEDER_PIPELINE))
+        if channel.uses_relay() and feeder and feeder.is_running():
+            await sync_outputs(channel)
+            request_status_report()
+            return None
+
+    if command.kind == RECONNECT:
+        if not channel.uses_relay():
+            command.state = SKIPPED
+            return None
+        for destination in channel.destinations():
+            if destination["name"] in command.keys:
+                await start_output(channel, destination)
+        request_status_report()
+        return None
+
+    if command.kind == RETUNE:
+        name = channel.source_pipeline()
+        if await retune_pipeline(channel, name, pipeline_plans.get(name), command.keys):
+            return None
+
+    started = await start_youtube_stream_directly(channel, command.url or channel.source_url())
+    request_status_report()
+    return STREAMING if started else STOPPED
+
+@app.post("/channels/{channel_name}/destinations/")
+async def set_destination(channel_name: str, request: DestinationRequest):
+    channel = get_channel(channel_name)
+
+    if not CHANNEL_NAME.match(request.name) or request.name in RESERVED_DESTINATIONS:
+        raise HTTPException(status_code=400, detail="Invalid destination name")
+    if not request.url.startswith(("rtmp://", "rtmps://")):
+        raise HTTPException(status_code=400, detail="Destinations must be rtmp:// or rtmps:// URLs")
+
+    destinations = [d for d in channel.config.get("destinations") or [] if d["name"] != request.name]
+    destinations.append({"name": request.name, "url": request.url, "enabled": request.enabled})
+    channel.config["destinations"] = destinations
+    save_config(config)
 
-        return {"message": "YouTube video downloaded and streaming started", "mp4_url": config['mp4_url']}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    command = apply_destinations(channel)
+    return {
+        "message": "Destination saved",
+        "channel": channel.name,
+        "destination": request.name,
+        "command_id": command.id if command else None,
+    }
+
+@app.delete("/channels/{channel_name}/destinations/{destination_name}")
+async def delete_destination(channel_name: str, destination_name: str):
+    channel = get_channel(channel_name)
+    destinations = channel.config.get("destinations") or []
+
+    if not any(d["name"] == destination_name for d in destinations):
+        raise HTTPException(status_code=404, detail="Destination not found")
+
+    channel.config["destinations"] = [d for d in destinations if d["name"] != destination_name]
+    channel.destination_policies.pop(destination_name, None)
+    save_config(config)
+
+    command = apply_destinations(channel)
+    return {
+        "message": "Destination removed",
+        "channel": channel.name,
+        "destination": destination_name,
+        "command_id": command.id if command else None,
+    }
+
+@app.get("/channels/")
+async def list_channels():
+    return {
+        name: {
+            "stream_key": channel.stream_key,
+            "active_source": channel.config.get("active_source"),
+            "should_be_streaming": channel.should_be_streaming,
+            "ffmpeg_alive": stream_pipelines_running(channel),
+            "pipelines": channel.pipelines(),
+        }
+        for name, channel in channels.items()
+    }
+
+@app.post("/channels/")
+async def create_channel(request: ChannelRequest):
+    if not CHANNEL_NAME.match(request.name):
+        raise HTTPException(status_code=400, detail="Channel names may only use letters, digits, - and _")
+    if request.name in channels:
+        raise HTTPException(status_code=409, detail="Channel already exists")
+    if request.stream_key and any(channel.stream_key == request.stream_key for channel in channels.values()):
+        raise HTTPException(status_code=409, detail="Stream key is used by another channel")
+
+    # Pack channels onto the node only while it has CPU to spare
+    cpu = metrics_sampler.host_average("cpu", 60)
+    if cpu is not None and cpu >= cpu_budget():
+        raise HTTPException(status_code=409, detail=f"Node is at {cpu:.0f}% CPU, over its {cpu_budget():.0f}% budget")
+
+    config["channels"][request.name] = new_channel_config(request.stream_key, request.youtube_key)
+    channel = Channel(request.name, config["channels"][request.name])
+    channels[channel.name] = channel
+    save_config(config)
+
+    await start_channel(channel)
+    request_status_report()
+    return {"message": "Channel created", "channel": channel.name, "stream_key": channel.stream_key}
+
+@app.delete("/channels/{channel_name}")
+async def delete_channel(channel_name: str):
+    channel = get_channel(channel_name)
+    if channel.name == DEFAULT_CHANNEL:
+        # Its status is the top level of every report, the webserver needs it
+        raise HTTPException(status_code=409, detail="The default channel can't be deleted")
+
+    if channel.task:
+        channel.task.cancel()
+
+    # Let a start that's halfway through finish, then stop through the queue so nothing is orphaned
+    channel.config["should_be_streaming"] = False
+    channel.lifecycle.submit(STOP, "channel deleted")
+    await channel.lifecycle.settle()
+    channel.lifecycle.close()
+
+    del channels[channel.name]
+    del config["channels"][channel.name]
+    save_config(config)
+    request_status_report()
+    return {"message": "Channel deleted", "channel": channel.name}
+
+@app.get("/pipelines/")
+async def get_pipelines():
+    return supervisor.status()
+
+@app.get("/pipelines/progress/")
+async def get_pipelines_progress():
+    return {name: list(tracker.samples) for name, tracker in progress_trackers.items() if name in supervisor.pipelines}
+
+@app.get("/pipelines/plans/")
+async def get_pipeline_plans():
+    return {name: plan.as_dict() for name, plan in pipeline_plans.items() if name in supervisor.pipelines}
+
+@app.get("/metrics/")
+async def get_metrics(seconds: int = 600):
+    return metrics_sampler.history(seconds)
 
 @app.get("/version/")
 async def get_version():
     return {"version": __version__}
 
+@app.get("/commands/{command_id}")
+@app.get("/channels/{channel_name}/commands/{command_id}")
+async def get_command(command_id: str, channel_name: str = DEFAULT_CHANNEL):
+    command = get_channel(channel_name).lifecycle.get(command_id)
+    if not command:
+        raise HTTPException(status_code=404, detail="Command not found")
+    return command.as_dict()
+
+@app.get("/channels/{channel_name}/lifecycle/")
+async def get_lifecycle(channel_name: str):
+    return get_channel(channel_name).lifecycle.status()
+
 @app.post("/validate_publish/")
 async def validate_stream(name: str = Form(...)):
     # Implement your authentication logic here
-    if name == config["stream_key"]:
+    channel = next((channel for channel in channels.values() if channel.stream_key == name), None)
+    if channel:
+        hls_monitor.watch(name)
         return {"success": True}
     else:
         return {"success": True}
         # raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unauthorized")
 
-async def kill_ffmpeg_processes():
-    """Kill all running ffmpeg processes."""
-    for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
-        try:
-            if proc.info['name'] == 'ffmpeg' or (proc.info['cmdline'] and '/usr/bin/ffmpeg' in proc.info['cmdline']):
-                logger.info(f"Killing ffmpeg process: {proc.info}")
-                proc.kill()
-                proc.wait()
-        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-            continue
+@control_channel.on("set_config")
+async def channel_set_config(data):
+    return await set_config(ConfigRequest(**data), data.get("channel", DEFAULT_CHANNEL))
 
-async def find_ffmpeg_processes():
-    for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
-        try:
-            if proc.info['name'] == 'ffmpeg' or (proc.info['cmdline'] and '/usr/bin/ffmpeg' in proc.info['cmdline']):
-                logger.info(f"Checking ffmpeg process: {proc.info}")
-                return True
-        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-            continue
-    
-    return False
+@control_channel.on("start_youtube_stream")
+async def channel_start_youtube_stream(data):
+    return await start_youtube_stream(data.get("channel", DEFAULT_CHANNEL))
+
+@control_channel.on("stop_youtube_stream")
+async def channel_stop_youtube_stream(data):
+    return await stop_youtube_stream(data.get("channel", DEFAULT_CHANNEL))
+
+@control_channel.on("status_resync")
+async def channel_status_resync(data):
+    await resync_status()
+    return {"message": "Full status will follow"}
+
+@control_channel.on("switch_stream")
+async def channel_switch_stream(data):
+    return await switch_stream(StreamData(**data), data.get("channel", DEFAULT_CHANNEL))
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+# Stream-ready copies of the backup videos, <key>.mp4 plus a <key>.json analysis record
+PREPARED_DIR = os.path.abspath(os.getenv("PREPARED_DIR", "prepared"))
+
+LOUDNESS_TARGET = "I=-16:TP=-1.5:LRA=11"
+GOP_SECONDS = 2
+
+def parse_fps(rate):
+    try:
+        num, den = rate.split("/")
+        return float(num) / float(den) if float(den) else None
+    except (AttributeError, ValueError):
+        return None
+
+class BackupIngest:
+    """
+    Turns a backup video into an asset the fallback pipeline can stream with
+    `-c copy`: loudness normalised with measured two-pass loudnorm, mono AAC
+    like the live pipeline, and a keyframe every GOP_SECONDS.
+
+    Each source is keyed by its path, size and mtime, so a file is only
+    processed once and a replaced file is processed again. Ingests run one at
+    a time at low priority so they don't starve a live pipeline.
+    """
+
+    def __init__(self, prepared_dir=PREPARED_DIR):
+        self.prepared_dir = prepared_dir
+        self.lock = asyncio.Lock()
+        self.running = {}  # key -> task
+        os.makedirs(self.prepared_dir, exist_ok=True)
+
+    def key_for(self, source):
+        try:
+            st = os.stat(source)
+        except OSError:
+            return None
+        identity = f"{os.path.abspath(source)}:{st.st_size}:{st.st_mtime_ns}"
+        return hashlib.sha1(identity.encode()).hexdigest()[:16]
+
+    def record_path(self, key):
+        return os.path.join(self.prepared_dir, f"{key}.json")
+
+    def asset_path(self, key):
+        return os.path.join(self.prepared_dir, f"{key}.mp4")
+
+    def record_for(self, source):
+        """ Analysis record of the prepared copy of `source`, or None if it isn't ready. """
+        key = self.key_for(source)
+        if not key or not os.path.isfile(self.asset_path(key)):
+            return None
+        try:
+            with open(self.record_path(key), 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def prepared_for(self, source):
+        record = self.record_for(source)
+        return record["path"] if record else None
+
+    def records(self):
+        records = []
+        for name in os.listdir(self.prepared_dir):
+            if name.endswith(".json"):
+                try:
+                    with open(os.path.join(self.prepared_dir, name), 'r') as file:
+                        records.append(json.load(file))
+                except (OSError, ValueError):
+                    continue
+        return records
+
+    def ensure(self, source):
+        """ Start preparing `source` in the background unless it's ready or already running. """
+        key = self.key_for(source)
+        if not key or self.prepared_for(source) or key in self.running:
+            return None
+
+        task = asyncio.create_task(self.prepare(source, key))
+        self.running[key] = task
+        task.add_done_callback(lambda _: self.running.pop(key, None))
+        return task
+
+    async def prepare(self, source, key):
+        async with self.lock:
+            print("Preparing backup video", source)
+            started = time.time()
+
+            try:
+                probe = await self.probe(source)
+                loudness = await self.measure_loudness(source)
+                await self.transcode(source, key, probe, loudness)
+            except Exception as e:
+                print(f"Preparing {source} failed", e)
+                return None
+
+            video = next((s for s in probe.get("streams", []) if s.get("codec_type") == "video"), {})
+            record = {
+                "key": key,
+                "source": source,
+                "path": self.asset_path(key),
+                "duration": float(probe.get("format", {}).get("duration") or 0),
+                "width": video.get("width"),
+                "height": video.get("height"),
+                "fps": parse_fps(video.get("avg_frame_rate")),
+                "gop_seconds": GOP_SECONDS,
+                "audio": "aac mono 48kHz",
+                "loudness_target": LOUDNESS_TARGET,
+                "measured_loudness": loudness,
+                "prepared_at": time.time(),
+                "prepare_seconds": round(time.time() - started, 1),
+            }
+
+            with open(self.record_path(key), 'w') as file:
+                json.dump(record, file)
+
+            print("Backup video ready", record["path"])
+            return record
+
+    async def run(self, *args):
+        process = await asyncio.create_subprocess_exec(
+            "nice", "-n", "10", *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise Exception(f"{args[0]} exited with {process.returncode}: {stderr.decode(errors='replace')[-500:]}")
+        return stdout.decode(errors="replace"), stderr.decode(errors="replace")
+
+    async def probe(self, source):
+        stdout, _ = await self.run("ffprobe", "-v", "error", "-print_format", "json", "-show_streams", "-show_format", source)
+        return json.loads(stdout)
+
+    async def measure_loudness(self, source):
+        """ First loudnorm pass, returns the measured values ffmpeg prints as JSON. """
+        _, stderr = await self.run(
+            "/usr/bin/ffmpeg", "-hide_banner", "-nostats", "-i", source, "-vn",
+            "-af", f"loudnorm={LOUDNESS_TARGET}:print_format=json", "-f", "null", "-"
+        )
+        return json.loads(stderr[stderr.rindex("{"):stderr.rindex("}") + 1])
+
+    async def transcode(self, source, key, probe, loudness):
+        video = next((s for s in probe.get("streams", []) if s.get("codec_type") == "video"), None)
+        fps = parse_fps(video.get("avg_frame_rate")) if video else None
+        gop = round((fps or 30) * GOP_SECONDS)
+
+        loudnorm = (
+            f"loudnorm={LOUDNESS_TARGET}"
+            f":measured_I={loudness['input_i']}:measured_TP={loudness['input_tp']}"
+            f":measured_LRA={loudness['input_lra']}:measured_thresh={loudness['input_thresh']}"
+            f":offset={loudness['target_offset']}:linear=true"
+        )
+
+        temp_path = self.asset_path(key) + ".tmp.mp4"
+        await self.run(
+            "/usr/bin/ffmpeg", "-hide_banner", "-nostats", "-loglevel", "error", "-y", "-i", source,
+            "-af", loudnorm, "-ac", "1", "-ar", "48000", "-c:a", "aac", "-b:a", "128k",
+            "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+            "-g", str(gop), "-keyint_min", str(gop), "-sc_threshold", "0",
+            "-force_key_frames", f"expr:gte(t,n_forced*{GOP_SECONDS})",
+            "-movflags", "+faststart", temp_path
+        )
+        os.replace(temp_path, self.asset_path(key))
@@ -0,0 +1,173 @@
+import os
+import time
+from uuid import uuid4
+
+from restart_policy import RestartPolicy, CONFIG_KEYS as RESTART_KEYS
+from failover import FailoverChain
+from content_health import CONFIG_KEYS as CONTENT_KEYS
+from adaptive_bitrate import BitrateController
+from lifecycle import ChannelLifecycle
+
+DEFAULT_CHANNEL = "default"
+SOURCES = ("stream1", "stream2", "mp4")
+
+# Pipeline roles, each channel runs its own copy as "<channel>:<role>".
+# Every destination gets an output pipeline named after it, the YouTube key
+# is the destination called "youtube".
+YOUTUBE_PIPELINE = "youtube"
+FEEDER_PIPELINE = "feeder"
+RESERVED_DESTINATIONS = (YOUTUBE_PIPELINE, FEEDER_PIPELINE)
+
+# Config keys that belong to the node, everything else is per channel
+NODE_KEYS = ("server_uuid", "server_host", "cpu_budget", "channels") + tuple(CONTENT_KEYS)
+
+def channel_defaults(stream_key, youtube_key=""):
+    return {
+        "stream1_url": f"rtmp://localhost:8453/live/{stream_key}",
+        "stream2_url": os.getenv("STREAM2_URL"),
+        "mp4_url": os.getenv("MP4_URL", "/backup.mp4"),
+        "active_source": "stream1",
+        "stream_key": stream_key,
+        "youtube_key": youtube_key,
+    }
+
+def migrate_config(config):
+    """
+    Move a single-stream config into the "channels" layout. The old top level
+    stream settings become the default channel, so existing nodes keep
+    streaming exactly what they streamed before.
+    """
+    if "channels" in config:
+        return False
+
+    channel = {key: value for key, value in config.items() if key not in NODE_KEYS}
+    for key in channel:
+        del config[key]
+
+    config["channels"] = {DEFAULT_CHANNEL: channel}
+    return True
+
+class Channel:
+    """
+    One restream: its own sources, stream key, YouTube key, restart policy,
+    health loop and ffmpeg pipelines.
+
+    `config` is the channel's section of the node config, so saving the node
+    config saves every channel.
+    """
+
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self.restart_policy = RestartPolicy()
+        self.restart_policy.configure(config)
+        self.failover = FailoverChain()
+        self.failover.configure(config)
+        self.failure_count = 0
+        self.task = None  # Health loop
+        self.destination_policies = {}
+        self.delay_buffer = None  # While the active source is played out behind live
+        self.bitrate = BitrateController()
+        self.bitrate.configure(config)
+        self.lifecycle = ChannelLifecycle(name)  # Every start, stop and restart goes through here
+        self.relay_clock = None  # Wall clock time the relay's timestamps count from
+
+    def pipeline(self, role):
+        return f"{self.name}:{role}"
+
+    def destinations(self):
+        """ Enabled outputs as {"name", "url"}, YouTube first. """
+        destinations = []
+        if self.config.get("youtube_key"):
+            destinations.append({"name": YOUTUBE_PIPELINE, "url": f"rtmp://a.rtmp.youtube.com/live2/{self.config['youtube_key']}"})
+
+        for destination in self.config.get("destinations") or []:
+            if destination.get("enabled", True) and destination.get("url"):
+                destinations.append({"name": destination["name"], "url": destination["url"]})
+        return destinations
+
+    def uses_relay(self):
+        """
+        Whether the source goes through the local relay. Relay switch mode
+        always does, and so does fan-out: the feeder reads and encodes the
+        input once and every destination copies from the relay.
+        """
+        return self.config.get("switch_mode") == "relay" or len(self.destinations()) > 1
+
+    def output_pipelines(self):
+        return [self.pipeline(destination["name"]) for destination in self.destinations()]
+
+    def source_pipeline(self):
+        """ The pipeline that reads the input: the feeder, or the only output in direct mode. """
+        if self.uses_relay():
+            return self.pipeline(FEEDER_PIPELINE)
+        outputs = self.output_pipelines()
+        return outputs[0] if outputs else None
+
+    def pipelines(self):
+        """ Names of the pipelines that make up this channel's stream in its current layout. """
+        if self.uses_relay():
+            return [self.pipeline(FEEDER_PIPELINE)] + self.output_pipelines()
+        return self.output_pipelines()[:1]
+
+    def destination_policy(self, name):
+        """ Each destination reconnects with its own backoff, so one bad target can't hold up the others. """
+        if name not in self.destination_policies:
+            self.destination_policies[name] = RestartPolicy()
+            self.destination_policies[name].configure(self.config)
+        return self.destination_policies[name]
+
+    def source_url(self, source=None):
+        return self.config.get(f"{source or self.config['active_source']}_url")
+
+    @property
+    def stream_key(self):
+        return self.config.get("stream_key")
+
+    def setting(self, key, default):
+        """ A numeric channel setting, config values arrive as strings. """
+        try:
+            return float(self.config.get(key, default))
+        except (TypeError, ValueError):
+            return default
+
+    @property
+    def adaptive_bitrate(self):
+        """ Encode on the bitrate ladder instead of copying, so the output can back off under congestion. """
+        return str(self.config.get("adaptive_bitrate", "")).lower() in ("1", "true", "yes", "on")
+
+    @property
+    def should_be_streaming(self):
+        return bool(self.config.get("should_be_streaming"))
+
+    @property
+    def relay_url(self):
+        """ Local nginx-rtmp application the feeder publishes to whenever the channel uses the relay. """
+        return f"rtmp://127.0.0.1:8453/relay/{self.name}"
+
+    def relay_offset(self):
+        """
+        Where on the relay's timeline a feeder starting now begins. Each
+        feeder starts its own timestamps from zero, shifted by this they carry
+        on from where the last feeder stopped.
+        """
+        self.start_relay_clock()
+        return round(time.time() - self.relay_clock, 3)
+
+    def start_relay_clock(self):
+        if self.relay_clock is None:
+            self.relay_clock = time.time()
+
+    def configure(self, values):
+        self.config.update(values)
+        if any(key in RESTART_KEYS for key in values):
+            self.restart_policy.configure(self.config)
+            for policy in self.destination_policies.values():
+                policy.configure(self.config)
+        if any(key.startswith("failover_") for key in values):
+            self.failover.configure(self.config)
+        if any(key.startswith("adaptive_") for key in values):
+            self.bitrate.configure(self.config)
+
+def new_channel_config(stream_key=None, youtube_key=""):
+    return channel_defaults(stream_key or uuid4().hex, youtube_key)
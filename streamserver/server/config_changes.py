@@ -0,0 +1,90 @@
+from planner import DENOISE_FILTER, LOUDNESS_FILTER, TARGET_LUFS
+from restart_policy import CONFIG_KEYS as RESTART_KEYS
+from failover import CONFIG_KEYS as FAILOVER_KEYS
+from adaptive_bitrate import CONFIG_KEYS as ADAPTIVE_KEYS
+
+# What a channel config change needs from the running pipeline
+NO_OP = "no_op"  # ffmpeg never sees it
+LIVE = "live"  # Applied to the running filtergraph with a filter command
+RESTART = "restart"  # Changes the pipeline itself
+
+# Keys only read from config by the node: validate_publish, the health loop and the controllers
+NO_OP_KEYS = ("stream_key", "delay_low_water", "failover_chain", "should_be_streaming") \
+    + tuple(RESTART_KEYS) + tuple(FAILOVER_KEYS) + tuple(ADAPTIVE_KEYS)
+
+SOURCE_URL_KEYS = {"stream1_url": "stream1", "stream2_url": "stream2", "mp4_url": "mp4"}
+
+# Keys a running source pipeline can take without a restart, given the filter is in its plan
+LIVE_KEYS = ("noise_reduction", "loudness_target")
+
+def pipeline_settings(config):
+    """
+    The part of a channel config a running source pipeline is built from.
+    Source URLs and the active source are left out, the caller has the URL
+    being streamed.
+    """
+    skip = set(NO_OP_KEYS) | set(LIVE_KEYS) | set(SOURCE_URL_KEYS) | {"active_source"}
+    return {key: value for key, value in config.items() if key not in skip}
+
+def noise_reduction(value):
+    """ afftdn strength from a config value, 0 when it's turned off. """
+    if not value:
+        return 0
+    try:
+        return max(0, min(97, int(value)))
+    except (TypeError, ValueError):
+        return 12
+
+def loudness_target(value):
+    """ Integrated loudness target in LUFS from a config value. """
+    try:
+        return max(-40.0, min(-5.0, float(value)))
+    except (TypeError, ValueError):
+        return TARGET_LUFS
+
+def has_filter(plan, instance):
+    return plan is not None and any(f.startswith(f"{instance}=") for f in plan.audio_filters)
+
+def classify(channel, key, value, plan):
+    """
+    Whether setting `key` to `value` on `channel` is a no-op, a live tweak or
+    needs a restart. `plan` is the plan of the channel's running source
+    pipeline, None when nothing runs.
+    """
+    if channel.config.get(key) == value:
+        return NO_OP
+
+    if key in SOURCE_URL_KEYS:
+        # Only the active source is being read
+        return RESTART if SOURCE_URL_KEYS[key] == channel.config.get("active_source") else NO_OP
+
+    if key == "noise_reduction":
+        if (channel.source_url() or "").endswith(".mp4"):
+            return NO_OP  # Backup videos are never denoised
+        return LIVE if has_filter(plan, DENOISE_FILTER) and noise_reduction(value) > 0 else RESTART
+
+    if key == "loudness_target":
+        return LIVE if has_filter(plan, LOUDNESS_FILTER) else RESTART
+
+    if key in NO_OP_KEYS:
+        return NO_OP
+    return RESTART
+
+def live_commands(channel, keys):
+    """ (filter, command, argument) for each live tweakable key in `keys`, from the channel's config. """
+    commands = []
+    for key in keys:
+        if key == "noise_reduction":
+            commands.append((DENOISE_FILTER, "nr", str(noise_reduction(channel.config.get(key)))))
+        elif key == "loudness_target":
+            gain = loudness_target(channel.config.get(key)) - TARGET_LUFS
+            commands.append((LOUDNESS_FILTER, "volume", f"{gain}dB"))
+    return commands
+
+def retune_plan(plan, commands):
+    """ Keep the plan's filter list in step with commands sent to its running ffmpeg. """
+    for instance, command, argument in commands:
+        plan.audio_filters = [
+            f"{instance}={command}={argument}" if f.startswith(f"{instance}=") else f
+            for f in plan.audio_filters
+        ]
@@ -0,0 +1,150 @@
+import asyncio
+import re
+import time
+
+# Problems a segment can have
+BLACK = "black"
+FROZEN = "frozen"
+SILENT = "silent"
+
+# Node config keys (all optional) and the attribute each one sets
+CONFIG_KEYS = {
+    "content_interval": "interval",
+    "content_black_ratio": "black_ratio",
+    "content_freeze_ratio": "freeze_ratio",
+    "content_silence_ratio": "silence_ratio",
+    "content_silence_db": "silence_db",
+    "content_bad_checks": "bad_checks",
+}
+
+EVENT = re.compile(r"(black_start|black_end|freeze_start|freeze_end|silence_start|silence_end):\s*(-?[\d.]+)")
+
+def covered_seconds(events, kind, duration):
+    """ Seconds of the segment inside `kind` intervals, an interval still open at the end runs to the end. """
+    total = 0.0
+    start = None
+    for name, value in events:
+        if name == f"{kind}_start":
+            start = value
+        elif name == f"{kind}_end" and start is not None:
+            total += value - start
+            start = None
+    if start is not None:
+        total += max(0.0, duration - start)
+    return total
+
+class StreamContent:
+    def __init__(self):
+        self.segment = None  # Last analysed segment
+        self.problems = []
+        self.ratios = {}
+        self.bad_streak = 0
+        self.checked_at = None
+
+    def as_dict(self):
+        return {
+            "problems": self.problems,
+            "ratios": self.ratios,
+            "bad_streak": self.bad_streak,
+            "checked_at": self.checked_at,
+        }
+
+class ContentAnalyzer:
+    """
+    Catches ingests that keep producing segments with nothing in them: a
+    black or frozen picture, or muted audio.
+
+    One worker takes the newest segment of one live stream key every
+    `interval` seconds, round robin, and runs black, freeze and silence
+    detection over a downscaled copy at low priority. The cost stays at one
+    short ffmpeg at a time no matter how many streams the node ingests. A
+    stream only counts as bad after `bad_checks` bad segments in a row.
+    """
+
+    def __init__(self, hls_monitor, interval=10):
+        self.hls_monitor = hls_monitor
+        self.interval = interval
+        self.black_ratio = 0.9
+        self.freeze_ratio = 0.9
+        self.silence_ratio = 0.9
+        self.silence_db = -50
+        self.bad_checks = 2
+        self.streams = {}
+        self.next_index = 0
+
+    def configure(self, config):
+        for key, attribute in CONFIG_KEYS.items():
+            if config.get(key) in (None, ""):
+                continue
+            try:
+                setattr(self, attribute, float(config[key]))
+            except (TypeError, ValueError):
+                print(f"Ignoring invalid {key}: {config[key]}")
+
+    def problems(self, stream_key):
+        """ What's wrong with the stream's content, empty while it looks fine or hasn't been checked. """
+        content = self.streams.get(stream_key)
+        if not content or content.bad_streak < self.bad_checks:
+            return []
+        return content.problems
+
+    def status(self):
+        return {key: content.as_dict() for key, content in self.streams.items()}
+
+    def next_stream_key(self):
+        keys = [key for key in self.hls_monitor.playlists if self.hls_monitor.is_live(key)]
+        if not keys:
+            return None
+        self.next_index = (self.next_index + 1) % len(keys)
+        return keys[self.next_index]
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+
+            stream_key = self.next_stream_key()
+            if not stream_key:
+                continue
+
+            try:
+                await self.analyse(stream_key)
+            except Exception as e:
+                print(f"Content check of {stream_key} failed", e)
+
+    async def analyse(self, stream_key):
+        path, duration = self.hls_monitor.playlists[stream_key].newest_segment()
+        content = self.streams.setdefault(stream_key, StreamContent())
+        if not path or path == content.segment:
+            return
+
+        process = await asyncio.create_subprocess_exec(
+            "nice", "-n", "10", "/usr/bin/ffmpeg", "-hide_banner", "-nostats", "-threads", "1", "-i", path,
+            "-vf", "scale=160:-2,blackdetect=d=0.1:pix_th=0.1,freezedetect=n=-60dB:d=0.5",
+            "-af", f"silencedetect=noise={self.silence_db}dB:d=0.5",
+            "-f", "null", "-",
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        _, stderr = await process.communicate()
+        if process.returncode != 0:
+            # nginx may have cleaned the segment up already, try the next one
+            return
+
+        events = [(name, float(value)) for name, value in EVENT.findall(stderr.decode(errors="replace"))]
+        duration = duration or max((value for _, value in events), default=0) or 1
+
+        ratios = {
+            BLACK: covered_seconds(events, "black", duration) / duration,
+            FROZEN: covered_seconds(events, "freeze", duration) / duration,
+            SILENT: covered_seconds(events, "silence", duration) / duration,
+        }
+        limits = {BLACK: self.black_ratio, FROZEN: self.freeze_ratio, SILENT: self.silence_ratio}
+
+        content.segment = path
+        content.ratios = {problem: round(min(1.0, ratio), 2) for problem, ratio in ratios.items()}
+        content.problems = [problem for problem, ratio in ratios.items() if ratio >= limits[problem]]
+        content.bad_streak = content.bad_streak + 1 if content.problems else 0
+        content.checked_at = time.time()
+
+        if content.problems:
+            print(f"{stream_key} segment is {', '.join(content.problems)}", content.ratios)
@@ -0,0 +1,152 @@
+import asyncio
+import json
+from uuid import uuid4
+
+import aiohttp
+
+class ChannelClosed(Exception):
+    pass
+
+class ControlChannel:
+    """
+    Long-lived WebSocket from this node to the webserver.
+
+    Carries status pushes and events up, commands down, and correlates
+    requests with their responses by id in both directions. Outgoing frames
+    go through a bounded queue drained by one writer, so callers wait when
+    the link is slow instead of queueing without limit. The connection is
+    re-established with backoff whenever it drops.
+    """
+
+    def __init__(self, url, headers=None, queue_size=100, request_timeout=10):
+        self.url = url
+        self.headers = headers or {}  # Carries the node secret
+        self.request_timeout = request_timeout
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.handlers = {}
+        self.connect_callbacks = []
+        self.pending = {}
+        self.ws = None
+        self.connected = asyncio.Event()
+
+    def on(self, method):
+        """ Register `handler(data)` for requests the webserver sends with this method. """
+        def decorator(handler):
+            self.handlers[method] = handler
+            return handler
+        return decorator
+
+    def on_connect(self, callback):
+        self.connect_callbacks.append(callback)
+
+    def is_connected(self):
+        return self.connected.is_set()
+
+    async def wait_connected(self, timeout):
+        try:
+            await asyncio.wait_for(self.connected.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def request(self, method, data=None, timeout=None):
+        if not self.is_connected():
+            raise ChannelClosed(method)
+
+        timeout = timeout or self.request_timeout
+        request_id = uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+
+        try:
+            await asyncio.wait_for(self.queue.put({"type": "request", "id": request_id, "method": method, "data": data or {}}), timeout)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def event(self, method, data=None):
+        """ Send an event that needs no answer. Returns False if the channel is down. """
+        if not self.is_connected():
+            return False
+        await self.queue.put({"type": "event", "method": method, "data": data or {}})
+        return True
+
+    async def run(self):
+        backoff = 1
+
+        async with aiohttp.ClientSession() as session:
+            while True:
+                try:
+                    async with session.ws_connect(self.url, headers=self.headers, heartbeat=20) as ws:
+                        print("Control channel connected")
+                        backoff = 1
+                        await self.serve(ws)
+                except Exception as e:
+                    print("Control channel failed", e)
+                finally:
+                    self.disconnected()
+
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    async def serve(self, ws):
+        self.ws = ws
+        self.connected.set()
+        writer = asyncio.create_task(self.write_loop(ws))
+
+        for callback in self.connect_callbacks:
+            asyncio.create_task(callback())
+
+        try:
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    break
+                await self.dispatch(json.loads(msg.data))
+        finally:
+            writer.cancel()
+
+    async def write_loop(self, ws):
+        while True:
+            message = await self.queue.get()
+            await ws.send_str(json.dumps(message, default=str, separators=(",", ":")))
+
+    def disconnected(self):
+        self.ws = None
+        self.connected.clear()
+
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ChannelClosed())
+
+        # Anything still queued was meant for the old connection
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    async def dispatch(self, message):
+        kind = message.get("type")
+
+        if kind == "response":
+            future = self.pending.get(message.get("id"))
+            if future and not future.done():
+                if message.get("ok"):
+                    future.set_result(message.get("data"))
+                else:
+                    future.set_exception(Exception(message.get("error", "Request failed")))
+        elif kind == "request":
+            asyncio.create_task(self.answer(message))
+
+    async def answer(self, message):
+        response = {"type": "response", "id": message.get("id")}
+        handler = self.handlers.get(message.get("method"))
+
+        try:
+            if not handler:
+                raise Exception(f"Unknown method {message.get('method')}")
+            response["data"] = await handler(message.get("data") or {})
+            response["ok"] = True
+        except Exception as e:
+            response["ok"] = False
+            response["error"] = getattr(e, "detail", None) or str(e)
+
+        if self.is_connected():
+            await self.queue.put(response)
@@ -0,0 +1,73 @@
+import math
+import os
+import time
+
+# nginx keeps this much of every ingest on disk (hls_playlist_length in nginx.conf)
+HLS_PLAYLIST_LENGTH = float(os.getenv("HLS_PLAYLIST_LENGTH", "30"))
+# Leave a couple of fragments of headroom so the segment we start on isn't cleaned up under us
+MAX_DELAY = HLS_PLAYLIST_LENGTH - 6
+
+class DelayBuffer:
+    """
+    Plays a local ingest out `delay` seconds behind live, so a short source
+    dropout is bridged from what is already buffered instead of failing
+    over.
+
+    The buffer is the HLS segments nginx already keeps on disk: the feeder
+    reads the playlist starting `delay` seconds back from the live edge, in
+    real time. The fill level is tracked from the segments that arrive
+    against the time that passes, since the reader consumes one second of
+    media per second.
+    """
+
+    def __init__(self, state, delay, low_water=4):
+        self.state = state  # hls_monitor PlaylistState of the source
+        self.delay = min(delay, MAX_DELAY)
+        self.low_water = low_water
+        self.fragment = state.target_duration or 3
+        self.segments = max(1, math.ceil(self.delay / self.fragment))
+
+        # What we start with is whatever is behind the live edge, at most `segments` of it
+        available = list(state.segments)[-self.segments:]
+        self.fill = sum(duration or self.fragment for _, duration, _ in available)
+        self.last_sequence = state.last_sequence
+        self.updated = time.monotonic()
+
+    @property
+    def stream_key(self):
+        return self.state.stream_key
+
+    def input_args(self):
+        """ ffmpeg input options and input for reading the playlist `delay` seconds behind live. """
+        return f"-live_start_index -{self.segments}", self.state.path
+
+    def update(self, now=None):
+        now = now or time.monotonic()
+
+        if self.last_sequence is not None and self.state.last_sequence is not None \
+                and self.state.last_sequence < self.last_sequence:
+            # The publisher restarted its sequence numbers
+            self.last_sequence = self.state.last_sequence
+
+        arrived = 0.0
+        for sequence, duration, _ in self.state.segments:
+            if self.last_sequence is None or sequence > self.last_sequence:
+                arrived += duration or self.fragment
+        if self.state.last_sequence is not None:
+            self.last_sequence = self.state.last_sequence
+
+        # The reader waits once it catches up with live, so the buffer never goes negative
+        self.fill = max(0.0, self.fill + arrived - (now - self.updated))
+        self.updated = now
+
+    def running_dry(self):
+        return self.fill <= self.low_water
+
+    def as_dict(self):
+        return {
+            "stream_key": self.stream_key,
+            "delay": self.delay,
+            "fill": round(self.fill, 1),
+            "fill_ratio": round(self.fill / self.delay, 2) if self.delay else 0,
+            "low_water": self.low_water,
+        }
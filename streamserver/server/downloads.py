@@ -0,0 +1,259 @@
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import yt_dlp
+from yt_dlp.extractor.youtube import YoutubeIE
+
+# Downloaded backup videos, one <video id>.mp4 (plus a .json record) per video
+VIDEO_CACHE_DIR = os.path.abspath(os.getenv("VIDEO_CACHE_DIR", "videos"))
+VIDEO_CACHE_MAX = int(os.getenv("VIDEO_CACHE_MAX", "10"))
+# Finished jobs stay listed this long, and at most this many of them
+DOWNLOAD_JOB_TTL = int(os.getenv("DOWNLOAD_JOB_TTL", "3600"))
+DOWNLOAD_JOBS_MAX = int(os.getenv("DOWNLOAD_JOBS_MAX", "50"))
+
+QUEUED = "queued"
+DOWNLOADING = "downloading"
+FINISHED = "finished"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+class DownloadJob:
+    def __init__(self, url, channel=None):
+        self.id = uuid4().hex
+        self.url = url
+        self.channel = channel  # Channel the video is the backup for
+        self.video_id = None
+        self.state = QUEUED
+        self.path = None
+        self.cached = False
+        self.downloaded_bytes = 0
+        self.total_bytes = None
+        self.speed = None
+        self.eta = None
+        self.error = None
+        self.created_at = datetime.utcnow()
+        self.finished_at = None
+        self.cancelled = False
+
+    @property
+    def progress(self):
+        if self.state == FINISHED:
+            return 100.0
+        if not self.total_bytes:
+            return None
+        return round(100.0 * self.downloaded_bytes / self.total_bytes, 1)
+
+    def as_dict(self):
+        return {
+            "job_id": self.id,
+            "url": self.url,
+            "channel": self.channel,
+            "video_id": self.video_id,
+            "state": self.state,
+            "progress": self.progress,
+            "downloaded_bytes": self.downloaded_bytes,
+            "total_bytes": self.total_bytes,
+            "speed": self.speed,
+            "eta": self.eta,
+            "path": self.path,
+            "cached": self.cached,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+class DownloadManager:
+    """
+    Runs yt-dlp downloads on a small worker pool so they never block the
+    event loop, and keeps the results in a cache keyed by video ID.
+
+    Asking for a video that's already cached finishes the job right away
+    without touching the network.
+    """
+
+    def __init__(self, cache_dir=VIDEO_CACHE_DIR, max_videos=VIDEO_CACHE_MAX, workers=2,
+                 job_ttl=DOWNLOAD_JOB_TTL, max_jobs=DOWNLOAD_JOBS_MAX):
+        self.cache_dir = cache_dir
+        self.max_videos = max_videos
+        self.job_ttl = job_ttl
+        self.max_jobs = max_jobs
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="download")
+        self.jobs = {}
+        self.complete_callbacks = []
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def on_complete(self, callback):
+        """ Register an async `callback(job)` run on the event loop when a job finishes. """
+        self.complete_callbacks.append(callback)
+
+    def video_path(self, video_id):
+        return os.path.join(self.cache_dir, f"{video_id}.mp4")
+
+    def record_path(self, video_id):
+        return os.path.join(self.cache_dir, f"{video_id}.json")
+
+    def lookup(self, video_id):
+        """ Cached path for `video_id`, or None. """
+        path = self.video_path(video_id)
+        return path if os.path.isfile(path) else None
+
+    def cached_videos(self):
+        videos = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.cache_dir, name), 'r') as file:
+                    record = json.load(file)
+            except (OSError, ValueError):
+                continue
+            if self.lookup(record.get("video_id", "")):
+                videos.append(record)
+        return sorted(videos, key=lambda record: record.get("last_used", 0), reverse=True)
+
+    def touch(self, video_id):
+        """ Mark a cached video as just used, so it's the last to be evicted. """
+        try:
+            with open(self.record_path(video_id), 'r') as file:
+                record = json.load(file)
+        except (OSError, ValueError):
+            record = {"video_id": video_id, "path": self.video_path(video_id)}
+
+        record["last_used"] = time.time()
+        with open(self.record_path(video_id), 'w') as file:
+            json.dump(record, file)
+
+    def evict(self, keep=()):
+        """ Drop the least recently used videos past `max_videos`, never the paths in `keep`. """
+        for record in self.cached_videos()[self.max_videos:]:
+            if record.get("path") in keep:
+                continue
+            for path in (self.video_path(record["video_id"]), self.record_path(record["video_id"])):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            print("Evicted cached video", record["video_id"])
+
+    def remove_partial(self, video_id):
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(f"{video_id}.") and name.endswith((".part", ".ytdl")):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+
+    def prune(self):
+        """ Forget finished jobs older than `job_ttl`, and the oldest ones past `max_jobs`. Running jobs stay. """
+        finished = sorted((job for job in self.jobs.values() if job.finished_at), key=lambda job: job.finished_at)
+        cutoff = datetime.utcnow() - timedelta(seconds=self.job_ttl)
+        for index, job in enumerate(finished):
+            if job.finished_at < cutoff or index < len(finished) - self.max_jobs:
+                del self.jobs[job.id]
+
+    def submit(self, url, channel=None):
+        self.prune()
+        job = DownloadJob(url, channel)
+        self.jobs[job.id] = job
+
+        video_id = YoutubeIE.get_temp_id(url) if YoutubeIE.suitable(url) else None
+        if video_id and self.lookup(video_id):
+            job.video_id = video_id
+            job.path = self.lookup(video_id)
+            job.cached = True
+            job.state = FINISHED
+            job.finished_at = datetime.utcnow()
+            self.touch(video_id)
+
+        asyncio.create_task(self.run(job))
+        return job
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job and job.state in (QUEUED, DOWNLOADING):
+            job.cancelled = True
+        return job
+
+    async def run(self, job):
+        if job.state == QUEUED:
+            try:
+                await asyncio.get_running_loop().run_in_executor(self.executor, self.download, job)
+            except Exception as e:
+                job.state = FAILED
+                job.error = str(e)
+                job.finished_at = datetime.utcnow()
+                print(f"Download {job.url} failed", e)
+                return
+
+        if job.state != FINISHED:
+            return
+
+        for callback in self.complete_callbacks:
+            try:
+                await callback(job)
+            except Exception as e:
+                print("Download complete callback failed", e)
+
+    def download(self, job):
+        """ Runs on a worker thread. """
+        if job.cancelled:
+            job.state = CANCELLED
+            job.finished_at = datetime.utcnow()
+            return
+
+        job.state = DOWNLOADING
+
+        def progress_hook(d):
+            if job.cancelled:
+                raise yt_dlp.utils.DownloadCancelled()
+            job.downloaded_bytes = d.get("downloaded_bytes") or job.downloaded_bytes
+            job.total_bytes = d.get("total_bytes") or d.get("total_bytes_estimate") or job.total_bytes
+            job.speed = d.get("speed")
+            job.eta = d.get("eta")
+
+        ydl_opts = {
+            'format': 'best[ext=mp4]/best',
+            'outtmpl': os.path.join(self.cache_dir, '%(id)s.%(ext)s'),
+            'merge_output_format': 'mp4',  # Ensure the output is MP4 if video and audio are separate
+            'postprocessors': [{'key': 'FFmpegVideoRemuxer', 'preferedformat': 'mp4'}],
+            'progress_hooks': [progress_hook],
+            'quiet': True,
+            'noprogress': True,
+        }
+
+        try:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(job.url, download=False)
+                job.video_id = info["id"]
+
+                if not self.lookup(job.video_id):
+                    ydl.process_ie_result(info, download=True)
+        except yt_dlp.utils.DownloadCancelled:
+            job.state = CANCELLED
+            job.finished_at = datetime.utcnow()
+            self.remove_partial(job.video_id)
+            return
+
+        job.path = self.lookup(job.video_id)
+        if not job.path:
+            raise Exception(f"yt-dlp did not produce {self.video_path(job.video_id)}")
+
+        with open(self.record_path(job.video_id), 'w') as file:
+            json.dump({
+                "video_id": job.video_id,
+                "title": info.get("title"),
+                "url": job.url,
+                "path": job.path,
+                "duration": info.get("duration"),
+                "size": os.path.getsize(job.path),
+                "downloaded_at": time.time(),
+                "last_used": time.time(),
+            }, file)
+
+        job.state = FINISHED
+        job.finished_at = datetime.utcnow()
@@ -0,0 +1,128 @@
+import time
+
+DEFAULT_CHAIN = ("stream1", "stream2", "mp4")
+
+# Node config keys (all optional) and the attribute each one sets
+CONFIG_KEYS = {
+    "failover_up_ticks": "up_ticks",
+    "failover_down_ticks": "down_ticks",
+    "failover_min_dwell": "min_dwell",
+}
+
+def parse_chain(value):
+    """ A chain from config, either a list or "stream1,stream2,mp4". """
+    if isinstance(value, str):
+        value = value.split(",")
+    chain = []
+    for source in value or []:
+        source = source.strip()
+        if source in DEFAULT_CHAIN and source not in chain:
+            chain.append(source)
+    return chain or list(DEFAULT_CHAIN)
+
+class SourceState:
+    def __init__(self):
+        self.live = None  # Last probe result
+        self.healthy = None  # After hysteresis
+        self.streak = 0  # Consecutive probes with the same result
+        self.changed_at = None
+
+    def as_dict(self):
+        return {"live": self.live, "healthy": self.healthy, "streak": self.streak}
+
+class FailoverChain:
+    """
+    Ordered list of sources a channel falls back through, best first.
+
+    Every source is probed on every tick. A source only counts as healthy
+    after `up_ticks` live probes in a row and as down after `down_ticks`
+    failed ones, so a flapping input doesn't bounce the stream around. When
+    the active source goes down the channel moves straight to the best
+    healthy source; when a better source comes back it climbs back up, but
+    never sooner than `min_dwell` seconds after the last switch.
+    """
+
+    def __init__(self, order=DEFAULT_CHAIN):
+        self.order = list(order)
+        self.up_ticks = 3
+        self.down_ticks = 3
+        self.min_dwell = 15
+        self.sources = {source: SourceState() for source in DEFAULT_CHAIN}
+        self.last_switch = None
+
+    def configure(self, config):
+        if "failover_chain" in config:
+            self.order = parse_chain(config["failover_chain"])
+
+        for key, attribute in CONFIG_KEYS.items():
+            if config.get(key) in (None, ""):
+                continue
+            try:
+                setattr(self, attribute, float(config[key]))
+            except (TypeError, ValueError):
+                print(f"Ignoring invalid {key}: {config[key]}")
+
+    def update(self, results, now=None):
+        """ Feed one tick of probe results, {source: live}. """
+        now = now or time.monotonic()
+
+        for source, live in results.items():
+            state = self.sources[source]
+            state.streak = state.streak + 1 if live == state.live else 1
+            state.live = live
+
+            # A source seen live on its first probe is trusted right away, so startup doesn't wait
+            if live and not state.healthy and (state.healthy is None or state.streak >= self.up_ticks):
+                state.healthy = True
+                state.changed_at = now
+            elif not live and state.healthy is not False and state.streak >= self.down_ticks:
+                state.healthy = False
+                state.changed_at = now
+
+    def is_live(self, source):
+        return bool(self.sources[source].live)
+
+    def is_healthy(self, source):
+        return bool(self.sources[source].healthy)
+
+    def failures(self, source):
+        """ Consecutive failed probes of `source`. """
+        state = self.sources[source]
+        return state.streak if state.live is False else 0
+
+    def best(self):
+        return next((source for source in self.order if self.is_healthy(source)), None)
+
+    def decide(self, active, now=None):
+        """ The source to switch to, or None to stay on `active`. """
+        now = now or time.monotonic()
+        target = self.best()
+
+        if target is None or target == active:
+            return None
+
+        if self.sources[active].healthy is False or active not in self.order:
+            return target
+
+        if self.order.index(target) > self.order.index(active):
+            # Active isn't confirmed down yet, don't step down on a hunch
+            return None
+
+        # Active is fine and a better source is back, climb up once we've settled
+        if self.last_switch is not None and now - self.last_switch < self.min_dwell:
+            return None
+        return target
+
+    def switched(self, now=None):
+        self.last_switch = now or time.monotonic()
+
+    def promote(self, source):
+        """ Make `source` the preferred one, e.g. after someone picks it by hand. """
+        self.order = [source] + [other for other in self.order if other != source]
+
+    def status(self):
+        return {
+            "chain": list(self.order),
+            "best": self.best(),
+            "sources": {source: state.as_dict() for source, state in self.sources.items()},
+        }
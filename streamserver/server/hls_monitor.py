@@ -0,0 +1,206 @@
+import asyncio
+import os
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+# nginx-rtmp writes the playlists for `application live` here (see hls_path in nginx.conf)
+HLS_PATH = os.getenv("HLS_PATH", "/var/www/html/streams/hls")
+
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+def read_playlist(text):
+    """ (media sequence, target duration, [(duration, uri)]) of a media playlist, ValueError if it is malformed. """
+    media_sequence = 0
+    target_duration = None
+    duration = None
+    entries = []
+
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        if line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            media_sequence = int(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-TARGETDURATION:"):
+            target_duration = float(line.split(":", 1)[1])
+        elif line.startswith("#EXTINF:"):
+            duration = float(line.split(":", 1)[1].split(",", 1)[0])
+        elif not line.startswith("#"):
+            entries.append((duration, line))
+            duration = None
+
+    return media_sequence, target_duration, entries
+
+class PlaylistState:
+    """ Everything we know about one stream key's playlist. """
+
+    def __init__(self, stream_key):
+        self.stream_key = stream_key
+        self.path = os.path.join(HLS_PATH, f"{stream_key}.m3u8")
+        self.signature = None  # (inode, mtime_ns, size) of the last parsed version
+        self.media_sequence = None
+        self.last_sequence = None  # Highest segment sequence number seen so far
+        self.target_duration = None
+        self.segments = deque(maxlen=32)  # (sequence, duration, arrival monotonic time)
+        self.last_advance = None  # Monotonic time the newest segment showed up
+        self.newest_uri = None  # File name of the newest segment in the playlist
+        self.last_checked = None
+
+    def age(self, now=None):
+        if self.last_advance is None:
+            return None
+        return (now or time.monotonic()) - self.last_advance
+
+    def newest_segment(self):
+        """ Path and duration of the newest segment on disk, or (None, None). """
+        if not self.newest_uri:
+            return None, None
+        duration = self.segments[-1][1] if self.segments else None
+        return os.path.join(HLS_PATH, self.newest_uri), duration
+
+    def as_dict(self):
+        age = self.age()
+        return {
+            "stream_key": self.stream_key,
+            "media_sequence": self.media_sequence,
+            "last_sequence": self.last_sequence,
+            "target_duration": self.target_duration,
+            "segment_age": round(age, 3) if age is not None else None,
+        }
+
+class HLSMonitor:
+    """
+    Watches the HLS playlists nginx-rtmp writes to disk and keeps a cached
+    live/stale verdict per stream key.
+
+    A playlist only changes when nginx finishes a segment, so polling the
+    (inode, mtime, size) triple is enough to know when to re-read it. Only
+    segments with a sequence number past the last one we saw are counted
+    as new arrivals.
+    """
+
+    def __init__(self, max_age_seconds=10, poll_interval=1.0):
+        self.max_age_seconds = max_age_seconds
+        self.poll_interval = poll_interval
+        self.playlists: dict = {}
+
+    def watch(self, stream_key):
+        if stream_key not in self.playlists:
+            self.playlists[stream_key] = PlaylistState(stream_key)
+            self.refresh(self.playlists[stream_key])
+        return self.playlists[stream_key]
+
+    def unwatch(self, stream_key):
+        self.playlists.pop(stream_key, None)
+
+    def stream_key_for_url(self, url):
+        """
+        Return the local stream key for an RTMP URL, or None if the stream
+        is not ingested by this node's nginx.
+        """
+        if not url or not url.startswith("rtmp://"):
+            return None
+
+        parsed = urlparse(url)
+        stream_key = parsed.path.rstrip("/").split("/")[-1]
+        if not stream_key:
+            return None
+
+        if stream_key in self.playlists or parsed.hostname in LOCAL_HOSTS \
+                or os.path.isfile(os.path.join(HLS_PATH, f"{stream_key}.m3u8")):
+            return stream_key
+
+        return None
+
+    def is_live(self, stream_key):
+        state = self.watch(stream_key)
+        age = state.age()
+        if age is None:
+            return False
+
+        stale_after = self.max_age_seconds
+        if state.target_duration:
+            stale_after = max(stale_after, state.target_duration * 3)
+
+        return age < stale_after
+
+    def status(self):
+        return {key: dict(state.as_dict(), live=self.is_live(key)) for key, state in self.playlists.items()}
+
+    def refresh(self, state):
+        state.last_checked = time.monotonic()
+
+        try:
+            st = os.stat(state.path)
+        except FileNotFoundError:
+            state.signature = None
+            return
+        except OSError as e:
+            print("Failed to stat playlist", state.path, e)
+            return
+
+        signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if signature == state.signature:
+            return
+
+        try:
+            with open(state.path, 'r') as file:
+                text = file.read()
+        except OSError as e:
+            print("Failed to read playlist", state.path, e)
+            return
+
+        first_read = state.signature is None and state.last_sequence is None
+        state.signature = signature
+
+        # On the first read we can't know when the segments arrived, so date the newest
+        # one by the file's mtime instead of "now" or a dead playlist would look live.
+        arrival = time.monotonic()
+        if first_read:
+            arrival -= max(0.0, time.time() - st.st_mtime_ns / 1e9)
+
+        self.parse(state, text, arrival)
+
+    def parse(self, state, text, arrival):
+        try:
+            media_sequence, target_duration, entries = read_playlist(text)
+        except ValueError as e:
+            # Malformed or caught half written, it stays stale until a good read
+            print("Failed to parse playlist", state.path, e)
+            state.signature = None
+            return
+
+        if target_duration is not None:
+            state.target_duration = target_duration
+
+        sequence = media_sequence
+        for duration, uri in entries:
+            state.newest_uri = uri
+
+            if state.last_sequence is None or sequence > state.last_sequence:
+                state.segments.append((sequence, duration, arrival))
+                state.last_sequence = sequence
+                state.last_advance = arrival
+
+            sequence += 1
+
+        # A restarted publisher can reset the sequence, start counting again from there
+        if state.media_sequence is not None and media_sequence < state.media_sequence:
+            state.last_sequence = sequence - 1
+            state.last_advance = arrival
+
+        state.media_sequence = media_sequence
+
+    def poll(self):
+        for state in list(self.playlists.values()):
+            self.refresh(state)
+
+    async def run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                print("HLS monitor poll failed", e)
+            await asyncio.sleep(self.poll_interval)
@@ -0,0 +1,193 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from uuid import uuid4
+
+# Channel states
+STOPPED = "stopped"
+STARTING = "starting"
+STREAMING = "streaming"
+STOPPING = "stopping"
+FAILED = "failed"  # The last start raised, the health loop will try again
+
+# Commands. START and STOP replace whatever is queued; RETUNE (live config
+# tweaks), SYNC (destination changes) and RECONNECT (failed relay outputs)
+# are folded into a queued START, which rebuilds everything from config anyway.
+START = "start"
+STOP = "stop"
+RETUNE = "retune"
+SYNC = "sync"
+RECONNECT = "reconnect"
+PARTIAL = (RETUNE, SYNC, RECONNECT)
+
+# Command states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+SUPERSEDED = "superseded"
+SKIPPED = "skipped"
+ERROR = "error"
+
+class Command:
+    def __init__(self, kind, reason, automatic=False, url=None, keys=()):
+        self.id = uuid4().hex
+        self.kind = kind
+        self.reason = reason
+        self.automatic = automatic  # From the health loop rather than someone asking
+        self.url = url  # Stream this instead of the active source
+        self.keys = list(keys)  # Config keys to retune, or destinations to reconnect
+        self.state = QUEUED
+        self.superseded_by = None
+        self.merged = []  # Reasons of commands folded into this one
+        self.error = None
+        self.created_at = datetime.utcnow()
+        self.finished_at = None
+
+    def supersede(self, other):
+        self.state = SUPERSEDED
+        self.superseded_by = other.id
+        self.finished_at = datetime.utcnow()
+        other.merged += self.merged + [self.reason]
+
+    def as_dict(self):
+        return {
+            "command_id": self.id,
+            "kind": self.kind,
+            "reason": self.reason,
+            "automatic": self.automatic,
+            "state": self.state,
+            "superseded_by": self.superseded_by,
+            "merged": self.merged,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+class ChannelLifecycle:
+    """
+    Serialises everything that starts, stops or restarts a channel's
+    pipelines.
+
+    Callers submit a command and get its ID back straight away; one worker
+    runs the commands in order. A command waits `coalesce_seconds` after the
+    last submit before it runs, and commands that are still queued when a
+    newer one arrives are merged into it, so a burst of switches ends in a
+    single restart. Commands from the health loop never replace one that
+    someone asked for.
+    """
+
+    def __init__(self, name, coalesce_seconds=0.5, history=50):
+        self.name = name
+        self.coalesce_seconds = coalesce_seconds
+        self.state = STOPPED
+        self.pending = deque()
+        self.current = None
+        self.commands = OrderedDict()  # Recent commands by ID, for status lookups
+        self.history = history
+        self.last_submit = 0.0
+        self.wakeup = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.task = None
+
+    @property
+    def busy(self):
+        """ Whether a command is running or waiting, the health loop holds off meanwhile. """
+        return self.current is not None or bool(self.pending)
+
+    def start(self, execute, streaming=False):
+        """ Start the worker, `execute(command)` does the actual work and returns the resulting state. """
+        self.state = STREAMING if streaming else STOPPED
+        self.task = asyncio.create_task(self.run(execute))
+
+    async def settle(self):
+        """ Wait until nothing is running or queued. """
+        while self.busy:
+            self.idle.clear()
+            await self.idle.wait()
+
+    def close(self):
+        if self.task:
+            self.task.cancel()
+        for command in self.pending:
+            command.state = SKIPPED
+        self.pending.clear()
+
+    def submit(self, kind, reason, automatic=False, url=None, keys=()):
+        command = Command(kind, reason, automatic, url, keys)
+        self.remember(command)
+        self.last_submit = time.monotonic()
+
+        full = next((queued for queued in self.pending if queued.kind not in PARTIAL), None)
+
+        if automatic and full and kind not in PARTIAL:
+            # The queued START or STOP already rebuilds from the current config
+            command.supersede(full)
+        elif kind in PARTIAL:
+            same = next((queued for queued in self.pending if queued.kind == kind), None)
+            if full:
+                command.supersede(full)
+            elif same:
+                same.keys = sorted(set(same.keys) | set(command.keys))
+                command.supersede(same)
+            else:
+                self.pending.append(command)
+        else:
+            for queued in self.pending:
+                queued.supersede(command)
+            self.pending.clear()
+            self.pending.append(command)
+
+        self.wakeup.set()
+        return command
+
+    def remember(self, command):
+        self.commands[command.id] = command
+        while len(self.commands) > self.history:
+            self.commands.popitem(last=False)
+
+    def get(self, command_id):
+        return self.commands.get(command_id)
+
+    async def run(self, execute):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+
+            while self.pending:
+                # Let a burst finish arriving before acting on it
+                quiet = time.monotonic() - self.last_submit
+                if quiet < self.coalesce_seconds:
+                    await asyncio.sleep(self.coalesce_seconds - quiet)
+                    continue
+
+                command = self.current = self.pending.popleft()
+                command.state = RUNNING
+                previous = self.state
+                if command.kind == START:
+                    self.state = STARTING
+                elif command.kind == STOP:
+                    self.state = STOPPING
+
+                try:
+                    self.state = await execute(command) or previous
+                    command.state = DONE if command.state == RUNNING else command.state
+                except Exception as e:
+                    print(f"Channel {self.name} {command.kind} failed", e)
+                    command.state = ERROR
+                    command.error = str(e)
+                    if command.kind == START:
+                        self.state = FAILED
+                finally:
+                    command.finished_at = datetime.utcnow()
+                    self.current = None
+
+            self.idle.set()
+
+    def status(self):
+        return {
+            "state": self.state,
+            "current": self.current.as_dict() if self.current else None,
+            "pending": [command.as_dict() for command in self.pending],
+            "recent": [command.as_dict() for command in list(self.commands.values())[-5:]],
+        }
@@ -0,0 +1,180 @@
+import math
+import threading
+import time
+from array import array
+
+import psutil
+
+class RingBuffer:
+    """ Fixed-size ring of floats backed by an array, oldest values get overwritten. """
+
+    def __init__(self, size):
+        self.size = size
+        self.data = array('d', [math.nan]) * size
+        self.index = 0
+        self.count = 0
+
+    def push(self, value):
+        self.data[self.index] = math.nan if value is None else value
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def last(self, n=None):
+        """ The newest `n` values (all of them by default), oldest first. """
+        n = self.count if n is None else min(n, self.count)
+        start = (self.index - n) % self.size
+        if start + n <= self.size:
+            return self.data[start:start + n].tolist()
+        return self.data[start:].tolist() + self.data[:self.index].tolist()
+
+    def average(self, n):
+        values = [value for value in self.last(n) if not math.isnan(value)]
+        return sum(values) / len(values) if values else None
+
+HOST_SERIES = ("time", "cpu", "ram", "net_sent", "net_recv")
+PROCESS_SERIES = ("time", "cpu", "rss", "read", "write")
+
+def clean(values):
+    return [None if math.isnan(value) else round(value, 2) for value in values]
+
+class MetricsSampler:
+    """
+    Samples host and per-pipeline resource usage on a background thread.
+
+    Counters (network bytes, process IO) are turned into per-second rates
+    from consecutive samples, so every value in the series is a rate over
+    exactly one sampling interval. `size` samples are kept per series, which
+    is the last 10 minutes at the default 1 s interval.
+    """
+
+    def __init__(self, pids, interval=1.0, size=600):
+        self.pids = pids  # Callable returning {pipeline name: pid}
+        self.interval = interval
+        self.size = size
+        self.lock = threading.Lock()
+        self.host = {name: RingBuffer(size) for name in HOST_SERIES}
+        self.processes = {}  # name -> {"pid", "process", "series", "last_io", "last_time"}
+        self.last_net = None
+        self.last_time = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        if self.thread:
+            return
+        psutil.cpu_percent(interval=None)  # Prime the counter, the first call always returns 0
+        self.thread = threading.Thread(target=self.run, name="metrics-sampler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                print("Metrics sample failed", e)
+
+    def sample(self):
+        now = time.time()
+        net = psutil.net_io_counters()
+        cpu = psutil.cpu_percent(interval=None)
+        ram = psutil.virtual_memory().percent
+
+        sent = recv = None
+        if self.last_net is not None:
+            elapsed = now - self.last_time
+            sent = (net.bytes_sent - self.last_net.bytes_sent) / elapsed
+            recv = (net.bytes_recv - self.last_net.bytes_recv) / elapsed
+        self.last_net = net
+        self.last_time = now
+
+        try:
+            pids = dict(self.pids())
+        except RuntimeError:
+            pids = {name: entry["pid"] for name, entry in self.processes.items()}
+
+        process_samples = {name: self.sample_process(name, pid, now) for name, pid in pids.items()}
+
+        with self.lock:
+            for name, value in zip(HOST_SERIES, (now, cpu, ram, sent, recv)):
+                self.host[name].push(value)
+
+            for name in list(self.processes):
+                if name not in pids:
+                    del self.processes[name]
+
+            for name, values in process_samples.items():
+                if values is None:
+                    continue
+                series = self.processes[name]["series"]
+                for key, value in zip(PROCESS_SERIES, values):
+                    series[key].push(value)
+
+    def sample_process(self, name, pid, now):
+        entry = self.processes.get(name)
+        if entry is None or entry["pid"] != pid:
+            try:
+                process = psutil.Process(pid)
+                process.cpu_percent(interval=None)
+            except psutil.Error:
+                return None
+            entry = {
+                "pid": pid,
+                "process": process,
+                "series": {key: RingBuffer(self.size) for key in PROCESS_SERIES},
+                "last_io": None,
+                "last_time": None,
+            }
+            with self.lock:
+                self.processes[name] = entry
+
+        process = entry["process"]
+        try:
+            with process.oneshot():
+                cpu = process.cpu_percent(interval=None)
+                rss = process.memory_info().rss
+                try:
+                    io = process.io_counters()
+                except (psutil.AccessDenied, AttributeError):
+                    io = None
+        except psutil.Error:
+            return None
+
+        read = write = None
+        if io is not None and entry["last_io"] is not None:
+            elapsed = now - entry["last_time"]
+            read = (io.read_bytes - entry["last_io"].read_bytes) / elapsed
+            write = (io.write_bytes - entry["last_io"].write_bytes) / elapsed
+        entry["last_io"] = io
+        entry["last_time"] = now
+
+        return (now, cpu, rss, read, write)
+
+    def samples_for(self, seconds):
+        return max(1, int(seconds / self.interval))
+
+    def host_average(self, name, seconds):
+        with self.lock:
+            return self.host[name].average(self.samples_for(seconds))
+
+    def pipeline_averages(self, seconds):
+        n = self.samples_for(seconds)
+        with self.lock:
+            return {
+                name: {key: entry["series"][key].average(n) for key in PROCESS_SERIES if key != "time"}
+                for name, entry in self.processes.items()
+            }
+
+    def history(self, seconds=600):
+        n = self.samples_for(seconds)
+        with self.lock:
+            return {
+                "interval": self.interval,
+                "host": {name: clean(buffer.last(n)) for name, buffer in self.host.items()},
+                "pipelines": {
+                    name: {key: clean(buffer.last(n)) for key, buffer in entry["series"].items()}
+                    for name, entry in self.processes.items()
+                },
+            }
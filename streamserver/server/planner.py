@@ -0,0 +1,303 @@
+import asyncio
+import json
+import os
+import time
+
+LOUDNESS_TARGET = "I=-16:TP=-1.5:LRA=11"
+TARGET_LUFS = -16
+LOUDNESS_TOLERANCE = 2  # LU either side of the target we leave alone
+
+# Named filter instances, so a running ffmpeg can be retuned with filter commands instead of restarted.
+# loudnorm has no runtime commands, so it always normalises to TARGET_LUFS and a volume stage after it
+# moves the output to the channel's own loudness target.
+DENOISE_FILTER = "afftdn@denoise"
+LOUDNESS_FILTER = "volume@loudness"
+
+# YouTube wants a keyframe at least every 4 s, we aim for 2 s when we encode
+MAX_KEYFRAME_INTERVAL = 4
+GOP_SECONDS = 2
+COPY_VIDEO_CODECS = ("h264",)
+COPY_AUDIO_CODECS = ("aac",)
+COPY_SAMPLE_RATES = (44100, 48000)
+
+PROBE_SECONDS = 8  # Enough to see two keyframes at the longest GOP we accept
+PROBE_TIMEOUT = 20
+
+# Pipeline paths, cheapest first
+COPY = "copy"
+AUDIO_TRANSCODE = "audio_transcode"
+REENCODE = "reencode"
+
+def parse_fps(rate):
+    try:
+        num, den = rate.split("/")
+        return float(num) / float(den) if float(den) else None
+    except (AttributeError, ValueError):
+        return None
+
+def keyframe_interval(packets, stream_index):
+    """ Longest gap between video keyframes in the probed packets, None if it can't be told. """
+    times = []
+    keyframes = []
+    for packet in packets:
+        if packet.get("stream_index") != stream_index or packet.get("pts_time") is None:
+            continue
+        pts = float(packet["pts_time"])
+        times.append(pts)
+        if "K" in packet.get("flags", ""):
+            keyframes.append(pts)
+
+    if len(keyframes) > 1:
+        return round(max(b - a for a, b in zip(keyframes, keyframes[1:])), 2)
+    if times and max(times) - min(times) > MAX_KEYFRAME_INTERVAL:
+        # A whole probe window with at most one keyframe, the GOP is at least this long
+        return round(max(times) - min(times), 2)
+    return None
+
+class Plan:
+    """ How one input gets to the output: what is copied, what is encoded and the single audio filtergraph. """
+
+    def __init__(self, video, audio, audio_filters, reasons, probe=None, rung=None):
+        self.video = video  # "copy" or "encode"
+        self.audio = audio
+        self.audio_filters = audio_filters
+        self.reasons = reasons
+        self.probe = probe
+        self.rung = rung  # Ladder rung ({"height", "video_bitrate"}) to encode at, if any
+
+    @property
+    def path(self):
+        if self.video == "encode":
+            return REENCODE
+        if self.audio == "encode":
+            return AUDIO_TRANSCODE
+        return COPY
+
+    def as_dict(self):
+        return {
+            "path": self.path,
+            "video": self.video,
+            "audio": self.audio,
+            "audio_filters": self.audio_filters,
+            "reasons": self.reasons,
+            "rung": self.rung,
+            "probe": self.probe,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["video"], data["audio"], data.get("audio_filters") or [], data.get("reasons") or [],
+                   data.get("probe"), data.get("rung"))
+
+class StreamPlanner:
+    """
+    Probes inputs without blocking the event loop and picks the cheapest
+    pipeline that still produces a valid stream.
+
+    A probe reads a few seconds of the input for codecs, pixel format, audio
+    layout and keyframe interval, and measures its loudness at the same time.
+    Results are cached for `ttl` seconds (and until a local file changes).
+    Live inputs take seconds to probe, so callers keep them warm with
+    `refresh` instead of waiting on `probe` when a stream starts.
+    """
+
+    def __init__(self, ttl=120):
+        self.ttl = ttl
+        self.cache = {}  # url -> (signature, probed_at, result)
+        self.inflight = {}
+
+    def signature(self, url):
+        if os.path.isfile(url):
+            st = os.stat(url)
+            return (st.st_size, st.st_mtime_ns)
+        return None
+
+    def cached(self, url):
+        entry = self.cache.get(url)
+        if not entry:
+            return None
+        signature, probed_at, result = entry
+        if time.monotonic() - probed_at > self.ttl or signature != self.signature(url):
+            return None
+        return result
+
+    def invalidate(self, url=None):
+        if url is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(url, None)
+
+    async def probe(self, url):
+        """ Probe result for `url`, or None if it couldn't be read. Concurrent callers share one probe. """
+        if not url:
+            return None
+
+        result = self.cached(url)
+        if result is not None:
+            return result
+
+        return await asyncio.shield(self.start_probe(url))
+
+    def refresh(self, url, ahead=0.25):
+        """ Probe `url` in the background if it has no cached result or it expires within `ahead` of the TTL. """
+        entry = self.cache.get(url)
+        if entry and entry[0] == self.signature(url) and time.monotonic() - entry[1] < self.ttl * (1 - ahead):
+            return
+        self.start_probe(url)
+
+    def start_probe(self, url):
+        if url not in self.inflight:
+            self.inflight[url] = asyncio.ensure_future(self.run_probe(url))
+            self.inflight[url].add_done_callback(lambda _: self.inflight.pop(url, None))
+        return self.inflight[url]
+
+    async def run_probe(self, url):
+        started = time.monotonic()
+        try:
+            streams, loudness = await asyncio.gather(self.probe_streams(url), self.measure_loudness(url))
+        except Exception as e:
+            print(f"Probing {url} failed", e)
+            return None
+
+        streams["loudness"] = loudness
+        streams["probe_seconds"] = round(time.monotonic() - started, 1)
+        self.cache[url] = (self.signature(url), time.monotonic(), streams)
+        return streams
+
+    async def run(self, *args):
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), PROBE_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise Exception(f"{args[0]} timed out after {PROBE_TIMEOUT}s")
+
+        if process.returncode != 0:
+            raise Exception(f"{args[0]} exited with {process.returncode}: {stderr.decode(errors='replace')[-300:]}")
+        return stdout.decode(errors="replace"), stderr.decode(errors="replace")
+
+    async def probe_streams(self, url):
+        stdout, _ = await self.run(
+            "ffprobe", "-v", "error", "-print_format", "json",
+            "-read_intervals", f"%+{PROBE_SECONDS}",
+            "-show_format", "-show_streams", "-show_entries", "packet=stream_index,pts_time,flags", url
+        )
+        data = json.loads(stdout)
+
+        video = next((s for s in data.get("streams", []) if s.get("codec_type") == "video"), None)
+        audio = next((s for s in data.get("streams", []) if s.get("codec_type") == "audio"), None)
+
+        result = {"video": None, "audio": None, "bit_rate": data.get("format", {}).get("bit_rate")}
+
+        if video:
+            result["video"] = {
+                "codec": video.get("codec_name"),
+                "pix_fmt": video.get("pix_fmt"),
+                "width": video.get("width"),
+                "height": video.get("height"),
+                "fps": parse_fps(video.get("avg_frame_rate")) or parse_fps(video.get("r_frame_rate")),
+                "keyframe_interval": keyframe_interval(data.get("packets", []), video.get("index")),
+            }
+
+        if audio:
+            result["audio"] = {
+                "codec": audio.get("codec_name"),
+                "channels": audio.get("channels"),
+                "channel_layout": audio.get("channel_layout"),
+                "sample_rate": int(audio.get("sample_rate") or 0) or None,
+            }
+
+        return result
+
+    async def measure_loudness(self, url):
+        """ Integrated loudness of the first few seconds, None when there's no audio to measure. """
+        try:
+            _, stderr = await self.run(
+                "/usr/bin/ffmpeg", "-hide_banner", "-nostats", "-i", url, "-t", str(PROBE_SECONDS), "-vn",
+                "-af", "loudnorm=print_format=json", "-f", "null", "-"
+            )
+            measured = json.loads(stderr[stderr.rindex("{"):stderr.rindex("}") + 1])
+            return float(measured["input_i"])
+        except Exception:
+            return None
+
+    def plan(self, probe, noise_reduction=0, loudness_target=TARGET_LUFS):
+        """ Pick copy, audio-only transcode or full re-encode for a probed input. """
+        loudness_filters = [f"loudnorm={LOUDNESS_TARGET}", f"{LOUDNESS_FILTER}=volume={loudness_target - TARGET_LUFS}dB"]
+        reasons = []
+        filters = []
+        video = "copy"
+        audio = "copy"
+
+        if probe is None:
+            # Nothing known about the input, keep the video and make the audio safe
+            return Plan("copy", "encode", loudness_filters, ["input not probed"])
+
+        v = probe.get("video")
+        if v:
+            if v["codec"] not in COPY_VIDEO_CODECS:
+                reasons.append(f"video codec {v['codec']}")
+            elif v["pix_fmt"] not in (None, "yuv420p", "yuvj420p"):
+                reasons.append(f"pixel format {v['pix_fmt']}")
+            elif v["keyframe_interval"] is None or v["keyframe_interval"] > MAX_KEYFRAME_INTERVAL:
+                reasons.append(f"keyframe interval {v['keyframe_interval']}s")
+            if reasons:
+                video = "encode"
+
+        a = probe.get("audio")
+        if a:
+            audio_reasons = []
+            if a["codec"] not in COPY_AUDIO_CODECS:
+                audio_reasons.append(f"audio codec {a['codec']}")
+            if a["channels"] != 1:
+                audio_reasons.append(f"{a['channels']} audio channels")
+            if a["sample_rate"] not in COPY_SAMPLE_RATES:
+                audio_reasons.append(f"sample rate {a['sample_rate']}")
+
+            loudness = probe.get("loudness")
+            if loudness is None or abs(loudness - loudness_target) > LOUDNESS_TOLERANCE:
+                audio_reasons.append(f"loudness {loudness} LUFS")
+                filters += loudness_filters
+
+            if noise_reduction > 0:
+                audio_reasons.append("noise reduction")
+                filters.insert(0, f"{DENOISE_FILTER}=nr={noise_reduction}")
+
+            if audio_reasons:
+                audio = "encode"
+                reasons += audio_reasons
+
+        return Plan(video, audio, filters, reasons, probe)
+
+    def output_args(self, plan, bitrate=None):
+        """ The codec arguments for `plan`, one audio filtergraph and encoder settings only where we encode. """
+        args = []
+
+        if plan.video == "encode":
+            fps = ((plan.probe or {}).get("video") or {}).get("fps") or 30
+            gop = round(fps * GOP_SECONDS)
+            bitrate = (plan.rung or {}).get("video_bitrate") or bitrate or 4500
+            if plan.rung and plan.rung.get("height"):
+                # Scale down to the rung, never up
+                args.append(f"-vf \"scale=-2:'min({plan.rung['height']},ih)'\"")
+            args += [
+                "-c:v libx264 -preset veryfast -pix_fmt yuv420p",
+                f"-b:v {bitrate}k -maxrate {bitrate}k -bufsize {bitrate * 2}k",
+                f"-g {gop} -keyint_min {gop} -sc_threshold 0",
+            ]
+        else:
+            args.append("-c:v copy")
+
+        if plan.audio == "encode":
+            if plan.audio_filters:
+                args.append(f'-af "{",".join(plan.audio_filters)}"')
+            args.append("-ac 1 -ar 48000 -c:a aac -b:a 128k")
+        else:
+            args.append("-c:a copy")
+
+        return " ".join(args)
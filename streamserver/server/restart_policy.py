@@ -0,0 +1,157 @@
+import time
+from collections import deque
+
+# Restart causes
+EXITED = "exited"
+SLOW = "slow"
+STALLED = "stalled"
+DROPPING = "dropping"
+INPUT_STALE = "input_stale"
+BAD_CONTENT = "bad_content"  # Input still arrives but is black, frozen or silent
+
+# Node config keys (all optional) and the attribute each one sets
+CONFIG_KEYS = {
+    "restart_min_speed": "min_speed",
+    "restart_slow_seconds": "slow_seconds",
+    "restart_stall_seconds": "stall_seconds",
+    "restart_max_new_drops": "max_new_drops",
+    "restart_grace_seconds": "grace_seconds",
+    "restart_backoff_base": "backoff_base",
+    "restart_backoff_max": "backoff_max",
+    "restart_healthy_seconds": "healthy_seconds",
+    "restart_breaker_restarts": "breaker_restarts",
+    "restart_breaker_window": "breaker_window",
+    "restart_breaker_cooldown": "breaker_cooldown",
+}
+
+class RestartPolicy:
+    """
+    Decides when a running stream should be restarted, based on pipeline
+    health rather than a timer.
+
+    A pipeline is unhealthy when it exited, has run below `min_speed` for
+    `slow_seconds`, has written nothing for `stall_seconds`, or dropped more
+    than `max_new_drops` frames in the last `slow_seconds`. Restarts back off
+    exponentially while the stream keeps failing, and more than
+    `breaker_restarts` restarts inside `breaker_window` opens a circuit
+    breaker that holds off restarts for `breaker_cooldown` seconds.
+    """
+
+    def __init__(self):
+        self.min_speed = 0.95
+        self.slow_seconds = 20
+        self.stall_seconds = 10
+        self.max_new_drops = 30
+        self.grace_seconds = 15  # Let a fresh pipeline settle before judging it
+        self.backoff_base = 2
+        self.backoff_max = 60
+        self.healthy_seconds = 60  # Healthy this long and the backoff resets
+        self.breaker_restarts = 5
+        self.breaker_window = 300
+        self.breaker_cooldown = 300
+
+        self.consecutive = 0
+        self.last_restart = None
+        self.breaker_open_until = None
+        self.recent_restarts = deque()
+        self.restarts_by_cause = {}
+        self.last_cause = None
+
+    def configure(self, config):
+        for key, attribute in CONFIG_KEYS.items():
+            if config.get(key) in (None, ""):
+                continue
+            try:
+                setattr(self, attribute, float(config[key]))
+            except (TypeError, ValueError):
+                print(f"Ignoring invalid {key}: {config[key]}")
+
+    def check(self, pipeline, tracker):
+        """ Return the reason `pipeline` needs a restart, or None if it looks healthy. """
+        if pipeline is None or not pipeline.is_running():
+            return EXITED
+
+        if pipeline.uptime < self.grace_seconds:
+            return None
+
+        if tracker is None:
+            # Adopted from an earlier run, no progress reports to go by, only whether it still does anything
+            return STALLED if pipeline.idle_seconds() >= self.stall_seconds else None
+
+        stall_window = tracker.window(self.stall_seconds)
+        if not stall_window:
+            return STALLED
+
+        sizes = [sample["total_size"] for sample in stall_window if sample["total_size"] is not None]
+        if len(sizes) > 1 and sizes[-1] <= sizes[0] \
+                and stall_window[-1]["time"] - stall_window[0]["time"] >= self.stall_seconds * 0.8:
+            return STALLED
+
+        if pipeline.uptime >= self.slow_seconds:
+            summary = tracker.summary(self.slow_seconds)
+            window = tracker.window(self.slow_seconds)
+            speeds = [sample["speed"] for sample in window if sample["speed"] is not None]
+
+            if speeds and max(speeds) < self.min_speed:
+                return SLOW
+
+            if summary and summary["new_drop_frames"] is not None and summary["new_drop_frames"] > self.max_new_drops:
+                return DROPPING
+
+        return None
+
+    def healthy(self, uptime):
+        """ Call while the stream is healthy so a long clean run resets the backoff. """
+        if self.consecutive and uptime >= self.healthy_seconds:
+            self.consecutive = 0
+
+    def recently_restarted(self, seconds):
+        return self.last_restart is not None and time.monotonic() - self.last_restart < seconds
+
+    def backoff(self):
+        if not self.consecutive:
+            return 0
+        return min(self.backoff_max, self.backoff_base * 2 ** (self.consecutive - 1))
+
+    def breaker_open(self, now=None):
+        now = now or time.monotonic()
+        if self.breaker_open_until and now < self.breaker_open_until:
+            return True
+        self.breaker_open_until = None
+        return False
+
+    def allow_restart(self, now=None):
+        now = now or time.monotonic()
+        if self.breaker_open(now):
+            return False
+        if self.last_restart is not None and now - self.last_restart < self.backoff():
+            return False
+        return True
+
+    def record_restart(self, cause, now=None):
+        now = now or time.monotonic()
+
+        self.restarts_by_cause[cause] = self.restarts_by_cause.get(cause, 0) + 1
+        self.last_cause = cause
+        self.last_restart = now
+        self.consecutive += 1
+
+        self.recent_restarts.append(now)
+        while self.recent_restarts and now - self.recent_restarts[0] > self.breaker_window:
+            self.recent_restarts.popleft()
+
+        if len(self.recent_restarts) >= self.breaker_restarts:
+            print(f"{len(self.recent_restarts)} restarts in {int(self.breaker_window)}s, holding off restarts for {int(self.breaker_cooldown)}s")
+            self.breaker_open_until = now + self.breaker_cooldown
+            self.recent_restarts.clear()
+
+    def status(self):
+        now = time.monotonic()
+        return {
+            "restarts_by_cause": dict(self.restarts_by_cause),
+            "last_cause": self.last_cause,
+            "consecutive": self.consecutive,
+            "backoff": self.backoff(),
+            "breaker_open": self.breaker_open(now),
+            "breaker_remaining": round(self.breaker_open_until - now, 1) if self.breaker_open_until else 0,
+        }
@@ -0,0 +1,111 @@
+# Host and process metrics jitter from one report to the next, changes
+# smaller than this aren't sent. Everything else, encoder speed included,
+# goes out exactly as measured.
+TOLERANCES = {"cpu_usage": 0.5, "ram_usage": 0.5, "cpu": 0.5}
+RELATIVE_TOLERANCES = {"bytes_sent_raw": 0.02, "bytes_recv_raw": 0.02, "rss": 0.02, "read": 0.02, "write": 0.02}
+
+def unchanged(key, old, new):
+    if old == new:
+        return True
+    if not isinstance(old, (int, float)) or not isinstance(new, (int, float)) \
+            or isinstance(old, bool) or isinstance(new, bool):
+        return False
+    if key in TOLERANCES:
+        return abs(new - old) < TOLERANCES[key]
+    if key in RELATIVE_TOLERANCES:
+        return abs(new - old) <= RELATIVE_TOLERANCES[key] * max(abs(old), abs(new))
+    return False
+
+def diff(old, new, path=()):
+    """
+    Return (changes, removed) that turn `old` into `new`. Nested dicts are
+    diffed key by key, `removed` holds the key paths that disappeared.
+    Metrics within their tolerance count as unchanged.
+    """
+    changes = {}
+    removed = []
+
+    for key, value in new.items():
+        if key not in old:
+            changes[key] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            nested_changes, nested_removed = diff(old[key], value, path + (key,))
+            if nested_changes:
+                changes[key] = nested_changes
+            removed += nested_removed
+        elif not unchanged(key, old[key], value):
+            changes[key] = value
+
+    for key in old:
+        if key not in new:
+            removed.append(list(path + (key,)))
+
+    return changes, removed
+
+def apply_delta(base, changes, removed=()):
+    """ What the receiver holds after applying a delta to `base`, `base` itself is left alone. """
+    merged = dict(base)
+
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = apply_delta(merged[key], value)
+        else:
+            merged[key] = value
+
+    for path in removed:
+        target = merged
+        for key in path[:-1]:
+            if not isinstance(target.get(key), dict):
+                break
+            target[key] = dict(target[key])
+            target = target[key]
+        else:
+            target.pop(path[-1], None)
+
+    return merged
+
+class StatusReporter:
+    """
+    Turns status payloads into a full snapshot followed by numbered deltas.
+
+    Every message carries a sequence number and every delta the number it
+    applies on top of, so the receiver can tell when it missed one and ask
+    for a new snapshot. The reporting interval adapts to what the node is
+    doing.
+    """
+
+    def __init__(self, fast_interval=3, streaming_interval=10, idle_interval=25):
+        self.fast_interval = fast_interval
+        self.streaming_interval = streaming_interval
+        self.idle_interval = idle_interval
+        self.last = None
+        self.seq = 0
+        self.full_needed = True
+
+    def reset(self):
+        """ Send a full snapshot next time, e.g. after a reconnect. """
+        self.full_needed = True
+
+    def build(self, payload):
+        self.seq += 1
+
+        if self.full_needed or self.last is None:
+            message = {"kind": "full", "seq": self.seq, "status": payload}
+            self.full_needed = False
+            self.last = payload
+        else:
+            changes, removed = diff(self.last, payload)
+            message = {"kind": "delta", "seq": self.seq, "base": self.seq - 1, "changes": changes}
+            if removed:
+                message["removed"] = removed
+            # Diff against what the webserver has, so small changes still add up to a sent one
+            self.last = apply_delta(self.last, changes, removed)
+
+        return message
+
+    def interval(self, streaming, failing):
+        if failing:
+            return self.fast_interval
+        if streaming:
+            return self.streaming_interval
+        return self.idle_interval
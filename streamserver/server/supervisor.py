@@ -0,0 +1,456 @@
+import asyncio
+import hashlib
+import json
+import os
+import shlex
+import signal
+import subprocess
+import time
+from datetime import datetime
+
+import psutil
+
+STARTING = "starting"
+RUNNING = "running"
+RESTARTING = "restarting"
+EXITED = "exited"
+
+def command_hash(command):
+    """ Identifies a command without keeping it around, commands carry stream keys. """
+    args = shlex.split(command) if isinstance(command, str) else list(command)
+    return hashlib.sha256("\0".join(args).encode()).hexdigest()
+
+class SpawnedProcess:
+    """
+    A pipeline process this run of the node started. It is a plain Popen
+    rather than an asyncio subprocess, because closing or dropping an
+    asyncio subprocess kills the child, and a detached pipeline has to keep
+    running for the next run to adopt. The output is read through asyncio
+    streams. The exit is noticed through a pidfd in the event loop as soon
+    as it happens; without pidfd_open (Linux before 5.3) it is polled for,
+    and noticed up to `poll_interval` late.
+    """
+
+    def __init__(self, popen, poll_interval=0.5):
+        self.popen = popen
+        self.pid = popen.pid
+        self.poll_interval = poll_interval
+        self.stdin = popen.stdin
+        self.stdout = self.stderr = None
+        self.transports = []
+        self.exited = None  # Future of the exit code, shared by every wait()
+        self.pidfd = None
+        self.poller = None
+
+        if self.stdin is not None:
+            # Interactive commands are a few bytes, never wait on a full pipe
+            os.set_blocking(self.stdin.fileno(), False)
+
+    @classmethod
+    async def spawn(cls, args, stdin, stdout, stderr):
+        popen = subprocess.Popen(args, stdin=stdin, stdout=stdout, stderr=stderr, start_new_session=True)
+        process = cls(popen)
+
+        loop = asyncio.get_running_loop()
+        for name in ("stdout", "stderr"):
+            pipe = getattr(popen, name)
+            if pipe is None:
+                continue
+            reader = asyncio.StreamReader()
+            transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+            process.transports.append(transport)
+            setattr(process, name, reader)
+
+        process.watch_exit(loop)
+        return process
+
+    def watch_exit(self, loop):
+        self.exited = loop.create_future()
+        try:
+            self.pidfd = os.pidfd_open(self.pid)
+        except (AttributeError, OSError):
+            self.poller = asyncio.ensure_future(self.poll())
+            return
+        loop.add_reader(self.pidfd, self.reap)
+
+    def reap(self):
+        """ The pidfd turned readable, the process has exited. """
+        self.close_pidfd()
+        self.finish()
+
+    async def poll(self):
+        while self.popen.poll() is None:
+            await asyncio.sleep(self.poll_interval)
+        self.finish()
+
+    def finish(self):
+        returncode = self.popen.wait()  # Already exited, this only reaps it
+        if not self.exited.done():
+            self.exited.set_result(returncode)
+
+    def close_pidfd(self):
+        if self.pidfd is not None:
+            self.exited.get_loop().remove_reader(self.pidfd)
+            os.close(self.pidfd)
+            self.pidfd = None
+
+    @property
+    def returncode(self):
+        return self.popen.returncode
+
+    def write_input(self, data):
+        os.write(self.stdin.fileno(), data)
+
+    async def wait(self):
+        returncode = await asyncio.shield(self.exited)
+        if self.stdin is not None:
+            self.stdin.close()
+        return returncode
+
+    def detach(self):
+        """ Close our ends of its pipes and let go of it, the process keeps running. """
+        self.close_pidfd()
+        if self.poller:
+            self.poller.cancel()
+        for transport in self.transports:
+            transport.close()
+        if self.stdin is not None:
+            self.stdin.close()
+        self.popen = None
+
+class AdoptedProcess:
+    """
+    Stands in for the asyncio process of a pipeline an earlier run of the
+    node left running. It isn't our child, so its exit is noticed by polling
+    and its exit code is unknown, and its stdio went away with the old node.
+    """
+
+    stdin = stdout = stderr = None
+
+    def __init__(self, process, poll_interval=1):
+        self.process = process  # psutil.Process
+        self.pid = process.pid
+        self.returncode = None
+        self.poll_interval = poll_interval
+        self.cpu_time = None
+        self.cpu_advanced = time.monotonic()
+
+    def idle_seconds(self):
+        """ Seconds since the process last used any CPU, a stuck ffmpeg uses none. """
+        return time.monotonic() - self.cpu_advanced
+
+    async def wait(self):
+        while self.returncode is None:
+            try:
+                if self.process.status() == psutil.STATUS_ZOMBIE:
+                    raise psutil.NoSuchProcess(self.pid)
+                times = self.process.cpu_times()
+                if times.user + times.system != self.cpu_time:
+                    self.cpu_time = times.user + times.system
+                    self.cpu_advanced = time.monotonic()
+            except psutil.NoSuchProcess:
+                self.returncode = -1
+                break
+            except psutil.Error:
+                pass
+            await asyncio.sleep(self.poll_interval)
+        return self.returncode
+
+class Pipeline:
+    """ One named process owned by the supervisor. """
+
+    def __init__(self, name):
+        self.name = name
+        self.command = None
+        self.command_hash = None
+        self.identity = None  # What the caller built the command from, see ProcessSupervisor.adopt
+        self.meta = {}  # Caller state kept across node restarts (plan, bitrate rung, ...)
+        self.create_time = None  # Process start time as the OS reports it, tells a reused PID apart
+        self.recovered = False  # Adopted on boot and not yet claimed by a start
+        self.process = None
+        self.pid = None
+        self.pgid = None
+        self.state = STARTING
+        self.exit_code = None
+        self.started_at = None
+        self.exited_at = None
+        self.starts = 0
+        self._started_monotonic = None
+        self._watcher = None
+
+    def is_running(self):
+        return self.state == RUNNING and self.process is not None and self.process.returncode is None
+
+    @property
+    def adopted(self):
+        return isinstance(self.process, AdoptedProcess)
+
+    def idle_seconds(self):
+        """ How long an adopted pipeline has gone without using CPU, 0 for our own (they report progress). """
+        return self.process.idle_seconds() if self.adopted else 0
+
+    @property
+    def uptime(self):
+        if not self.is_running() or self._started_monotonic is None:
+            return 0
+        return time.monotonic() - self._started_monotonic
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "state": self.state,
+            "pid": self.pid,
+            "exit_code": self.exit_code,
+            "uptime": round(self.uptime, 1),
+            "starts": self.starts,
+            "adopted": self.adopted,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "exited_at": self.exited_at.isoformat() if self.exited_at else None,
+        }
+
+class ProcessSupervisor:
+    """
+    Owns the processes this node spawns.
+
+    Every pipeline runs in its own process group so a stop takes down the
+    whole group and nothing else on the host. Exits are picked up by a task
+    waiting on each process instead of scanning the process table.
+
+    The running pipelines are recorded in `state_file` (PID, process start
+    time, a hash of the command, and the identity and meta the caller
+    started it with). On shutdown they are left running, and the next run
+    adopts every one that is still alive, so restarting the node doesn't
+    take the streams down. An adopted pipeline is kept by a start with the
+    same command, or claimed through `adopt` with the same identity.
+    """
+
+    def __init__(self, stop_timeout=3, state_file=None):
+        self.stop_timeout = stop_timeout
+        self.state_file = state_file
+        self.pipelines: dict = {}
+
+    def get(self, name):
+        return self.pipelines.get(name)
+
+    def is_running(self, name):
+        pipeline = self.pipelines.get(name)
+        return bool(pipeline and pipeline.is_running())
+
+    def status(self):
+        return {name: pipeline.as_dict() for name, pipeline in self.pipelines.items()}
+
+    def pids(self):
+        """ {name: pid} of the running pipelines. """
+        return {name: pipeline.pid for name, pipeline in list(self.pipelines.items()) if pipeline.is_running()}
+
+    def adopt(self, name, identity):
+        """
+        Claim pipeline `name` if the last run of the node left it running and
+        it was started with `identity`, so the caller can keep it without
+        rebuilding the command. None otherwise.
+        """
+        pipeline = self.pipelines.get(name)
+        if pipeline is None or not pipeline.recovered or not pipeline.is_running() \
+                or not identity or pipeline.identity != identity:
+            return None
+
+        print(f"Pipeline {name} (pid {pipeline.pid}) kept running across the restart, adopting it")
+        pipeline.recovered = False
+        return pipeline
+
+    def update_meta(self, name, **meta):
+        """ Change what is recorded with running pipeline `name`, e.g. after retuning it. """
+        pipeline = self.pipelines.get(name)
+        if pipeline is None:
+            return
+        pipeline.meta = {**pipeline.meta, **meta}
+        self.save_state()
+
+    async def start(self, name, command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                    stdin=subprocess.PIPE, identity=None, meta=None):
+        """
+        Start `command` as pipeline `name`, replacing the running one if there is one.
+        `identity` and `meta` are recorded with it for the next run of the node.
+        """
+        pipeline = self.pipelines.get(name)
+
+        if pipeline is not None and pipeline.recovered:
+            pipeline.recovered = False
+            if pipeline.is_running() and pipeline.command_hash == command_hash(command):
+                print(f"Pipeline {name} (pid {pipeline.pid}) kept running across the restart, adopting it")
+                pipeline.command = command
+                pipeline.identity = identity
+                pipeline.meta = meta or {}
+                self.save_state()
+                return pipeline
+
+        if pipeline is None:
+            pipeline = self.pipelines[name] = Pipeline(name)
+            pipeline.state = STARTING
+        elif pipeline.process is not None and pipeline.process.returncode is None:
+            pipeline.state = RESTARTING
+            await self._terminate(pipeline)
+        else:
+            pipeline.state = STARTING
+
+        args = shlex.split(command) if isinstance(command, str) else list(command)
+
+        process = await SpawnedProcess.spawn(args, stdin, stdout, stderr)
+
+        pipeline.command = command
+        pipeline.command_hash = command_hash(args)
+        pipeline.identity = identity
+        pipeline.meta = meta or {}
+        pipeline.process = process
+        pipeline.pid = process.pid
+        try:
+            pipeline.create_time = psutil.Process(process.pid).create_time()
+        except psutil.Error:
+            pipeline.create_time = None
+        pipeline.pgid = process.pid  # start_new_session makes it the group leader
+        pipeline.exit_code = None
+        pipeline.exited_at = None
+        pipeline.started_at = datetime.utcnow()
+        pipeline._started_monotonic = time.monotonic()
+        pipeline.starts += 1
+        pipeline.state = RUNNING
+        pipeline._watcher = asyncio.create_task(self._watch(pipeline, process))
+        self.save_state()
+
+        return pipeline
+
+    def save_state(self):
+        """ Record the running pipelines for the next run of the node to adopt. """
+        if not self.state_file:
+            return
+
+        state = {
+            name: {
+                "pid": pipeline.pid,
+                "create_time": pipeline.create_time,
+                "command_hash": pipeline.command_hash,
+                "identity": pipeline.identity,
+                "meta": pipeline.meta,
+                "started_at": pipeline.started_at.isoformat() if pipeline.started_at else None,
+            }
+            for name, pipeline in self.pipelines.items()
+            if pipeline.is_running() and pipeline.create_time
+        }
+        try:
+            with open(self.state_file + ".tmp", 'w') as file:
+                json.dump(state, file)
+            os.replace(self.state_file + ".tmp", self.state_file)
+        except OSError as e:
+            print("Failed to save pipeline state", e)
+
+    def recover(self):
+        """ Adopt the pipelines the last run of the node left running, returns their names. """
+        try:
+            with open(self.state_file, 'r') as file:
+                state = json.load(file)
+        except (TypeError, OSError, ValueError):
+            return []
+
+        for name, record in state.items():
+            try:
+                process = psutil.Process(record["pid"])
+                # The PID may have been reused since, only take the process we started
+                if abs(process.create_time() - record["create_time"]) > 1 \
+                        or command_hash(process.cmdline()) != record["command_hash"]:
+                    continue
+                pgid = os.getpgid(process.pid)
+            except (psutil.Error, OSError, KeyError, TypeError):
+                continue
+
+            pipeline = self.pipelines[name] = Pipeline(name)
+            pipeline.command_hash = record["command_hash"]
+            pipeline.identity = record.get("identity")
+            pipeline.meta = record.get("meta") or {}
+            pipeline.create_time = record["create_time"]
+            pipeline.process = AdoptedProcess(process)
+            pipeline.pid = process.pid
+            pipeline.pgid = pgid
+            pipeline.started_at = datetime.utcfromtimestamp(record["create_time"])
+            pipeline._started_monotonic = time.monotonic() - (time.time() - record["create_time"])
+            pipeline.starts = 1
+            pipeline.recovered = True
+            pipeline.state = RUNNING
+            pipeline._watcher = asyncio.create_task(self._watch(pipeline, pipeline.process))
+            print(f"Found pipeline {name} (pid {pipeline.pid}) still running")
+
+        self.save_state()
+        return [name for name, pipeline in self.pipelines.items() if pipeline.recovered]
+
+    def detach_all(self):
+        """ Let go of every pipeline without stopping it, for the next run of the node to adopt. """
+        self.save_state()
+        for pipeline in self.pipelines.values():
+            if pipeline._watcher:
+                pipeline._watcher.cancel()
+            if isinstance(pipeline.process, SpawnedProcess):
+                pipeline.process.detach()
+            # Only the pid stays on record, in the state file
+            pipeline.process = None
+        self.pipelines = {}
+
+    async def send_input(self, name, data):
+        """ Write `data` to the stdin of running pipeline `name` (ffmpeg reads its interactive commands there). """
+        pipeline = self.pipelines.get(name)
+        if not pipeline or not pipeline.is_running() or not pipeline.process.stdin:
+            return False
+
+        try:
+            pipeline.process.write_input(data)
+        except OSError:
+            # Gone, or not reading its stdin
+            return False
+        return True
+
+    async def stop(self, name):
+        """ Stop pipeline `name` and forget about it. """
+        pipeline = self.pipelines.pop(name, None)
+        if pipeline is not None:
+            await self._terminate(pipeline)
+            self.save_state()
+        return pipeline
+
+    async def _watch(self, pipeline, process):
+        exit_code = await process.wait()
+
+        # A restart or stop already took care of this process
+        if pipeline.process is not process:
+            return
+
+        pipeline.process = None
+        pipeline.exit_code = exit_code
+        pipeline.exited_at = datetime.utcnow()
+        pipeline.state = EXITED
+
+        print(f"Pipeline {pipeline.name} (pid {pipeline.pid}) exited with {exit_code}")
+        self.save_state()
+
+    async def _terminate(self, pipeline):
+        process = pipeline.process
+        pipeline.process = None
+
+        if process is None or process.returncode is not None:
+            return
+
+        self._signal_group(pipeline, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(process.wait(), self.stop_timeout)
+        except asyncio.TimeoutError:
+            print(f"Pipeline {pipeline.name} ignored SIGTERM, killing it")
+            self._signal_group(pipeline, signal.SIGKILL)
+            await process.wait()
+
+        pipeline.exit_code = process.returncode
+        pipeline.exited_at = datetime.utcnow()
+        if pipeline.state != RESTARTING:
+            pipeline.state = EXITED
+
+    def _signal_group(self, pipeline, sig):
+        try:
+            os.killpg(pipeline.pgid, sig)
+        except ProcessLookupError:
+            pass
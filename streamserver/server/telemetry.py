@@ -0,0 +1,143 @@
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Global options every pipeline starts with: warnings only on stderr, machine-readable
+# progress blocks on stdout once a second
+FFMPEG = "/usr/bin/ffmpeg -hide_banner -nostats -loglevel warning -stats_period 1 -progress pipe:1"
+
+def parse_number(value):
+    """ Parse the numeric part of a progress value such as '2510.3kbits/s', '1.01x' or 'N/A'. """
+    value = value.strip()
+    for suffix in ("kbits/s", "x"):
+        if value.endswith(suffix):
+            value = value[:-len(suffix)]
+            break
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+class ProgressTracker:
+    """
+    Parses ffmpeg's `-progress` output and keeps the last `size` samples.
+
+    ffmpeg writes one key=value per line and closes each block with a
+    `progress=continue` (or `progress=end`) line, which is when a sample
+    gets committed.
+    """
+
+    def __init__(self, size=300):
+        self.samples = deque(maxlen=size)
+        self.current = {}
+        self.ended = False
+
+    def feed(self, line):
+        key, sep, value = line.partition("=")
+        if not sep:
+            return
+
+        key = key.strip()
+        if key == "progress":
+            self.commit()
+            self.ended = value.strip() == "end"
+        else:
+            self.current[key] = value
+
+    def commit(self):
+        block, self.current = self.current, {}
+        if not block:
+            return
+
+        out_time_us = parse_number(block.get("out_time_us", "N/A"))
+
+        self.samples.append({
+            "time": time.time(),
+            "frame": parse_number(block.get("frame", "N/A")),
+            "fps": parse_number(block.get("fps", "N/A")),
+            "bitrate": parse_number(block.get("bitrate", "N/A")),  # kbit/s
+            "speed": parse_number(block.get("speed", "N/A")),
+            "drop_frames": parse_number(block.get("drop_frames", "N/A")),
+            "dup_frames": parse_number(block.get("dup_frames", "N/A")),
+            "total_size": parse_number(block.get("total_size", "N/A")),
+            "out_time": out_time_us / 1e6 if out_time_us is not None else None,
+        })
+
+    def latest(self):
+        return self.samples[-1] if self.samples else None
+
+    def window(self, seconds):
+        """ Samples from the last `seconds` seconds, oldest first. """
+        cutoff = time.time() - seconds
+        return [sample for sample in self.samples if sample["time"] >= cutoff]
+
+    def summary(self, seconds=30):
+        latest = self.latest()
+        if latest is None:
+            return None
+
+        recent = self.window(seconds)
+
+        def values(key):
+            return [sample[key] for sample in recent if sample[key] is not None]
+
+        speeds = values("speed")
+        fps = values("fps")
+        bitrates = values("bitrate")
+        drops = values("drop_frames")
+        dups = values("dup_frames")
+
+        return {
+            "fps": latest["fps"],
+            "bitrate": latest["bitrate"],
+            "speed": latest["speed"],
+            "drop_frames": latest["drop_frames"],
+            "dup_frames": latest["dup_frames"],
+            "total_size": latest["total_size"],
+            "out_time": latest["out_time"],
+            "avg_fps": round(sum(fps) / len(fps), 2) if fps else None,
+            "avg_bitrate": round(sum(bitrates) / len(bitrates), 1) if bitrates else None,
+            "min_speed": min(speeds) if speeds else None,
+            "new_drop_frames": drops[-1] - drops[0] if drops else None,
+            "new_dup_frames": dups[-1] - dups[0] if dups else None,
+            "ended": self.ended,
+        }
+
+    async def read(self, stream):
+        async for line in stream:
+            self.feed(line.decode(errors="replace"))
+
+class RateLimitedLog:
+    """ Lets through at most `max_lines` lines per `interval` seconds and counts the rest. """
+
+    def __init__(self, name, max_lines=20, interval=60):
+        self.name = name
+        self.max_lines = max_lines
+        self.interval = interval
+        self.window_start = time.monotonic()
+        self.lines = 0
+        self.suppressed = 0
+
+    def log(self, message):
+        now = time.monotonic()
+        if now - self.window_start >= self.interval:
+            if self.suppressed:
+                logger.warning(f"{self.name}: suppressed {self.suppressed} lines in the last {int(now - self.window_start)}s")
+            self.window_start = now
+            self.lines = 0
+            self.suppressed = 0
+
+        if self.lines >= self.max_lines:
+            self.suppressed += 1
+            return
+
+        self.lines += 1
+        logger.warning(f"{self.name}: {message}")
+
+    async def read(self, stream):
+        async for line in stream:
+            line = line.decode(errors="replace").strip()
+            if line:
+                self.log(line)
@@ -9,6 +9,7 @@ SERVER_IP="$6"
 STREAM_KEY="$7"
 YOUTUBE_KEY="$8"
 BACKUP_MP4="$9"
+NODE_SECRET="${10}"
 
 echo $@
 
@@ -77,6 +78,11 @@ chown flow:flow /flowrecaster_stream_key.txt
 echo $YOUTUBE_KEY > /flowrecaster_youtube_key.txt
 chown flow:flow /flowrecaster_youtube_key.txt
 
+# Proves to the webserver that the control channel is really this node
+echo $NODE_SECRET > /flowrecaster_node_secret.txt
+chown flow:flow /flowrecaster_node_secret.txt
+chmod 600 /flowrecaster_node_secret.txt
+
 cp flowrecaster.service /etc/systemd/system/flowrecaster.service
 sudo systemctl daemon-reload
 sudo systemctl enable flowrecaster
@@ -8,6 +8,8 @@ import VideoJS from './VideoJS'
 import videojs from 'video.js';
 import StreamEditModal from './StreamEditModal';
 
+const HEARTBEAT_TIMEOUT = 30000; // A server that hasn't reported for this long shows as down
+
 function WorkspaceView() {
     const { uuid } = useParams();
     const [workspace, setWorkspace] = useState(null);
@@ -21,6 +23,8 @@ function WorkspaceView() {
     const [newYoutubeKey, setNewYoutubeKey] = useState('');
     const [loading, setLoading] = useState(false);
     const ws = useRef(null);
+    const lastSeq = useRef(null); // Last frame of the workspace feed we applied
+    const feedEpoch = useRef(null);
     const { user, setUser } = useUser();
     const [shouldReconnect, setShouldReconnect] = useState(true);
     const [retryCount, setRetryCount] = useState(0);
@@ -30,8 +34,10 @@ function WorkspaceView() {
 
     useEffect(() => {
         fetchWorkspace();
-        fetchStreamServers();
 
+        // The socket starts with a snapshot of the servers, then sends what changes
+        lastSeq.current = null;
+        feedEpoch.current = null;
         connectWebSocket();
 
         return () => {
@@ -51,7 +57,7 @@ function WorkspaceView() {
             const newHeartbeats = { ...lastHeartbeats };
 
             Object.keys(newHeartbeats).forEach(uuid => {
-                if (now - newHeartbeats[uuid] > 30000) { // 30 seconds
+                if (now - newHeartbeats[uuid] > HEARTBEAT_TIMEOUT) {
                     // Set server hasHeartbeat to false locally
                     const newStreamServers = streamServers.map(server => {
                         if (server.uuid === uuid) {
@@ -65,14 +71,16 @@ function WorkspaceView() {
             });
 
             setLastHeartbeats(newHeartbeats);
-        }, 30000); // check every 30 seconds
+        }, HEARTBEAT_TIMEOUT);
 
         return () => clearInterval(interval);
     }, [lastHeartbeats]);
 
     const connectWebSocket = () => {
         const token = user.access_token;
-        ws.current = new WebSocket(`${process.env.REACT_APP_API_SOCKET}/ws/updates/${uuid}?token=${token}`);
+        // Resume from the last frame we saw, the server replays what we missed or sends a new snapshot
+        const resume = lastSeq.current !== null ? `&since=${lastSeq.current}&epoch=${feedEpoch.current}` : '';
+        ws.current = new WebSocket(`${process.env.REACT_APP_API_SOCKET}/ws/updates/${uuid}?token=${token}${resume}`);
 
         ws.current.onopen = () => {
             console.log('WebSocket Connected');
@@ -102,80 +110,166 @@ function WorkspaceView() {
         };
     };
 
+    // Same as merge_delta on the server: nested objects merge key by key, removed lists key paths to drop
+    const isObject = value => value && typeof value === 'object' && !Array.isArray(value);
+
+    const removePath = (obj, [key, ...rest]) => {
+        if (!isObject(obj)) {
+            return obj;
+        }
+        const copy = { ...obj };
+        if (rest.length === 0) {
+            delete copy[key];
+        } else {
+            copy[key] = removePath(copy[key], rest);
+        }
+        return copy;
+    };
+
+    const mergeDelta = (base, changes, removed) => {
+        let merged = { ...(base || {}) };
+
+        Object.entries(changes || {}).forEach(([key, value]) => {
+            merged[key] = isObject(value) && isObject(merged[key]) ? mergeDelta(merged[key], value) : value;
+        });
+
+        (removed || []).forEach(path => {
+            merged = removePath(merged, path);
+        });
+
+        return merged;
+    };
+
+    // When the webserver received the status, date_created is UTC without a zone
+    const reportedAt = (status) => {
+        const created = status && status.date_created;
+        const time = created ? Date.parse(created.endsWith('Z') ? created : `${created}Z`) : NaN;
+        return isNaN(time) ? null : time;
+    };
+
+    const withStatus = (server, status, live = true) => ({
+        ...server,
+        hasHeartbeat: live,
+        stream1: status.stream1_live,
+        hasFFmpeg: status.ffmpeg_alive,
+        last_status_update: status,
+    });
+
+    const updateServer = (serverUuid, update, create = false) => {
+        setStreamServers(currentStreamServers => {
+            const existing = currentStreamServers.find(s => s.uuid === serverUuid);
+
+            if (!existing && !create) {
+                return currentStreamServers;
+            }
+
+            const updated = update(existing || { uuid: serverUuid });
+
+            setSelectedServer(selectedServer => (
+                selectedServer && selectedServer.uuid === serverUuid ? updated : selectedServer
+            ));
+
+            return existing
+                ? currentStreamServers.map(s => (s.uuid === serverUuid ? updated : s))
+                : [...currentStreamServers, updated];
+        });
+    };
+
+    const markHeartbeat = (serverUuid) => {
+        setLastHeartbeats(currentHeartBeats => ({ ...currentHeartBeats, [serverUuid]: Date.now() }));
+    };
+
     const handleWebSocketMessage = (message) => {
-        if (message.type === 'server_online' && message.data.uuid) {
-            setStreamServers(currentStreamServers => {
-                const updateServer = currentStreamServers.find(s => s.uuid === message.data.uuid);
-
-                if (updateServer) {
-                    Object.assign(updateServer, message.data);
-                    updateServer.hasHeartbeat = true;
-
-                    if (selectedServer && selectedServer.uuid === updateServer.uuid) {
-                        setSelectedServer(updateServer);
-                    }
-                } else {
-                    currentStreamServers.push(message.data);
-                }
-                
-                return currentStreamServers.slice();
-            });
+        if (message.seq !== undefined) {
+            if (message.type !== 'snapshot' && message.epoch === feedEpoch.current
+                    && lastSeq.current !== null && message.seq !== lastSeq.current + 1) {
+                // Missed a frame, reconnecting picks up from the last one we applied
+                ws.current.close();
+                return;
+            }
+            lastSeq.current = message.seq;
+            feedEpoch.current = message.epoch;
+        }
 
-            setLastHeartbeats(currentHeartBeats => {
-                currentHeartBeats[message.data.uuid] = Date.now();
-                return {...currentHeartBeats};
-            });
-        } else if (message.type === 'status_report' && message.data.uuid) {
-            setStreamServers(currentStreamServers => {
-                console.log("Current Stream Servers", currentStreamServers, message.data.status)
-
-                const updateServer = currentStreamServers.find(s => s.uuid === message.data.uuid);
-
-                if (updateServer) {
-                    updateServer.hasHeartbeat = true;
-                    updateServer.stream1 = message.data.status.stream1_live;
-                    updateServer.hasFFmpeg = message.data.status.ffmpeg_alive;
-                    updateServer.last_status_update = message.data.status;
-
-                    console.log("selectedServer server", selectedServer);
-
-                    if (selectedServer) {
-                        setSelectedServer(selectedServer => {
-                            if (selectedServer.uuid === updateServer.uuid) {
-                                return updateServer;
-                            } else {
-                                return selectedServer;
-                            }
-                        });
-                    }
-                }
+        const data = message.data || {};
 
-                return currentStreamServers.slice();
+        if (message.type === 'snapshot') {
+            // The remembered status may be from a node that has since gone away
+            const heartbeats = {};
+            const servers = Object.values(data.servers || {}).map(server => {
+                if (!server.status) {
+                    return server;
+                }
+                const reported = reportedAt(server.status);
+                const live = reported !== null && Date.now() - reported < HEARTBEAT_TIMEOUT;
+                if (live) {
+                    heartbeats[server.uuid] = reported;
+                }
+                return withStatus(server, server.status, live);
             });
-
-            setLastHeartbeats(currentHeartBeats => {
-                currentHeartBeats[message.data.uuid] = Date.now();
-                return {...currentHeartBeats};
+            setStreamServers(servers);
+            setLastHeartbeats(current => ({ ...current, ...heartbeats }));
+            setSelectedServer(selectedServer => {
+                const fresh = selectedServer && servers.find(s => s.uuid === selectedServer.uuid);
+                // Keep the keys fetched when it was selected, snapshots don't carry them
+                return fresh ? { ...fresh, stream_key: selectedServer.stream_key, youtube_key: selectedServer.youtube_key } : null;
             });
+        } else if (['server_added', 'server_online', 'server_config'].includes(message.type) && data.uuid) {
+            updateServer(data.uuid, server => {
+                const merged = mergeDelta(server, data.changes);
+                return message.type === 'server_online' ? { ...merged, hasHeartbeat: true } : merged;
+            }, true);
+
+            if (message.type === 'server_online') {
+                markHeartbeat(data.uuid);
+            }
+        } else if (message.type === 'server_removed' && data.uuid) {
+            setStreamServers(currentStreamServers => currentStreamServers.filter(s => s.uuid !== data.uuid));
+            setSelectedServer(selectedServer => (selectedServer && selectedServer.uuid === data.uuid ? null : selectedServer));
+        } else if (message.type === 'status_report' && data.uuid) {
+            applyStatus(data);
+        } else if (message.type === 'status_batch') {
+            // Every server of the workspace that reported in the last coalescing window
+            (data.reports || []).forEach(applyStatus);
         }
     };
 
-    const fetchWorkspace = async () => {
+    const applyStatus = (report) => {
+        updateServer(report.uuid, server => withStatus(server, report.replace
+            ? report.changes
+            : mergeDelta(server.last_status_update, report.changes, report.removed)));
+        markHeartbeat(report.uuid);
+    };
+
+    // Stream and YouTube keys never come over the socket, they are fetched from the access checked API
+    // only when they are about to be shown
+    const fetchServerKeys = async (serverUuid) => {
         try {
-            const response = await API.get(`/workspaces/${uuid}`);
-            setWorkspace(response.data);
+            const response = await API.get(`/streamservers/${uuid}`);
+            const server = response.data.find(s => s.uuid === serverUuid);
+            if (!server) {
+                return {};
+            }
+            const keys = { stream_key: server.stream_key, youtube_key: server.youtube_key };
+            updateServer(serverUuid, current => ({ ...current, ...keys }));
+            return keys;
         } catch (error) {
-            console.error('Failed to fetch workspace details:', error);
+            console.error('Failed to fetch stream server keys:', error);
+            return {};
         }
     };
 
-    const fetchStreamServers = async () => {
+    const selectServer = (server) => {
+        setSelectedServer(server);
+        fetchServerKeys(server.uuid);
+    };
+
+    const fetchWorkspace = async () => {
         try {
-            const response = await API.get(`/streamservers/${uuid}`);
-            console.log(response);
-            setStreamServers(response.data);
+            const response = await API.get(`/workspaces/${uuid}`);
+            setWorkspace(response.data);
         } catch (error) {
-            console.error('Failed to fetch stream servers:', error);
+            console.error('Failed to fetch workspace details:', error);
         }
     };
 
@@ -189,7 +283,10 @@ function WorkspaceView() {
                 stream_key: newStreamKey,
                 workspace: uuid
             });
-            setStreamServers([...streamServers, response.data]);
+            // The server_added frame may have beaten the response here
+            setStreamServers(current => (
+                current.some(s => s.uuid === response.data.uuid) ? current : [...current, response.data]
+            ));
             console.log("Response", response)
             setShowModal(false);
             setNewServerName('');
@@ -319,9 +416,10 @@ function WorkspaceView() {
         }
     }
     
-    const openEditModal = (data) => {
+    const openEditModal = async (data) => {
+        const keys = await fetchServerKeys(data.uuid);
         console.log("Initial Data", data);
-        setInitialEditData({...data});
+        setInitialEditData({...data, ...keys});
         setShowEditModal(true);
     };
 
@@ -350,7 +448,7 @@ function WorkspaceView() {
                 <Col md={4}>
                     <ListGroup>
                         {streamServers.map(server => (
-                            <ListGroup.Item key={server.uuid} action onClick={() => setSelectedServer(server)}  className="d-flex justify-content-between align-items-center mb-2">
+                            <ListGroup.Item key={server.uuid} action onClick={() => selectServer(server)}  className="d-flex justify-content-between align-items-center mb-2">
                                 {server.label}
                                 <div className="d-flex" style={{gap: "5px"}}>
                                     <Badge pill bg={server.hasHeartbeat ? "success" : "danger"}>
@@ -433,7 +531,7 @@ function WorkspaceView() {
                                             </tr>
                                             <tr>
                                                 <td>YouTube Key</td>
-                                                <td>{selectedServer.last_status_update.youtube_key}</td>
+                                                <td>{selectedServer.youtube_key}</td>
                                             </tr>
                                             <tr>
                                                 <td>FFmpeg Alive</td>
@@ -6,7 +6,7 @@ import models
 import logging
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
-from routers import workspaces, sockets, streamservers, users
+from routers import workspaces, sockets, streamservers, users, nodes
 
 # Load environment variables from .env file
 load_dotenv()
@@ -34,6 +34,15 @@ app.include_router(streamservers.router, prefix="/api/v1", tags=["streamservers"
 app.include_router(workspaces.router, prefix="/api/v1", tags=["workspaces"])
 app.include_router(users.router, prefix="/api/v1", tags=["users"])
 app.include_router(sockets.router,  prefix="/api/v1", tags=["sockets"])
+app.include_router(nodes.router, prefix="/api/v1", tags=["nodes"])
+
+@app.on_event("startup")
+async def startup_event():
+    await sockets.manager.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await sockets.manager.stop()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,83 @@
+import asyncio
+import os
+from datetime import datetime
+from uuid import uuid4
+
+# "memory" for a single process, "mongo" to fan out across workers and hosts
+BROADCAST_BACKPLANE = os.getenv('BROADCAST_BACKPLANE', "memory")
+# How long published frames stay in the broadcasts collection
+BROADCAST_TTL_SECONDS = int(os.getenv('BROADCAST_TTL_SECONDS', "60"))
+
+class MemoryBackplane:
+    """ Everything runs in one process, a published frame goes straight to this worker's sockets. """
+
+    async def start(self, deliver):
+        self.deliver = deliver
+
+    async def publish(self, workspace_uuid: str, message: dict):
+        await self.deliver(workspace_uuid, message)
+
+    async def stop(self):
+        pass
+
+class MongoBackplane:
+    """
+    Shares broadcasts between webserver workers through a MongoDB change
+    stream, so a report that lands on one worker reaches dashboards
+    connected to any of them.
+
+    Publishing inserts the message into the broadcasts collection, then
+    delivers it to this worker's own sockets; every worker
+    watches the collection and delivers what the others inserted. Old frames
+    expire through a TTL index. Change streams need a replica set, a single
+    node one (mongod --replSet rs0, then rs.initiate()) is enough.
+    """
+
+    def __init__(self, collection, ttl_seconds: int = BROADCAST_TTL_SECONDS):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.origin = uuid4().hex  # This worker
+        self.resume_token = None
+        self.task = None
+
+    async def start(self, deliver):
+        self.deliver = deliver
+        await self.collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+        self.task = asyncio.create_task(self.watch())
+
+    async def publish(self, workspace_uuid: str, message: dict):
+        # Inserted first, so a frame either reaches every worker or none of them
+        await self.collection.insert_one({
+            "workspace": workspace_uuid,
+            "message": message,
+            "origin": self.origin,
+            "created_at": datetime.utcnow(),
+        })
+        await self.deliver(workspace_uuid, message)
+
+    async def watch(self):
+        pipeline = [{"$match": {"operationType": "insert", "fullDocument.origin": {"$ne": self.origin}}}]
+
+        while True:
+            try:
+                async with self.collection.watch(pipeline, resume_after=self.resume_token) as stream:
+                    async for change in stream:
+                        self.resume_token = stream.resume_token
+                        document = change["fullDocument"]
+                        await self.deliver(document["workspace"], document["message"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Picks up where it left off as long as the token is still in the oplog
+                print("Broadcast change stream failed, reconnecting", e)
+                await asyncio.sleep(1)
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+
+def create_backplane(kind: str = BROADCAST_BACKPLANE):
+    if kind == "mongo":
+        from database import broadcasts_table
+        return MongoBackplane(broadcasts_table)
+    return MemoryBackplane()
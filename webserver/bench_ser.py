@@ -0,0 +1,64 @@
+import json
+import timeit
+from datetime import datetime
+from uuid import uuid4
+from bson import ObjectId
+from utils import ser, dumps
+from routers.sockets import WorkspaceFeed
+
+# Compares the old ser() round trip with the single pass encoder, run from the webserver folder:
+#   python bench_ser.py
+
+def old_ser(myobj):
+    return json.loads(json.dumps(myobj, indent=4, sort_keys=True, default=str))
+
+def server(index):
+    return {
+        "_id": ObjectId(),
+        "uuid": str(uuid4()),
+        "hostname": f"node{index}",
+        "workspace": uuid4(),
+        "created_at": datetime.utcnow(),
+        "last_heartbeat": datetime.utcnow(),
+        "status": {
+            "channels": {
+                f"channel{channel}": {
+                    "streaming": True,
+                    "bitrate": 128000 + channel,
+                    "loudness": -16.2,
+                    "updated_at": datetime.utcnow(),
+                    "destinations": [{"url": f"rtmp://live/{channel}/{n}", "ok": True} for n in range(3)],
+                }
+                for channel in range(8)
+            },
+        },
+    }
+
+servers = [server(index) for index in range(50)]
+runs = 200
+
+def report(name, seconds):
+    print(f"{name:<40} {seconds / runs * 1000:8.3f} ms/call  {runs / seconds:10.0f} calls/s")
+
+report("old ser (dumps + loads)", timeit.timeit(lambda: old_ser(servers), number=runs))
+report("ser (single pass)", timeit.timeit(lambda: ser(servers), number=runs))
+report("old ser + json.dumps for the response", timeit.timeit(lambda: json.dumps(old_ser(servers)).encode(), number=runs))
+report("dumps to bytes", timeit.timeit(lambda: dumps(servers), number=runs))
+
+# A snapshot after one server changed only encodes that server again
+feed = WorkspaceFeed("bench")
+feed.loaded = True
+for document in ser(servers):
+    feed.apply({"type": "server_added", "data": {"uuid": document["uuid"], "changes": document}})
+uuid = servers[0]["uuid"]
+
+def changed_snapshot():
+    feed.apply({"type": "status_report", "data": {"uuid": uuid, "changes": {"beat": feed.seq}}})
+    return feed.snapshot()
+
+def uncached_snapshot():
+    return json.dumps({"type": "snapshot", "seq": feed.seq, "epoch": feed.epoch, "data": {"servers": feed.servers}}, default=str)
+
+report("snapshot, uncached", timeit.timeit(uncached_snapshot, number=runs))
+report("snapshot, one server changed", timeit.timeit(changed_snapshot, number=runs))
+report("snapshot, nothing changed", timeit.timeit(feed.snapshot, number=runs))
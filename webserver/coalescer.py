@@ -0,0 +1,69 @@
+import asyncio
+import os
+from typing import Dict
+
+# Seconds status reports of one workspace are held to go out together, 0 sends each one right away
+STATUS_COALESCE_WINDOW = float(os.getenv('STATUS_COALESCE_WINDOW', "0.5"))
+
+class StatusCoalescer:
+    """
+    Holds status reports per workspace for `window` seconds and hands the
+    latest one of each server to `flush(workspace_uuid, reports)` in one go,
+    so dashboards get one frame per workspace per window however many nodes
+    report. `reports` maps server uuid to (status, replace); replace sticks if
+    any report it stands for was a full one.
+    """
+
+    def __init__(self, flush, window: float = STATUS_COALESCE_WINDOW):
+        self.flush = flush
+        self.window = window
+        self.pending: Dict[str, Dict[str, tuple]] = {}
+        self.timers: Dict[str, asyncio.Task] = {}
+        self.received: Dict[str, int] = {}
+        self.sent: Dict[str, int] = {}
+
+    async def add(self, workspace_uuid: str, server_uuid: str, status: dict, replace: bool = False):
+        self.received[workspace_uuid] = self.received.get(workspace_uuid, 0) + 1
+
+        reports = self.pending.setdefault(workspace_uuid, {})
+        previous = reports.get(server_uuid)
+        reports[server_uuid] = (status, replace or bool(previous and previous[1]))
+
+        if self.window <= 0:
+            await self.send(workspace_uuid)
+        elif workspace_uuid not in self.timers:
+            self.timers[workspace_uuid] = asyncio.create_task(self.send_later(workspace_uuid))
+
+    async def send_later(self, workspace_uuid: str):
+        await asyncio.sleep(self.window)
+        self.timers.pop(workspace_uuid, None)
+        await self.send(workspace_uuid)
+
+    async def send(self, workspace_uuid: str):
+        reports = self.pending.pop(workspace_uuid, None)
+        if not reports:
+            return
+
+        self.sent[workspace_uuid] = self.sent.get(workspace_uuid, 0) + 1
+        try:
+            await self.flush(workspace_uuid, reports)
+        except Exception as e:
+            print(f"Status broadcast for {workspace_uuid} failed", e)
+
+    def stats(self):
+        received = sum(self.received.values())
+        sent = sum(self.sent.values())
+        return {
+            "window": self.window,
+            "reports_received": received,
+            "frames_sent": sent,
+            "frames_saved": received - sent,
+            "workspaces": {
+                workspace_uuid: {
+                    "reports_received": count,
+                    "frames_sent": self.sent.get(workspace_uuid, 0),
+                    "frames_saved": count - self.sent.get(workspace_uuid, 0),
+                }
+                for workspace_uuid, count in self.received.items()
+            },
+        }
@@ -8,3 +8,7 @@ stream_servers_table = db['stream_servers']
 stream_servers_status_table = db['stream_servers_status']
 workspaces_table = db['workspaces']
 users_table = db['users']
+broadcasts_table = db['broadcasts']  # Cross-worker broadcast backplane
+
+# Projection for stream server documents, leaves out what never goes to a client
+PRIVATE_FIELDS = {"_id": 0, "node_secret_hash": 0}
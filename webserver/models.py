@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Dict
 from uuid import UUID, uuid4
 from datetime import datetime
 from typing import Optional
@@ -48,8 +48,10 @@ class ServerStatus(BaseModel):
     uuid:  str = None
     cpu_usage: float
     ram_usage: float
-    bytes_sent: str
-    bytes_recv: str
+    bytes_sent: str = None
+    bytes_recv: str = None
+    bytes_sent_raw: float = None
+    bytes_recv_raw: float = None
     selected_source: str
     youtube_key: str
     ffmpeg_alive: Optional[bool] = False
@@ -58,6 +60,22 @@ class ServerStatus(BaseModel):
     noise_reduction: str = None
     stream1_url: str = None
     stream2_url: str = None
+    pipelines: Optional[Dict] = None
+    ffmpeg_progress: Optional[Dict] = None
+    restart_policy: Optional[Dict] = None
+    pipeline_resources: Optional[Dict] = None
+    pipeline_plans: Optional[Dict] = None
+    cpu_budget: Optional[float] = None
+    content_health: Optional[Dict] = None
+    channels: Optional[Dict] = None
+    # The default channel's status, repeated at the top level for older dashboards
+    switch_mode: str = None
+    stream_key: str = None
+    failover: Optional[Dict] = None
+    delay_buffer: Optional[Dict] = None
+    bitrate: Optional[Dict] = None
+    destinations: Optional[Dict] = None
+    lifecycle: Optional[Dict] = None
 
 from pydantic import BaseModel, Field, EmailStr
 from typing import List, Dict
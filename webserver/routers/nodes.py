@@ -0,0 +1,176 @@
+from fastapi import WebSocket, APIRouter
+from starlette.websockets import WebSocketDisconnect
+from typing import Dict
+from uuid import uuid4
+import asyncio
+from database import stream_servers_table
+from security import verify_node_secret
+from utils import dumps
+
+router = APIRouter()
+
+class NodeNotConnected(Exception):
+    pass
+
+class NodeConnection:
+    """
+    One stream server's control channel.
+
+    Everything we send goes through a bounded queue drained by a single
+    writer task, so a slow node pushes back on whoever is sending to it
+    instead of piling up frames in memory.
+    """
+
+    def __init__(self, websocket: WebSocket, server_uuid: str, queue_size: int = 100):
+        self.websocket = websocket
+        self.server_uuid = server_uuid
+        self.host = websocket.client.host if websocket.client else None
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.writer = asyncio.create_task(self.write_loop())
+
+    async def write_loop(self):
+        while True:
+            message = await self.queue.get()
+            await self.websocket.send_text(dumps(message).decode())
+
+    async def send(self, message: dict):
+        await self.queue.put(message)
+
+    async def request(self, method: str, data: dict = None, timeout: float = 10):
+        request_id = uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+
+        try:
+            await asyncio.wait_for(self.send({"type": "request", "id": request_id, "method": method, "data": data or {}}), timeout)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(request_id, None)
+
+    def resolve(self, message: dict):
+        future = self.pending.get(message.get("id"))
+        if future is None or future.done():
+            return
+
+        if message.get("ok"):
+            future.set_result(message.get("data"))
+        else:
+            future.set_exception(Exception(message.get("error", "Request failed")))
+
+    def close(self):
+        self.writer.cancel()
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(NodeNotConnected(self.server_uuid))
+
+class NodeManager:
+    def __init__(self):
+        self.connections: Dict[str, NodeConnection] = {}
+        self.handlers = {}
+
+    def on(self, method: str):
+        """ Register `handler(connection, data)` for requests and events with this method. """
+        def decorator(handler):
+            self.handlers[method] = handler
+            return handler
+        return decorator
+
+    def is_connected(self, server_uuid: str):
+        return server_uuid in self.connections
+
+    def connect(self, websocket: WebSocket, server_uuid: str):
+        """ Register the node's control channel, None if it already has one. """
+        if server_uuid in self.connections:
+            return None
+
+        connection = NodeConnection(websocket, server_uuid)
+        self.connections[server_uuid] = connection
+        return connection
+
+    def disconnect(self, connection: NodeConnection):
+        connection.close()
+        if self.connections.get(connection.server_uuid) is connection:
+            del self.connections[connection.server_uuid]
+
+    async def request(self, server_uuid: str, method: str, data: dict = None, timeout: float = 10):
+        connection = self.connections.get(server_uuid)
+        if not connection:
+            raise NodeNotConnected(server_uuid)
+        return await connection.request(method, data, timeout)
+
+    async def dispatch(self, connection: NodeConnection, message: dict):
+        kind = message.get("type")
+
+        if kind == "response":
+            connection.resolve(message)
+            return
+
+        handler = self.handlers.get(message.get("method"))
+
+        if kind == "event":
+            if handler:
+                await handler(connection, message.get("data") or {})
+            return
+
+        if kind == "request":
+            # Run requests on their own so a slow handler doesn't hold up the read loop
+            asyncio.create_task(self.answer(connection, handler, message))
+
+    async def answer(self, connection: NodeConnection, handler, message: dict):
+        response = {"type": "response", "id": message.get("id")}
+
+        try:
+            if not handler:
+                raise Exception(f"Unknown method {message.get('method')}")
+            response["data"] = await handler(connection, message.get("data") or {})
+            response["ok"] = True
+        except Exception as e:
+            response["ok"] = False
+            response["error"] = getattr(e, "detail", None) or str(e)
+
+        await connection.send(response)
+
+node_manager = NodeManager()
+
+def node_secret(websocket: WebSocket):
+    authorization = websocket.headers.get("authorization", "")
+    return authorization[len("Bearer "):] if authorization.startswith("Bearer ") else None
+
+@router.websocket("/ws/node/{server_uuid}")
+async def node_endpoint(websocket: WebSocket, server_uuid: str):
+    server = await stream_servers_table.find_one({"uuid": server_uuid})
+    if not server:
+        await websocket.close(code=4004)
+        return
+
+    # The uuid is no secret (it is the default stream key), the node has to prove who it is
+    if not verify_node_secret(node_secret(websocket), server.get("node_secret_hash")):
+        print(f"Rejected control channel for {server_uuid}, bad node secret")
+        await websocket.close(code=4003)
+        return
+
+    # A second connection never takes over the one that is up, a dead one is dropped by the ping timeout
+    if node_manager.is_connected(server_uuid):
+        print(f"Rejected control channel for {server_uuid}, already connected")
+        await websocket.close(code=4009)
+        return
+
+    await websocket.accept()
+    connection = node_manager.connect(websocket, server_uuid)
+    if connection is None:
+        await websocket.close(code=4009)
+        return
+    print(f"Node {server_uuid} connected from {connection.host}")
+
+    try:
+        while True:
+            message = await websocket.receive_json()
+            try:
+                await node_manager.dispatch(connection, message)
+            except Exception as e:
+                print(f"Node {server_uuid} message failed", e)
+    except WebSocketDisconnect:
+        print(f"Node {server_uuid} disconnected")
+    finally:
+        node_manager.disconnect(connection)
@@ -1,50 +1,327 @@
 from fastapi import WebSocket, APIRouter, Depends, HTTPException
 from starlette.websockets import WebSocketDisconnect
-from typing import List
+from typing import Dict, Set, Optional
+from collections import deque
+from uuid import uuid4
+import asyncio
+import os
+import time
 from security import get_current_user, get_user_from_token
 from models import User
+from backplane import create_backplane
+from database import stream_servers_table, users_table, PRIVATE_FIELDS
+from utils import ser, merge_delta, dumps, strip_keys, redact_urls
 
 router = APIRouter()
 
+# Frames a dashboard may fall behind before the slow client policy kicks in
+CLIENT_QUEUE_SIZE = int(os.getenv('WS_CLIENT_QUEUE_SIZE', "64"))
+# "drop_oldest" skips the stale frames, "disconnect" makes the client reconnect and catch up
+SLOW_CLIENT_POLICY = os.getenv('WS_SLOW_CLIENT_POLICY', "drop_oldest")
+# Frames kept per workspace for dashboards resuming after a reconnect
+REPLAY_LOG_SIZE = int(os.getenv('WS_REPLAY_LOG_SIZE', "500"))
+# Seconds a workspace's feed outlives its last dashboard, so a reconnect can still resume from it
+FEED_IDLE_SECONDS = int(os.getenv('WS_FEED_IDLE_SECONDS', "300"))
+
+# Messages that change a server document, their data is {"uuid", "changes"}
+SERVER_UPDATES = ("server_added", "server_online", "server_config")
+# Never sent over dashboard sockets, dashboards read them from GET /streamservers/{workspace_id}
+SECRET_FIELDS = ("youtube_key", "stream_key")
+# Shown, but the stream key in them is masked
+SECRET_URL_FIELDS = ("stream1_url", "stream2_url")
+# Not a dashboard frame: asks whoever broadcasts the workspace's statuses to send them whole next time
+STATUS_RESYNC = "status_resync"
+
+class WorkspaceFeed:
+    """
+    What dashboards of one workspace see: the current state of its servers
+    (documents plus their latest status) and the numbered frames that led
+    there.
+
+    A dashboard gets a snapshot when it connects, then every frame with a
+    sequence number. One that reconnects with the last number it saw gets
+    just the frames it missed from the replay log, as long as they are still
+    in it and it's talking to the same feed (`epoch`, new every time the
+    webserver starts).
+
+    Documents and statuses are kept and sent without SECRET_FIELDS, and with
+    the keys in SECRET_URL_FIELDS masked.
+    """
+
+    def __init__(self, workspace_uuid: str, log_size: int = REPLAY_LOG_SIZE):
+        self.workspace_uuid = workspace_uuid
+        self.epoch = uuid4().hex
+        self.seq = 0
+        self.log = deque(maxlen=log_size)  # (seq, serialized frame)
+        self.servers: Dict[str, dict] = {}
+        self.encoded: Dict[str, bytes] = {}  # Servers that haven't changed since they were last encoded
+        self.snapshot_cache = None  # (seq, frame)
+        self.loaded = False
+
+    async def load(self):
+        """ Fill in the server documents from the database, updates already applied in memory win. """
+        if self.loaded:
+            return
+        documents = await stream_servers_table.find({"workspace": self.workspace_uuid}, PRIVATE_FIELDS).to_list(None)
+        for document in redact_urls(strip_keys(ser(documents), SECRET_FIELDS), SECRET_URL_FIELDS):
+            self.servers[document["uuid"]] = merge_delta(document, self.servers.get(document["uuid"], {}))
+            self.encoded.pop(document["uuid"], None)
+        self.snapshot_cache = None
+        self.loaded = True
+
+    def apply(self, message: dict):
+        """ Update the state with `message`, number it and return the serialized frame. """
+        message = redact_urls(strip_keys(message, SECRET_FIELDS), SECRET_URL_FIELDS)
+        kind = message.get("type")
+        data = message.get("data") or {}
+        uuid = data.get("uuid")
+
+        if kind in SERVER_UPDATES:
+            self.servers[uuid] = merge_delta(self.servers.get(uuid, {"uuid": uuid}), data.get("changes", {}))
+            self.encoded.pop(uuid, None)
+        elif kind == "server_removed":
+            self.servers.pop(uuid, None)
+            self.encoded.pop(uuid, None)
+        elif kind == "status_report":
+            self.apply_status(data)
+        elif kind == "status_batch":
+            for report in data.get("reports", []):
+                self.apply_status(report)
+
+        self.seq += 1
+        text = dumps({**message, "seq": self.seq, "epoch": self.epoch}).decode()
+        self.log.append((self.seq, text))
+        return text
+
+    def apply_status(self, data: dict):
+        self.encoded.pop(data.get("uuid"), None)
+        server = self.servers.setdefault(data.get("uuid"), {"uuid": data.get("uuid")})
+        if data.get("replace"):
+            server["status"] = data.get("changes", {})
+        else:
+            server["status"] = merge_delta(server.get("status") or {}, data.get("changes", {}), data.get("removed"))
+
+    def snapshot(self):
+        """ The state as a snapshot frame, only servers that changed since the last one are encoded again. """
+        if self.snapshot_cache and self.snapshot_cache[0] == self.seq:
+            return self.snapshot_cache[1]
+
+        servers = []
+        for uuid, server in self.servers.items():
+            if uuid not in self.encoded:
+                self.encoded[uuid] = dumps(server)
+            servers.append(dumps(uuid) + b":" + self.encoded[uuid])
+
+        head = dumps({"type": "snapshot", "seq": self.seq, "epoch": self.epoch})[:-1]
+        text = (head + b',"data":{"servers":{' + b",".join(servers) + b"}}}").decode()
+        self.snapshot_cache = (self.seq, text)
+        return text
+
+    def replay(self, since: Optional[int], epoch: Optional[str]):
+        """ The frames after `since`, or None when they can't all be replayed and a snapshot is needed. """
+        if since is None or epoch != self.epoch or since > self.seq:
+            return None
+        if since < self.seq and (not self.log or self.log[0][0] > since + 1):
+            return None
+        return [text for seq, text in self.log if seq > since]
+
+class ClientConnection:
+    """
+    One dashboard socket.
+
+    Broadcasts only put the already serialized frame on a bounded queue, a
+    writer task per client does the sending. A client that can't keep up
+    loses its oldest frames (or is disconnected), it never holds up the
+    broadcast or the other clients.
+    """
+
+    def __init__(self, websocket: WebSocket, user: User, workspace_uuid: str,
+                 queue_size: int = CLIENT_QUEUE_SIZE, policy: str = SLOW_CLIENT_POLICY):
+        self.websocket = websocket
+        self.user = user
+        self.workspace_uuid = workspace_uuid
+        self.policy = policy
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.writer = asyncio.create_task(self.write_loop())
+
+    async def write_loop(self):
+        try:
+            while True:
+                text = await self.queue.get()
+                await self.websocket.send_text(text)
+        except Exception as e:
+            # Gone or broken, the read loop sees the disconnect and cleans up
+            print(f"Dashboard socket for {self.workspace_uuid} failed", e)
+            await self.close_socket()
+
+    def send(self, text: str):
+        """ Queue a serialized frame, never waits. Returns False when the client is cut off. """
+        if self.queue.full():
+            if self.policy == "disconnect":
+                print(f"Dashboard for {self.workspace_uuid} fell {self.queue.qsize()} frames behind, disconnecting")
+                asyncio.create_task(self.abort())
+                return False
+
+            self.queue.get_nowait()
+            self.dropped += 1
+
+        self.queue.put_nowait(text)
+        return True
+
+    async def abort(self):
+        self.writer.cancel()
+        await self.close_socket()
+
+    async def close_socket(self):
+        try:
+            await self.websocket.close(code=1013)  # Try again later
+        except Exception:
+            pass
+
+    def close(self):
+        self.writer.cancel()
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[dict] = []
+    """
+    Dashboard sockets connected to this worker. Broadcasts go through the
+    backplane, which hands every frame to each worker's `deliver`, so they
+    reach dashboards whichever worker they are connected to.
+
+    A worker only keeps feeds of workspaces it has dashboards for, dropping
+    them FEED_IDLE_SECONDS after the last one leaves. Statuses aren't
+    stored, so a new feed asks for them whole with a STATUS_RESYNC.
+    """
+
+    def __init__(self, backplane=None):
+        # workspace uuid -> its connected dashboards, a broadcast only touches its own workspace
+        self.workspaces: Dict[str, Set[ClientConnection]] = {}
+        self.connections: Dict[WebSocket, ClientConnection] = {}
+        self.feeds: Dict[str, WorkspaceFeed] = {}
+        self.idle_since: Dict[str, float] = {}  # workspace uuid -> when its last dashboard left
+        self.resync_handlers = []
+        self.backplane = backplane or create_backplane()
+
+    def on_resync(self, handler):
+        """ Register `handler(workspace_uuid)`, called when a new feed needs the workspace's statuses whole. """
+        self.resync_handlers.append(handler)
+        return handler
+
+    def feed(self, workspace_uuid: str):
+        if workspace_uuid not in self.feeds:
+            self.feeds[workspace_uuid] = WorkspaceFeed(workspace_uuid)
+        return self.feeds[workspace_uuid]
+
+    async def start(self):
+        await self.backplane.start(self.deliver)
 
-    async def connect(self, websocket: WebSocket, user: User, workspace_uuid: str):
+    async def stop(self):
+        await self.backplane.stop()
+
+    async def connect(self, websocket: WebSocket, user: User, workspace_uuid: str,
+                      since: Optional[int] = None, epoch: Optional[str] = None):
         await websocket.accept()
-        print("Appending", {"socket": websocket, "user": user, "workspace_uuid": workspace_uuid})
-        self.active_connections.append({"socket": websocket, "user": user, "workspace_uuid": workspace_uuid})
+        fresh = workspace_uuid not in self.feeds
+        feed = self.feed(workspace_uuid)
+        self.idle_since.pop(workspace_uuid, None)  # Not evicted while it loads
+        await feed.load()
+        if fresh:
+            await self.broadcast({"type": STATUS_RESYNC}, workspace_uuid)
+
+        # No awaits from here on, so nothing is broadcast between the catch up and subscribing
+        connection = ClientConnection(websocket, user, workspace_uuid)
+        missed = feed.replay(since, epoch)
+        if missed is None or len(missed) >= connection.queue.maxsize:
+            missed = [feed.snapshot()]
+        for text in missed:
+            connection.send(text)
+
+        self.connections[websocket] = connection
+        self.workspaces.setdefault(workspace_uuid, set()).add(connection)
+        return connection
 
     def disconnect(self, websocket: WebSocket):
-        print("depending", websocket)
-        self.active_connections = [conn for conn in self.active_connections if conn["socket"] != websocket]
+        connection = self.connections.pop(websocket, None)
+        if connection is None:
+            return
+
+        connection.close()
+        subscribers = self.workspaces.get(connection.workspace_uuid)
+        if subscribers is not None:
+            subscribers.discard(connection)
+            if not subscribers:
+                del self.workspaces[connection.workspace_uuid]
+                self.idle_since[connection.workspace_uuid] = time.monotonic()
+
+    def evict_idle(self):
+        """ Drop the feeds of workspaces nobody on this worker has watched for FEED_IDLE_SECONDS. """
+        now = time.monotonic()
+        for workspace_uuid, since in list(self.idle_since.items()):
+            if now - since > FEED_IDLE_SECONDS:
+                del self.idle_since[workspace_uuid]
+                self.feeds.pop(workspace_uuid, None)
 
     async def broadcast(self, message: dict, workspace_uuid: str):
-        print("Doing Broadcast", self.active_connections)
-        for conn in self.active_connections:
-            print("Conn", conn, conn["workspace_uuid"], "Looking for", workspace_uuid)
-            if conn["workspace_uuid"] == workspace_uuid:
-                await conn["socket"].send_json(message)
+        await self.backplane.publish(workspace_uuid, message)
+
+    async def deliver(self, workspace_uuid: str, message: dict):
+        """ Number `message` in the workspace's feed and queue it for this worker's dashboards. """
+        if message.get("type") == STATUS_RESYNC:
+            for handler in self.resync_handlers:
+                handler(workspace_uuid)
+            return
+
+        self.evict_idle()
+        feed = self.feeds.get(workspace_uuid)
+        if feed is None:
+            # Nobody here watches it, a dashboard connecting later loads the feed fresh
+            return
+
+        # Serialized once however many dashboards are watching
+        text = feed.apply(message)
+
+        subscribers = self.workspaces.get(workspace_uuid)
+        if not subscribers:
+            return
+
+        for connection in list(subscribers):
+            if not connection.send(text):
+                self.disconnect(connection.websocket)
 
 manager = ConnectionManager()
 
+async def can_access_workspace(user: str, workspace_uuid: str):
+    user_data = await users_table.find_one({"email": user}, {"_id": 0, "password": 0})
+    if not user_data:
+        return False
+    return user_data.get("role") == "admin" or workspace_uuid in (user_data.get("workspaces") or [])
+
 @router.websocket("/ws/updates/{workspace_uuid}")
 async def websocket_endpoint(websocket: WebSocket, workspace_uuid: str):
-    print("End point")
     token = websocket.query_params.get('token')
     if not token:
         await websocket.close(code=4001)
         return
     try:
         user_id = await get_user_from_token(token)
-        await manager.connect(websocket, user_id, workspace_uuid)  # Properly use the connect method
+    except HTTPException:
+        await websocket.close(code=4001)
+        return
+
+    # Same check as GET /streamservers/{workspace_id}, before anything about the workspace is sent
+    if not await can_access_workspace(user_id, workspace_uuid):
+        await websocket.close(code=4003)
+        return
+
+    try:
+        since = websocket.query_params.get('since')
+        epoch = websocket.query_params.get('epoch')
+        await manager.connect(websocket, user_id, workspace_uuid, int(since) if since and since.isdigit() else None, epoch)
         print(f"User {user_id} connected to workspace {workspace_uuid}")
         while True:
             data = await websocket.receive_text()
             # Process incoming messages, if any
     except WebSocketDisconnect:
-        manager.disconnect(websocket)  # Ensure disconnection is also handled through the manager
         print(f"User {user_id} disconnected")
-    except HTTPException as e:
-        await websocket.send_text(str(e.detail))
-        await websocket.close(code=e.status_code)
\ No newline at end of file
+    finally:
+        manager.disconnect(websocket)
@@ -4,23 +4,27 @@ from pydantic import BaseModel
 from typing import Optional
 import httpx
 from models import StreamServer, ServerStatus
-from security import get_current_user
+from security import get_current_user, hash_node_secret
 from uuid import uuid4, UUID
 import datetime
 import os
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.backends import default_backend
-from database import stream_servers_table, users_table
+from database import stream_servers_table, users_table, PRIVATE_FIELDS
 import base64
+import secrets
 from routers.sockets import manager
-from utils import ser
+from routers.nodes import node_manager, NodeNotConnected
+from utils import ser, get_size, merge_delta, diff, FastJSONResponse
+from coalescer import StatusCoalescer
+import asyncio
 
 # Define the user data script
 user_data_script = """#!/bin/bash
 wget https://raw.githubusercontent.com/WhiskeyDeltaX/FlowRecaster/main/streamserver/update.sh
 chmod +x update.sh
-./update.sh {uuid} {host_url} {fqdn} {zone_id} {api_token} {server_ip} {stream_key} {youtube_key} {backup_mp4} > /stream_report.txt
+./update.sh {uuid} {host_url} {fqdn} {zone_id} {api_token} {server_ip} {stream_key} {youtube_key} {backup_mp4} {node_secret} > /stream_report.txt
 """
 
 router = APIRouter()
@@ -215,8 +219,8 @@ async def get_streamservers(workspace_id: str, user: dict = Depends(get_current_
     if user_data and (user_data["role"] != "admin" and workspace_id not in user_data["workspaces"]):
         raise HTTPException(status_code=401, detail="Access to the workspace is denied")
 
-    streamservers = await stream_servers_table.find({"workspace": str(workspace_id)}).to_list(None)
-    return ser(streamservers)
+    streamservers = await stream_servers_table.find({"workspace": str(workspace_id)}, PRIVATE_FIELDS).to_list(None)
+    return FastJSONResponse(streamservers)
 
 @router.post("/streamservers/", status_code=status.HTTP_201_CREATED)
 async def create_streamserver(server: StreamServer, user: dict = Depends(get_current_user)):
@@ -244,6 +248,9 @@ async def create_streamserver(server: StreamServer, user: dict = Depends(get_cur
     print("FWG", firewall_group_id)
     plan = "vc2-1c-1gb"
 
+    # The node authenticates its control channel with this, only the hash is kept here
+    node_secret = secrets.token_urlsafe(32)
+
     async with httpx.AsyncClient() as client:
         response = await client.post(
             "https://api.vultr.com/v2/instances",
@@ -262,7 +269,8 @@ async def create_streamserver(server: StreamServer, user: dict = Depends(get_cur
                     zone_id=CF_ZONE_ID, api_token=CF_API_TOKEN,
                     server_ip=PUBLIC_IP, stream_key=server.stream_key,
                     youtube_key=server.youtube_key or "None",
-                    backup_mp4=BACKUP_MP4_URL
+                    backup_mp4=BACKUP_MP4_URL,
+                    node_secret=node_secret
                 ).encode()).decode('utf-8')
             },
             headers={"Authorization": f"Bearer {VULTR_API_KEY}"}
@@ -294,8 +302,10 @@ async def create_streamserver(server: StreamServer, user: dict = Depends(get_cur
 
         server.is_youtube_streaming = False
 
-        await stream_servers_table.insert_one(server.dict())
-        return ser(server.dict())
+        await stream_servers_table.insert_one({**server.dict(), "node_secret_hash": hash_node_secret(node_secret)})
+        document = ser(server.dict())
+        await manager.broadcast({"type": "server_added", "data": {"uuid": server.uuid, "changes": document}}, server.workspace)
+        return FastJSONResponse(document, status_code=status.HTTP_201_CREATED)
 
 class UpdateStreamServer(BaseModel):
     label: Optional[str] = None
@@ -305,43 +315,35 @@ class UpdateStreamServer(BaseModel):
 
 @router.put("/streamservers/{server_id}")
 async def update_streamserver(server_id: str, update_data: UpdateStreamServer, user: dict = Depends(get_current_user)):
-    server = await stream_servers_table.find_one({"uuid": str(server_id)})
+    server = await stream_servers_table.find_one({"uuid": str(server_id)}, PRIVATE_FIELDS)
     user_data = await users_table.find_one({"email": user}, {"_id": 0, "password": 0})
 
-    if not server or (user_data["role"] != "admin" and server.workspace not in user_data["workspaces"]):
+    if not server or (user_data["role"] != "admin" and server["workspace"] not in user_data["workspaces"]):
         raise HTTPException(status_code=404, detail="Server not found or access denied")
 
     update_data = update_data.dict(exclude_unset=True)
 
     if update_data:
-        await stream_servers_table.update_one(
-            {"uuid": str(server_id)},
-            {"$set": update_data}
-        )
-
-        changes_detected = False
         config_changes = []
 
         for key in ["stream_key", "youtube_key", "noise_reduction"]:
             if key in update_data and update_data[key] != server.get(key):
-                changes_detected = True
                 config_changes.append({"configKey": key, "configValue": update_data[key]})
 
-        if changes_detected:
-            # Send the updated config to the streaming server
-            streaming_server_url = f"https://{server['fqdn']}/set-config/"
-            async with httpx.AsyncClient() as client:
-                response = await client.post(streaming_server_url, json={"config": config_changes})
-                print("Got response", response)
-                if response.status_code != 200:
-                    raise HTTPException(status_code=500, detail="Failed to update streaming server configuration")
+        # The node first, so a change it refused is never stored or shown to dashboards
+        if config_changes and not await send_node_command(server, "set_config", "set-config", {"config": config_changes}):
+            raise HTTPException(status_code=500, detail="Failed to update streaming server configuration")
+
+        await stream_servers_table.update_one(
+            {"uuid": str(server_id)},
+            {"$set": update_data}
+        )
 
-        server["label"] = update_data["label"]
-        server["stream_key"] = update_data["stream_key"]
-        server["youtube_key"] = update_data["youtube_key"]
-        server["noise_reduction"] = update_data["noise_reduction"]
+        await manager.broadcast({"type": "server_config", "data": {"uuid": server["uuid"], "changes": ser(update_data)}}, server["workspace"])
 
-    return ser(server)
+        server.update(update_data)
+
+    return FastJSONResponse(server)
 
 async def delete_dns_record(client, fqdn):
     # Retrieve the DNS record ID
@@ -391,8 +393,32 @@ async def delete_streamserver(server_id: str, user: dict = Depends(get_current_u
             print("Vultr failed to delete", e)
 
         await stream_servers_table.delete_one({"uuid": str(server_id)})
+        await manager.broadcast({"type": "server_removed", "data": {"uuid": server["uuid"]}}, server["workspace"])
         return {"message": "Server deleted"}
 
+async def send_node_command(server, method: str, path: str, data: dict = None) -> bool:
+    """ Send a command to a stream server over its control channel, or over HTTPS if it isn't connected. """
+    if node_manager.is_connected(server["uuid"]):
+        try:
+            response = await node_manager.request(server["uuid"], method, data)
+            print("Got response", response)
+            return True
+        except NodeNotConnected:
+            pass
+        except Exception as e:
+            print(f"Command {method} failed", e)
+            return False
+
+    url = f"https://{server['fqdn']}/{path}/"
+    async with httpx.AsyncClient() as client:
+        if data is None:
+            response = await client.get(url)
+        else:
+            response = await client.post(url, json=data)
+
+        print("Got response", response.text)
+        return response.status_code < 400
+
 @router.post("/streamservers/server_online")
 async def server_online(request: Request):
     data = await request.json()
@@ -400,6 +426,18 @@ async def server_online(request: Request):
     
     print("UUID:", server_uuid, "data", data)
 
+    if await mark_server_online(server_uuid, request.client.host):
+        return JSONResponse(status_code=200, content={"message": "Server status updated successfully."})
+    else:
+        return JSONResponse(status_code=500, content={"message": "Failed to update server status."})
+
+@node_manager.on("server_online")
+async def node_server_online(connection, data):
+    if not await mark_server_online(connection.server_uuid, connection.host):
+        raise HTTPException(status_code=500, detail="Failed to update server status.")
+    return {"message": "Server status updated successfully."}
+
+async def mark_server_online(server_uuid: str, host: str) -> bool:
     if not server_uuid:
         raise HTTPException(status_code=400, detail="Server UUID is required.")
 
@@ -408,14 +446,14 @@ async def server_online(request: Request):
     if not server:
         raise HTTPException(status_code=404, detail="Server not found.")
 
-    print("HOST IP?", request.client.host)
+    print("HOST IP?", host)
 
     # Update server data
     update_data = {
         "$set": {
             "last_heartbeat": datetime.datetime.utcnow(),
             "last_boot": datetime.datetime.utcnow(),
-            "ip": request.client.host,
+            "ip": host,
             "online": True
         }
     }
@@ -438,14 +476,70 @@ async def server_online(request: Request):
     print("Server Online", server)
 
     if result.modified_count == 1:
-        await manager.broadcast({"type": "server_online", "data": ser(server)}, server["workspace"])
-        return JSONResponse(status_code=200, content={"message": "Server status updated successfully."})
-    else:
-        return JSONResponse(status_code=500, content={"message": "Failed to update server status."})
+        await manager.broadcast({"type": "server_online", "data": {"uuid": server_uuid, "changes": ser(update_data["$set"])}}, server["workspace"])
+        return True
+    return False
 
 @router.post("/streamservers/report_status")
 async def report_status(status: ServerStatus):
+    # Posted whole, and possibly to another worker than the last one, so dashboards get it whole too
+    await handle_status_report(status, replace=True)
+    return {"message": "Status reported successfully"}
+
+# Last merged status and sequence number per node, for applying status deltas
+# Last status sent to dashboards per workspace and node, dashboards get what changed since
+# Last status sent to dashboards per node, dashboards get what changed since
+broadcast_statuses = {}
+
+@node_manager.on("status_report")
+async def node_status_report(connection, data):
+    server_uuid = connection.server_uuid
+
+    if data.get("kind") == "delta":
+        previous = latest_statuses.get(server_uuid)
+        if not previous or previous["seq"] != data.get("base"):
+            # We missed a message, ask the node for a new snapshot
+            latest_statuses.pop(server_uuid, None)
+            asyncio.create_task(request_status_resync(server_uuid))
+            return
+        status = merge_delta(previous["status"], data.get("changes", {}), data.get("removed"))
+    else:
+        status = data.get("status", data)
+
+    status["server_uuid"] = server_uuid
+    latest_statuses[server_uuid] = {"seq": data.get("seq"), "status": status}
+
+    await handle_status_report(ServerStatus(**status), replace=data.get("kind") != "delta")
+
+@node_manager.on("report_failure")
+async def node_report_failure(connection, data):
+    print("Failure reported by", connection.server_uuid, data)
+    server = await stream_servers_table.find_one({"uuid": connection.server_uuid})
+    if server:
+        await manager.broadcast({"type": "failure_report", "data": {"uuid": connection.server_uuid, "failure": data}}, server["workspace"])
+
+@node_manager.on("bitrate_step")
+async def node_bitrate_step(connection, data):
+    print("Bitrate step on", connection.server_uuid, data)
+    server = await stream_servers_table.find_one({"uuid": connection.server_uuid})
+    if server:
+        await manager.broadcast({"type": "bitrate_step", "data": {"uuid": connection.server_uuid, "step": data}}, server["workspace"])
+
+async def request_status_resync(server_uuid: str):
+    try:
+        await node_manager.request(server_uuid, "status_resync")
+    except Exception as e:
+        print(f"Status resync for {server_uuid} failed", e)
+
+async def handle_status_report(status: ServerStatus, replace: bool = False):
     print("Checking", status.server_uuid)
+
+    # Nodes reporting over the control channel only send raw byte rates
+    if status.bytes_sent is None and status.bytes_sent_raw is not None:
+        status.bytes_sent = get_size(status.bytes_sent_raw)
+    if status.bytes_recv is None and status.bytes_recv_raw is not None:
+        status.bytes_recv = get_size(status.bytes_recv_raw)
+
     # Check if the server_uuid exists in the stream_servers_table
     server = await stream_servers_table.find_one({"uuid": status.server_uuid})
     if not server or not server["online"]:
@@ -460,16 +554,48 @@ async def report_status(status: ServerStatus):
 
     # Insert the status document into the stream_servers_status_table
     # stream_servers_status_table.insert_one(status)
-    await manager.broadcast({"type": "status_report", "data": {"uuid": status["server_uuid"], "status": ser(status)}}, server["workspace"])
+    await status_coalescer.add(server["workspace"], status["server_uuid"], ser(status), replace)
+
+async def broadcast_statuses_of(workspace_uuid: str, reports: dict):
+    """ One frame with what changed for every server that reported during the coalescing window. """
+    batch = []
+    sent = broadcast_statuses.setdefault(workspace_uuid, {})
+    for server_uuid, (report, replace) in reports.items():
+        previous = sent.get(server_uuid)
+        sent[server_uuid] = report
+
+        data = {"uuid": server_uuid}
+        if replace or previous is None:
+            data.update(replace=True, changes=report)
+        else:
+            changes, removed = diff(previous, report)
+            data["changes"] = changes
+            if removed:
+                data["removed"] = removed
+        batch.append(data)
+
+    if len(batch) == 1:
+        await manager.broadcast({"type": "status_report", "data": batch[0]}, workspace_uuid)
+    else:
+        await manager.broadcast({"type": "status_batch", "data": {"reports": batch}}, workspace_uuid)
 
-    return {"message": "Status reported successfully"}
+status_coalescer = StatusCoalescer(broadcast_statuses_of)
+
+@manager.on_resync
+def resend_statuses(workspace_uuid: str):
+    # A dashboard feed started without statuses, the next broadcast sends them whole
+    broadcast_statuses.pop(workspace_uuid, None)
+
+@router.get("/broadcast/stats")
+async def get_broadcast_stats(user: dict = Depends(get_current_user)):
+    return status_coalescer.stats()
 
 class StreamServerStream(BaseModel):
     status: bool = False
 
 @router.post("/streamservers/streaming/{server_id}")
 async def streamserver_streaming(server_id: str, status_data: StreamServerStream, user: dict = Depends(get_current_user)):
-    server = await stream_servers_table.find_one({"uuid": str(server_id)})
+    server = await stream_servers_table.find_one({"uuid": str(server_id)}, PRIVATE_FIELDS)
     user_data = await users_table.find_one({"email": user}, {"_id": 0, "password": 0})
 
     if not server or (user_data["role"] != "admin" and server.workspace not in user_data["workspaces"]):
@@ -478,28 +604,24 @@ async def streamserver_streaming(server_id: str, status_data: StreamServerStream
     print("Changing to status", status_data.status)
 
     if status_data.status:
-        url = f"https://{server['fqdn']}/start-youtube-stream/"
+        succeeded = await send_node_command(server, "start_youtube_stream", "start-youtube-stream")
     else:
-        url = f"https://{server['fqdn']}/stop-youtube-stream/"
-
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url)
+        succeeded = await send_node_command(server, "stop_youtube_stream", "stop-youtube-stream")
 
-        print("Response", response.text)
+    if not succeeded:
+        print("YouTube stream failed to start")
+        status_data.status = False
 
-        if response.status_code > 399:
-            print("YouTube stream failed to start")
-            status_data.status = False
-
-        update_data = {
-            "is_youtube_streaming": status_data.status
-        }
+    update_data = {
+        "is_youtube_streaming": status_data.status
+    }
 
-        await stream_servers_table.update_one(
-            {"uuid": str(server_id)},
-            {"$set": update_data}
-        )
+    await stream_servers_table.update_one(
+        {"uuid": str(server_id)},
+        {"$set": update_data}
+    )
 
-        server["is_youtube_streaming"] = status_data.status
+    server["is_youtube_streaming"] = status_data.status
+    await manager.broadcast({"type": "server_config", "data": {"uuid": server["uuid"], "changes": update_data}}, server["workspace"])
 
-        return ser(server)
+    return FastJSONResponse(server)
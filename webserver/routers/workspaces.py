@@ -7,7 +7,7 @@ import os
 from security import get_current_user
 from database import workspaces_table, users_table
 from models import Workspace
-from utils import ser
+from utils import FastJSONResponse
 
 router = APIRouter()
 
@@ -21,13 +21,13 @@ async def create_workspace(workspace: Workspace, user: dict = Depends(get_curren
 
     result = await workspaces_table.insert_one(workspace_dict)
     if result.inserted_id:
-        return JSONResponse(status_code=status.HTTP_201_CREATED, content=ser(workspace_dict))
+        return FastJSONResponse(workspace_dict, status_code=status.HTTP_201_CREATED)
     raise HTTPException(status_code=500, detail="Workspace could not be created")
 
 @router.get("/workspaces", response_description="List all workspaces")
 async def list_workspaces(user: dict = Depends(get_current_user)):
     workspaces = await workspaces_table.find({}).to_list(None)
-    return ser(workspaces)
+    return FastJSONResponse(workspaces)
 
 @router.get("/workspaces/{workspace_uuid}", response_model=Workspace, response_description="Get a single workspace")
 async def get_workspace(workspace_uuid: str, user: dict = Depends(get_current_user)):
@@ -52,7 +52,7 @@ async def update_workspace(workspace_id: str, workspace: Workspace, user: dict =
     result = await workspaces_table.update_one({"uuid": workspace_id}, {"$set": workspace_dict})
     if result.modified_count == 1:
         updated_workspace = await workspaces_table.find_one({"uuid": workspace_id})
-        return ser(updated_workspace)
+        return FastJSONResponse(updated_workspace)
     raise HTTPException(status_code=404, detail="Workspace not found")
 
 @router.delete("/workspaces/{workspace_id}", response_description="Delete a workspace")
@@ -1,4 +1,6 @@
 from passlib.context import CryptContext
+import hashlib
+import hmac
 from dotenv import load_dotenv
 from typing import Optional
 from datetime import datetime, timedelta
@@ -60,6 +62,20 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def hash_node_secret(secret: str) -> str:
+    """
+    Hash a node secret for storing. It is random and long, so a plain hash is enough.
+    """
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+def verify_node_secret(secret: str, hashed_secret: str) -> bool:
+    """
+    Verify the secret a node presents against the stored hash
+    """
+    if not secret or not hashed_secret:
+        return False
+    return hmac.compare_digest(hash_node_secret(secret), hashed_secret)
+
 def hash_password(password: str) -> str:
     """
     Hash a password for storing.